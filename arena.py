@@ -0,0 +1,777 @@
+# Flat, array-backed form of the AST of code1.py.
+#
+# An Arena holds a program as a struct of arrays, one entry per node, in
+# postorder: a node's children always come before it. A pass over a whole
+# program is then a loop over a few contiguous arrays of machine ints rather
+# than a walk through objects spread over the heap, and saving or loading one
+# is a handful of bulk copies.
+#
+#   kind       array('B')  what the node is, one of the kind codes below
+#   data       array('i')  BinOp: its operator, an index into `operators`;
+#                          literals and Variable: the index of their value in
+#                          `constants`; 0 for every other node
+#   first      array('i')  node i's children are links[first[i]:first[i + 1]]
+#   links      array('i')  child node indices, in field order. The one list
+#                          field a node may have (Seq.body, FunCall.args,
+#                          LetFun.params) is laid out in place; its length is
+#                          whatever the other fields leave over
+#   constants  list        the literal values and names, each stored once
+#
+# A subtree that is shared in the dataclass form (the same e2 used twice, say)
+# is stored once in the arena as well.
+#
+# arena_eval, ArenaTypeChecker and arena_fold work on the arrays directly, with
+# the semantics of eval, TypeChecker and optimizer.fold. BinOps, concatenations
+# and slices are evaluated with an explicit stack, so a long chain of them
+# (a + a + ... + a) needs no Python recursion, and arena_fold is a single loop
+# over the nodes.
+
+from array import array
+from dataclasses import fields
+from fractions import Fraction
+import marshal
+import operator
+import struct
+import sys
+
+from code1 import (NumLiteral, BoolLiteral, StringLiteral, BinOp, Variable, Let, LetMut,
+                   if_else, while_loop, for_loop, Break, Continue, Two_Str_concatenation,
+                   Str_slicing, Seq, Put, Get, Assign, Print, LetFun, FunCall, LetAnd, UBoolOp,
+                   NumType, BoolType, StringType, UnitType, FnObject, TailCall, Environment,
+                   InvalidProgram, BreakLoop, ContinueLoop, call_frame, unify, divide,
+                   as_number, as_str, is_string, concat, slice_string, example_programs)
+
+
+# Kind codes. The ones up to SLICE are evaluated without recursion (see
+# operate), and the ones up to VARIABLE keep their value in the constant pool.
+NUM = 0
+BOOL = 1
+STRING = 2
+VARIABLE = 3
+GET = 4
+BINOP = 5
+CONCAT = 6
+SLICE = 7
+IF = 8
+LET = 9
+LETMUT = 10
+SEQ = 11
+PUT = 12
+ASSIGN = 13
+WHILE = 14
+FOR = 15
+BREAK = 16
+CONTINUE = 17
+PRINT = 18
+LETFUN = 19
+FUNCALL = 20
+LETAND = 21
+UBOOL = 22
+
+classes = (NumLiteral, BoolLiteral, StringLiteral, Variable, Get, BinOp, Two_Str_concatenation,
+           Str_slicing, if_else, Let, LetMut, Seq, Put, Assign, while_loop, for_loop, Break,
+           Continue, Print, LetFun, FunCall, LetAnd, UBoolOp)
+kinds = {cls: k for k, cls in enumerate(classes)}
+
+operators = ("+", "-", "*", "/", "<", ">", "==", "=")
+operator_codes = {op: k for k, op in enumerate(operators)}
+# what eval does for each operator; it has no case for "=", which only typechecks
+functions = (operator.add, operator.sub, operator.mul, divide, operator.lt, operator.gt,
+             operator.eq, None)
+
+# the fields that hold a plain value (kept in `data`) rather than a node
+value_fields = {NumLiteral: "value", BoolLiteral: "value", StringLiteral: "word",
+                Variable: "name", BinOp: "operator"}
+list_fields = {Seq: "body", FunCall: "args", LetFun: "params"}
+# for each kind, the names of the fields that hold nodes, in order
+layouts = tuple(tuple(f.name for f in fields(cls) if f.name not in (value_fields.get(cls), "type"))
+                for cls in classes)
+
+# TypeChecker's types, as stored in an arena's types column
+types = (None, NumType(), BoolType(), StringType(), UnitType())
+type_codes = {t: k for k, t in enumerate(types)}
+
+MAGIC = b"ARN1"
+HEADER = struct.Struct("<4sIII")     # magic, nodes, links, root
+
+
+class Arena:
+    def __init__(self):
+        self.kind = array("B")
+        self.data = array("i")
+        self.first = array("i", [0])
+        self.links = array("i")
+        self.constants = []
+        self.constant_index = {}
+        self.root = -1
+        # filled in by ArenaTypeChecker, one code from `types` per node
+        self.types = None
+
+    def __len__(self):
+        return len(self.kind)
+
+    def constant(self, value) -> int:
+        # True == 1 and hash alike, so the type is part of the key
+        key = (type(value), value)
+        k = self.constant_index.get(key)
+        if k is None:
+            k = self.constant_index[key] = len(self.constants)
+            self.constants.append(value)
+        return k
+
+    def add(self, kind, data, children) -> int:
+        # children must already be in the arena; the new node is the root
+        # until another one is added
+        self.kind.append(kind)
+        self.data.append(data)
+        self.links.extend(children)
+        self.first.append(len(self.links))
+        self.root = len(self.kind) - 1
+        return self.root
+
+    def children(self, i):
+        return self.links[self.first[i]:self.first[i + 1]]
+
+    def value(self, i):
+        return self.constants[self.data[i]]
+
+    def name(self, i) -> str:
+        # the name of Variable node i, where the language expects one
+        if self.kind[i] != VARIABLE:
+            raise InvalidProgram()
+        return self.constants[self.data[i]]
+
+    def compact(self) -> 'Arena':
+        # a copy with only the nodes and constants the root still uses
+        kind, data, first, links = self.kind, self.data, self.first, self.links
+        live = bytearray(len(kind))
+        live[self.root] = 1
+        for i in range(self.root, -1, -1):
+            if live[i]:
+                for j in links[first[i]:first[i + 1]]:
+                    live[j] = 1
+        out = Arena()
+        moved = array("i", [0]) * len(kind)
+        for i in range(self.root + 1):
+            if live[i]:
+                k = kind[i]
+                d = out.constant(self.constants[data[i]]) if k <= VARIABLE else data[i]
+                moved[i] = out.add(k, d, [moved[j] for j in links[first[i]:first[i + 1]]])
+        return out
+
+    def dumps(self) -> bytes:
+        # the header, the four columns as they are in memory and the constants
+        columns = [self.kind, self.data, self.first, self.links]
+        if sys.byteorder == "big":
+            columns = [array(c.typecode, c) for c in columns]
+            for c in columns:
+                c.byteswap()
+        # marshal has no Fraction; no other constant is a tuple
+        constants = [(c.numerator, c.denominator) if type(c) is Fraction else c for c in self.constants]
+        return b"".join([HEADER.pack(MAGIC, len(self.kind), len(self.links), self.root)]
+                        + [c.tobytes() for c in columns] + [marshal.dumps(constants)])
+
+    @classmethod
+    def loads(cls, data: bytes) -> 'Arena':
+        magic, n, m, root = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("not an arena")
+        arena = cls()
+        view = memoryview(data)
+        pos = HEADER.size
+        for column, count in ((arena.kind, n), (arena.data, n), (arena.first, n + 1), (arena.links, m)):
+            del column[:]
+            size = count * column.itemsize
+            column.frombytes(view[pos:pos + size])
+            if sys.byteorder == "big":
+                column.byteswap()
+            pos += size
+        for value in marshal.loads(view[pos:]):
+            arena.constant(as_number(Fraction(*value)) if type(value) is tuple else value)
+        arena.root = root
+        return arena
+
+    def save(self, path):
+        with open(path, "wb") as file:
+            file.write(self.dumps())
+
+    @classmethod
+    def load(cls, path) -> 'Arena':
+        with open(path, "rb") as file:
+            return cls.loads(file.read())
+
+
+def child_nodes(node, kind):
+    for name in layouts[kind]:
+        value = getattr(node, name)
+        if type(value) is list:
+            yield from value
+        else:
+            yield value
+
+
+def from_tree(program) -> Arena:
+    arena = Arena()
+    index = {}      # id(node) -> its index in the arena
+    # (node, expanded): a node is visited twice, first to schedule its
+    # children and then, once they are in the arena, itself
+    todo = [(program, False)]
+    while todo:
+        node, expanded = todo.pop()
+        if id(node) in index:
+            continue
+        kind = kinds.get(type(node))
+        if kind is None:
+            raise InvalidProgram()
+        if not expanded:
+            todo.append((node, True))
+            todo.extend((child, False) for child in reversed(list(child_nodes(node, kind))))
+            continue
+        if kind <= VARIABLE:
+            data = arena.constant(getattr(node, value_fields[classes[kind]]))
+        elif kind == BINOP:
+            if node.operator not in operator_codes:
+                raise InvalidProgram()
+            data = operator_codes[node.operator]
+        else:
+            data = 0
+        index[id(node)] = arena.add(kind, data, [index[id(child)] for child in child_nodes(node, kind)])
+    return arena
+
+
+def to_tree(arena: Arena):
+    kind, data, first, links, constants = arena.kind, arena.data, arena.first, arena.links, arena.constants
+    built = []
+    for i in range(arena.root + 1):
+        k = kind[i]
+        nodes = [built[j] for j in links[first[i]:first[i + 1]]]
+        if k <= VARIABLE:
+            node = classes[k](constants[data[i]])
+        elif k == BINOP:
+            node = BinOp(operators[data[i]], nodes[0], nodes[1])
+        else:
+            cls = classes[k]
+            names = layouts[k]
+            if cls in list_fields:
+                # the list takes what the other fields leave over
+                at = names.index(list_fields[cls])
+                end = len(nodes) - (len(names) - 1 - at)
+                nodes[at:end] = [nodes[at:end]]
+            node = cls(*nodes)
+        built.append(node)
+    return built[arena.root]
+
+
+# Evaluation
+
+def arena_eval(arena: Arena, environment: Environment = None):
+    if environment is None:
+        environment = Environment()
+    return as_str(evaluate(arena, arena.root, environment))
+
+
+def operate(arena, i, environment):
+    # A BinOp, concatenation or slice, with the nodes under it of those kinds
+    # too, evaluated with a stack of its own. A node of any other kind is
+    # handed to evaluate. todo holds i to evaluate node i and ~i to apply it
+    # to the values of its children, which are then on top of `values`.
+    kind, data, first, links, constants = arena.kind, arena.data, arena.first, arena.links, arena.constants
+    values = []
+    todo = [i]
+    while todo:
+        i = todo.pop()
+        if i < 0:
+            i = ~i
+            k = kind[i]
+            if k == BINOP:
+                right = values.pop()
+                values[-1] = functions[data[i]](values[-1], right)
+            elif k == CONCAT:
+                right = values.pop()
+                values[-1] = concat(values[-1], right)
+            else:
+                end = values.pop()
+                start = values.pop()
+                values[-1] = slice_string(values[-1], start, end)
+            continue
+        k = kind[i]
+        if k <= STRING:
+            values.append(constants[data[i]])
+        elif k == VARIABLE:
+            values.append(environment.get(constants[data[i]]))
+        elif k == GET:
+            values.append(environment.get(arena.name(links[first[i]])))
+        elif k <= SLICE:
+            if k == BINOP and functions[data[i]] is None:
+                raise InvalidProgram()
+            todo.append(~i)
+            todo.extend(reversed(links[first[i]:first[i + 1]]))
+        else:
+            values.append(evaluate(arena, i, environment))
+    return values[0]
+
+
+def bind(environment, name, value):
+    if environment.check(name):
+        environment.update(name, value)
+    else:
+        environment.add(name, value)
+
+
+def evaluate(arena: Arena, i: int, environment: Environment, tail: bool = False):
+    # tail: as for code1.evaluate, a FunCall here returns a TailCall
+    k = arena.kind[i]
+    if k <= SLICE:
+        return operate(arena, i, environment)
+    links = arena.links
+    f = arena.first[i]
+    e = arena.first[i + 1]
+    if k == IF:
+        if evaluate(arena, links[f], environment) == True:
+            return evaluate(arena, links[f + 1], environment, tail)
+        return evaluate(arena, links[f + 2], environment, tail)
+    if k == LET or k == LETMUT:
+        name = arena.name(links[f])
+        v1 = evaluate(arena, links[f + 1], environment)
+        environment.enter_scope()
+        environment.add(name, v1)
+        v2 = evaluate(arena, links[f + 2], environment, tail)
+        environment.exit_scope()
+        return v2
+    if k == SEQ:
+        if f == e:
+            return None
+        for j in links[f:e - 1]:
+            evaluate(arena, j, environment)
+        return evaluate(arena, links[e - 1], environment, tail)
+    if k == PUT:
+        name = arena.name(links[f])
+        environment.update(name, evaluate(arena, links[f + 1], environment))
+        return environment.get(name)
+    if k == ASSIGN:
+        name = arena.name(links[f])
+        environment.add(name, evaluate(arena, links[f + 1], environment))
+        return name
+    if k == WHILE:
+        condition, body = links[f], links[f + 1]
+        depth = len(environment.env)
+        while evaluate(arena, condition, environment) == True:
+            try:
+                evaluate(arena, body, environment)
+            except BreakLoop:
+                environment.unwind(depth)
+                break
+            except ContinueLoop:
+                environment.unwind(depth)
+        return None
+    if k == FOR:
+        name = arena.name(links[f])
+        condition, updt, body = links[f + 2], links[f + 3], links[f + 4]
+        bind(environment, name, evaluate(arena, links[f + 1], environment))
+        depth = len(environment.env)
+        while evaluate(arena, condition, environment) == True:
+            try:
+                evaluate(arena, body, environment)
+            except BreakLoop:
+                environment.unwind(depth)
+                break
+            except ContinueLoop:
+                environment.unwind(depth)
+            environment.update(name, evaluate(arena, updt, environment))
+        return None
+    if k == BREAK:
+        raise BreakLoop()
+    if k == CONTINUE:
+        raise ContinueLoop()
+    if k == PRINT:
+        v = evaluate(arena, links[f], environment)
+        print(v)
+        return v
+    if k == LETFUN:
+        # the body of the function is a node index; arena functions are not memoized
+        name = arena.name(links[f])
+        params = [Variable(arena.name(j)) for j in links[f + 1:e - 2]]
+        environment.enter_scope()
+        environment.add(name, FnObject(params, links[e - 2], environment.env.copy()))
+        v = evaluate(arena, links[e - 1], environment, tail)
+        environment.exit_scope()
+        return v
+    if k == FUNCALL:
+        fn = environment.get(arena.name(links[f]))
+        argv = [evaluate(arena, j, environment) for j in links[f + 1:e]]
+        frame = call_frame(fn, argv)
+        if tail:
+            return TailCall(fn, frame)
+        while True:
+            v = evaluate(arena, fn.body, frame, True)
+            if type(v) is not TailCall:
+                return v
+            fn, frame = v.fn, v.frame
+    if k == LETAND:
+        name1, name2 = arena.name(links[f]), arena.name(links[f + 2])
+        v1 = evaluate(arena, links[f + 1], environment)
+        v2 = evaluate(arena, links[f + 3], environment)
+        environment.enter_scope()
+        bind(environment, name1, v1)
+        bind(environment, name2, v2)
+        v3 = evaluate(arena, links[f + 4], environment, tail)
+        environment.exit_scope()
+        return v3
+    if k == UBOOL:
+        name = arena.name(links[f])
+        evaluate(arena, links[f + 1], environment)
+        v = environment.get(name)
+        if is_string(v):
+            return v != ""
+        return v != 0
+    raise InvalidProgram()
+
+
+# Type checking, by the rules of code1.TypeChecker. The type of every node
+# ends up in the arena's types column; a node typed in several places (a
+# function body at each call) keeps the last one.
+
+class ArenaTypeChecker:
+    def __init__(self, arena: Arena, env: Environment = None):
+        self.arena = arena
+        self.env = env if env is not None else Environment()
+        # node index -> type, for the nodes that do not look at the environment
+        self.types = {}
+        self.env_uses = 0
+        self.calls = set()
+        if arena.types is None or len(arena.types) != len(arena):
+            arena.types = array("B", bytes(len(arena)))
+
+    def lookup(self, name):
+        self.env_uses += 1
+        try:
+            t = self.env.get(name)
+        except KeyError:
+            raise TypeError() from None
+        if isinstance(t, FnObject):
+            raise TypeError()
+        return t
+
+    def bind(self, name, t):
+        self.env_uses += 1
+        if self.env.check(name):
+            self.env.update(name, unify(self.lookup(name), t))
+        else:
+            self.env.add(name, t)
+
+    def name(self, i):
+        try:
+            return self.arena.name(i)
+        except InvalidProgram:
+            raise TypeError() from None
+
+    def type_of(self, i):
+        if i in self.types:
+            return self.types[i]
+        uses = self.env_uses
+        t = self.check(i)
+        self.arena.types[i] = type_codes[t]
+        if self.env_uses == uses:
+            self.types[i] = t
+        return t
+
+    def check(self, i):
+        arena, type_of = self.arena, self.type_of
+        k = arena.kind[i]
+        links = arena.links
+        f = arena.first[i]
+        e = arena.first[i + 1]
+        if k == NUM:
+            return NumType()
+        if k == BOOL:
+            return BoolType()
+        if k == STRING:
+            return StringType()
+        if k == BINOP:
+            op = operators[arena.data[i]]
+            if op in ("+", "-", "*", "/"):
+                unify(type_of(links[f]), NumType())
+                unify(type_of(links[f + 1]), NumType())
+                return NumType()
+            t = unify(type_of(links[f]), type_of(links[f + 1]))
+            if op in ("<", ">") and t not in (None, NumType(), StringType()):
+                raise TypeError()
+            return BoolType()
+        if k == IF:
+            unify(type_of(links[f]), BoolType())
+            return unify(type_of(links[f + 1]), type_of(links[f + 2]))
+        if k == VARIABLE:
+            return self.lookup(arena.value(i))
+        if k == GET:
+            return self.lookup(self.name(links[f]))
+        if k == PUT:
+            name = self.name(links[f])
+            t = type_of(links[f + 1])
+            self.env_uses += 1
+            self.env.update(name, unify(self.lookup(name), t))
+            return t
+        if k == ASSIGN:
+            name = self.name(links[f])
+            t = type_of(links[f + 1])
+            self.env_uses += 1
+            if name in self.env.env[-1]:
+                self.env.update(name, unify(self.env.get(name), t))
+            else:
+                self.env.add(name, t)
+            return StringType()
+        if k == LET or k == LETMUT:
+            name = self.name(links[f])
+            t1 = type_of(links[f + 1])
+            self.env.enter_scope()
+            self.env.add(name, t1)
+            t2 = type_of(links[f + 2])
+            self.env.exit_scope()
+            return t2
+        if k == LETAND:
+            name1, name2 = self.name(links[f]), self.name(links[f + 2])
+            t1 = type_of(links[f + 1])
+            t2 = type_of(links[f + 3])
+            self.env.enter_scope()
+            self.bind(name1, t1)
+            self.bind(name2, t2)
+            t3 = type_of(links[f + 4])
+            self.env.exit_scope()
+            return t3
+        if k == SEQ:
+            t = UnitType()
+            for j in links[f:e]:
+                t = type_of(j)
+            return t
+        if k == WHILE:
+            unify(type_of(links[f]), BoolType())
+            type_of(links[f + 1])
+            return UnitType()
+        if k == FOR:
+            name = self.name(links[f])
+            self.bind(name, type_of(links[f + 1]))
+            unify(type_of(links[f + 2]), BoolType())
+            type_of(links[f + 4])
+            self.bind(name, type_of(links[f + 3]))
+            return UnitType()
+        if k == BREAK or k == CONTINUE:
+            return None
+        if k == CONCAT:
+            unify(type_of(links[f]), StringType())
+            unify(type_of(links[f + 1]), StringType())
+            return StringType()
+        if k == SLICE:
+            unify(type_of(links[f]), StringType())
+            unify(type_of(links[f + 1]), NumType())
+            unify(type_of(links[f + 2]), NumType())
+            return StringType()
+        if k == LETFUN:
+            name = self.name(links[f])
+            params = [Variable(self.name(j)) for j in links[f + 1:e - 2]]
+            self.env.enter_scope()
+            self.env.add(name, FnObject(params, links[e - 2], self.env.env.copy()))
+            t = type_of(links[e - 1])
+            self.env.exit_scope()
+            return t
+        if k == FUNCALL:
+            name = self.name(links[f])
+            self.env_uses += 1
+            fn = self.env.get(name) if self.env.check(name) else None
+            args = links[f + 1:e]
+            if not isinstance(fn, FnObject) or len(fn.params) != len(args):
+                raise TypeError()
+            arg_types = tuple(type_of(j) for j in args)
+            call = (fn.body, arg_types)
+            if call in self.calls:
+                return None
+            self.calls.add(call)
+            caller, self.env = self.env, Environment(fn.env + [{}])
+            for par, t in zip(fn.params, arg_types):
+                self.env.add(par.name, t)
+            try:
+                t = type_of(fn.body)
+            finally:
+                self.env = caller
+                self.calls.remove(call)
+            return t
+        if k == UBOOL:
+            name = self.name(links[f])
+            type_of(links[f + 1])
+            if self.lookup(name) not in (NumType(), StringType()):
+                raise TypeError()
+            return BoolType()
+        if k == PRINT:
+            return type_of(links[f])
+        raise TypeError()
+
+
+def arena_typecheck(arena: Arena, env: Environment = None) -> Arena:
+    ArenaTypeChecker(arena, env).type_of(arena.root)
+    return arena
+
+
+# Constant folding, as optimizer.fold does it, in one loop over the nodes:
+# a node's children have been folded by the time it is reached.
+def arena_fold(arena: Arena) -> Arena:
+    kind, data, first, links, constants = arena.kind, arena.data, arena.first, arena.links, arena.constants
+    out = Arena()
+    numeric = bytearray()  # numeric[j]: out's node j passes optimizer.is_numeric
+    moved = array("i", [0]) * len(kind)
+    typed = arena.types if arena.types is not None and len(arena.types) == len(kind) else None
+    number_type = type_codes[NumType()]
+
+    def add(k, d, children, number=False):
+        j = out.add(k, d, children)
+        numeric.append(k == NUM or number)
+        return j
+
+    def literal(value):
+        value = as_str(value)
+        if isinstance(value, bool):
+            return add(BOOL, out.constant(value), ())
+        if isinstance(value, str):
+            return add(STRING, out.constant(value), ())
+        return add(NUM, out.constant(value), ())
+
+    def is_number(j, n):
+        # BoolLiteral(False) == 0 in Python, so check the kind as well
+        return out.kind[j] == NUM and out.value(j) == n
+
+    for i in range(arena.root + 1):
+        k = kind[i]
+        children = [moved[j] for j in links[first[i]:first[i + 1]]]
+        j = -1
+        if k == BINOP:
+            op = operators[data[i]]
+            left, right = children
+            if out.kind[left] <= STRING and out.kind[right] <= STRING and functions[data[i]] is not None:
+                try:
+                    j = literal(functions[data[i]](out.value(left), out.value(right)))
+                except Exception:
+                    pass    # leave the error to happen at run time
+            if j < 0:
+                # the identities hold for numbers only, as in optimizer.fold
+                if (op == "+" or op == "-") and is_number(right, 0) and numeric[left]:
+                    j = left
+                elif op == "+" and is_number(left, 0) and numeric[right]:
+                    j = right
+                elif (op == "*" or op == "/") and is_number(right, 1) and numeric[left]:
+                    j = left
+                elif op == "*" and is_number(left, 1) and numeric[right]:
+                    j = right
+                else:
+                    number = (op in "+-*/" and numeric[left] and numeric[right]) or (typed is not None and typed[i] == number_type)
+                    j = add(k, data[i], children, number)
+        elif k == IF:
+            condition = children[0]
+            if out.kind[condition] <= STRING:
+                j = children[1] if out.value(condition) == True else children[2]
+        elif k == CONCAT:
+            str1, str2 = children
+            if out.kind[str1] == STRING and out.kind[str2] == STRING:
+                j = literal(out.value(str1) + out.value(str2))
+        if j < 0:
+            j = add(k, out.constant(constants[data[i]]) if k <= VARIABLE else data[i], children)
+        moved[i] = j
+    out.root = moved[arena.root]
+    # a folded if_else leaves its other branch behind
+    return out.compact()
+
+
+def test_arena_round_trip():
+    for program, expected in example_programs():
+        arena = from_tree(program)
+        assert to_tree(arena) == program
+        assert Arena.loads(arena.dumps()).__dict__ == arena.__dict__
+    # the shared e2 is stored once, and shared again when converted back
+    a = Variable("a")
+    e2 = BinOp("+", a, a)
+    arena = from_tree(Let(a, NumLiteral(5), Let(a, e2, e2)))
+    assert len(arena) == 5 and arena.constants == ["a", 5]
+    tree = to_tree(arena)
+    assert tree.e2.e1 is tree.e2.e2
+    arena = from_tree(NumLiteral(Fraction(1, 3)))
+    assert to_tree(Arena.loads(arena.dumps())) == NumLiteral(1, 3)
+
+def test_arena_eval():
+    for program, expected in example_programs():
+        assert arena_eval(from_tree(program)) == expected
+    env = Environment()
+    env.add("a", 4)
+    a = Variable("a")
+    assert arena_eval(from_tree(BinOp("*", a, Str_slicing(StringLiteral("xyz"), NumLiteral(1), a))), env) == "yzyzyzyz"
+    import pytest
+    with pytest.raises(InvalidProgram):
+        arena_eval(from_tree(BinOp("=", NumLiteral(1), NumLiteral(1))))
+    with pytest.raises(InvalidProgram):
+        arena_eval(from_tree(Let(NumLiteral(1), NumLiteral(2), NumLiteral(3))))
+
+def test_arena_typecheck():
+    import pytest
+    from code1 import TypeChecker
+    for program, expected in example_programs():
+        arena = arena_typecheck(from_tree(program))
+        assert types[arena.types[arena.root]] == TypeChecker().type_of(program)
+    arena = arena_typecheck(from_tree(BinOp("<", BinOp("+", NumLiteral(2), NumLiteral(3)), NumLiteral(7))))
+    assert [types[t] for t in arena.types] == [NumType(), NumType(), NumType(), NumType(), BoolType()]
+    a = Variable("a")
+    f = Variable("f")
+    for program in (a, Let(a, StringLiteral("x"), BinOp("+", a, NumLiteral(1))),
+                    LetFun(f, [a], a, FunCall(f, [])), while_loop(NumLiteral(1), NumLiteral(2))):
+        with pytest.raises(TypeError):
+            arena_typecheck(from_tree(program))
+    # 2**60 paths through the tree, 61 nodes, each checked once
+    e = NumLiteral(1)
+    for k in range(60):
+        e = BinOp("+", e, e)
+    checker = ArenaTypeChecker(from_tree(e))
+    assert checker.type_of(checker.arena.root) == NumType() and len(checker.types) == 61
+
+def test_arena_fold():
+    import optimizer
+    for program, expected in example_programs():
+        folded = arena_fold(from_tree(program))
+        assert to_tree(folded) == optimizer.fold(program)
+        assert arena_eval(folded) == expected
+    a = Variable("a")
+    x = BinOp("+", a, NumLiteral(2))
+    e = if_else(BinOp(">", NumLiteral(50), NumLiteral(36)), BinOp("*", BinOp("-", x, NumLiteral(0)), NumLiteral(1)), Print(a))
+    folded = arena_fold(arena_typecheck(from_tree(Let(a, NumLiteral(1), e))))
+    assert to_tree(folded) == Let(a, NumLiteral(1), x) and len(folded) == 5 and folded.constants == ["a", 1, 2]
+    # a is not known to be a number, "a" + 0 fails and 0 + (1 < 2) is 1
+    for e in (BinOp("/", NumLiteral(1), NumLiteral(0)), BinOp("*", Put(a, NumLiteral(1)), NumLiteral(0)),
+              BinOp("+", a, BoolLiteral(False)), BinOp("*", a, NumLiteral(1)), BinOp("*", a, NumLiteral(0)),
+              BinOp("+", NumLiteral(0), BinOp("<", a, NumLiteral(2))),
+              BinOp("*", BinOp("/", NumLiteral(1), NumLiteral(0)), NumLiteral(0)),
+              BinOp("*", NumLiteral(0), BinOp("-", BinOp("/", NumLiteral(1), NumLiteral(0)), NumLiteral(2)))):
+        assert to_tree(arena_fold(from_tree(e))) == e
+    assert arena_eval(arena_fold(from_tree(BinOp("+", NumLiteral(0), BinOp("<", NumLiteral(1), NumLiteral(2)))))) == 1
+    import pytest
+    with pytest.raises(TypeError):
+        arena_eval(arena_fold(from_tree(BinOp("+", StringLiteral("a"), NumLiteral(0)))))
+    # an error in a branch that is not taken is no error at all
+    e = if_else(BoolLiteral(False), BinOp("/", StringLiteral(""), NumLiteral(3)), NumLiteral(1))
+    assert arena_eval(arena_fold(from_tree(e))) == 1
+
+def test_arena_deep():
+    # far deeper than eval, typecheck or == on the dataclass form could go
+    tree = NumLiteral(1)
+    for k in range(100000):
+        tree = BinOp("+", tree, NumLiteral(2))
+    a = Variable("a")
+    arena = Arena.loads(from_tree(BinOp("*", tree, a)).dumps())
+    assert len(arena) == 100004
+    env = Environment()
+    env.add("a", 3)
+    assert arena_eval(arena, env) == 600003
+    folded = arena_fold(arena)
+    assert len(folded) == 3 and arena_eval(folded, env) == 600003
+    copy = to_tree(arena)
+    assert copy.right is a and copy.left.left.right == NumLiteral(2)
+    import pytest
+    env.update("a", "x")
+    with pytest.raises(TypeError):
+        arena_eval(from_tree(BinOp("+", tree, a)), env)
+
+print("test_arena_round_trip(): ", test_arena_round_trip())
+print("test_arena_eval(): ", test_arena_eval())
+print("test_arena_typecheck(): ", test_arena_typecheck())
@@ -0,0 +1,323 @@
+# eval for programs that run inside an asyncio event loop.
+#
+# async_eval(program) gives the value eval gives, but hands control back to
+# the event loop every yield_every nodes, or once time_slice seconds have
+# gone by since it last did, whichever comes first, so a long while_loop
+# does not hold up everything else on the loop. Many programs can run side
+# by side (see run_all), and an async_eval can be cancelled or given a
+# timeout like any other coroutine: it stops at its next yield.
+#
+# Print hands its output to `sink`, an async function taking the printed
+# text, when there is one, and prints it as eval does otherwise.
+#
+# A subtree without loops, function calls or Prints always finishes after a
+# known number of steps. When that is no more than yield_every, the subtree is
+# evaluated by code1.evaluate in one go and counted as that many nodes, so the
+# coroutine machinery is only paid for around the loops, the calls and the
+# large subtrees (a shared one can take 2**30 steps), where it is needed.
+
+import asyncio
+import operator
+import time
+
+from code1 import (NumLiteral, BoolLiteral, StringLiteral, BinOp, Variable, Let, LetMut, if_else,
+                   while_loop, for_loop, Two_Str_concatenation, Str_slicing, Seq, Put, Get, Assign,
+                   Print, LetFun, FunCall, LetAnd, UBoolOp, FnObject, TailCall, Environment,
+                   BreakLoop, ContinueLoop, evaluate, call_frame, divide, concat, slice_string,
+                   as_str, is_string, missing, concatenation_operands, example_programs)
+from parallel import getters
+
+
+binary = {
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    "/": divide,
+    ">": operator.gt,
+    "<": operator.lt,
+    "==": operator.eq,
+}
+unbounded = {while_loop, for_loop, FunCall, LetFun, Print}
+
+
+def bounded_costs(program, costs):
+    # id(node) -> number of node visits eval makes for it (a shared subtree
+    # once per use), or -1 for a node that may loop, call or print, for
+    # every node of program not in costs already
+    todo = [(program, False)]
+    while todo:
+        node, expanded = todo.pop()
+        if id(node) in costs:
+            continue
+        getter = getters.get(type(node))
+        if getter is None:
+            costs[id(node)] = -1    # not a code1 node (parallel.py's Fork, say)
+            continue
+        kids = getter(node)
+        if not expanded:
+            todo.append((node, True))
+            todo.extend([(kid, False) for kid in kids])
+            continue
+        cost = -1 if type(node) in unbounded else 1
+        for kid in kids:
+            kid_cost = costs[id(kid)]
+            if kid_cost < 0 or cost < 0:
+                cost = -1
+            else:
+                cost += kid_cost
+        costs[id(node)] = cost
+    return costs
+
+
+class AsyncEvaluator:
+    def __init__(self, sink=None, yield_every=1000, time_slice=0.005):
+        self.sink = sink
+        self.yield_every = yield_every
+        self.time_slice = time_slice
+        self.costs = {}
+        self.steps = 0          # nodes since the last yield
+        self.yields = 0
+        self.slice_end = time.monotonic() + time_slice
+
+    async def tick(self, n):
+        self.steps += n
+        if self.steps >= self.yield_every or time.monotonic() >= self.slice_end:
+            self.steps = 0
+            self.yields += 1
+            await asyncio.sleep(0)
+            self.slice_end = time.monotonic() + self.time_slice
+
+    async def print(self, value):
+        if self.sink is None:
+            print(value)
+        else:
+            await self.sink(str(value))
+
+    def cost(self, program):
+        cost = self.costs.get(id(program))
+        if cost is None:
+            # a function body from the environment, say
+            cost = bounded_costs(program, self.costs)[id(program)]
+        return cost
+
+    async def evaluate(self, program, environment, tail=False):
+        cost = self.cost(program)
+        if 0 <= cost <= self.yield_every:
+            v = evaluate(program, environment, tail)
+            await self.tick(cost)
+            return v
+        await self.tick(1)
+        eval_ = lambda program: self.evaluate(program, environment)
+        eval_tail = lambda program: self.evaluate(program, environment, tail)
+        match program:
+            case while_loop(condition, body):
+                depth = len(environment.env)
+                while await eval_(condition) == True:
+                    try:
+                        await eval_(body)
+                    except BreakLoop:
+                        environment.unwind(depth)
+                        break
+                    except ContinueLoop:
+                        environment.unwind(depth)
+                return None
+            case for_loop(Variable(name), e1, condition, updt, body):
+                v = await eval_(e1)
+                if environment.check(name):
+                    environment.update(name, v)
+                else:
+                    environment.add(name, v)
+                depth = len(environment.env)
+                while await eval_(condition) == True:
+                    try:
+                        await eval_(body)
+                    except BreakLoop:
+                        environment.unwind(depth)
+                        break
+                    except ContinueLoop:
+                        environment.unwind(depth)
+                    environment.update(name, await eval_(updt))
+                return None
+            case Seq(body):
+                if not body:
+                    return None
+                for item in body[:-1]:
+                    await eval_(item)
+                return await eval_tail(body[-1])
+            case Let(Variable(name), e1, e2) | LetMut(Variable(name), e1, e2):
+                v1 = await eval_(e1)
+                environment.enter_scope()
+                environment.add(name, v1)
+                v2 = await eval_tail(e2)
+                environment.exit_scope()
+                return v2
+            case LetAnd(Variable(name1), expr1, Variable(name2), expr2, expr3):
+                v1 = await eval_(expr1)
+                v2 = await eval_(expr2)
+                environment.enter_scope()
+                for name, v in ((name1, v1), (name2, v2)):
+                    if environment.check(name):
+                        environment.update(name, v)
+                    else:
+                        environment.add(name, v)
+                v3 = await eval_tail(expr3)
+                environment.exit_scope()
+                return v3
+            case if_else(expr, et, ef):
+                if await eval_(expr) == True:
+                    return await eval_tail(et)
+                return await eval_tail(ef)
+            case LetFun(Variable(name), params, body, expr):
+                environment.enter_scope()
+                fn = FnObject(params, body, environment.env.copy())
+                environment.add(name, fn)
+                if environment.memo is not None:
+                    fn.cache = environment.memo.cache_for(program, environment)
+                v = await eval_tail(expr)
+                environment.exit_scope()
+                return v
+            case FunCall(Variable(name), args):
+                fn = environment.get(name)
+                argv = []
+                for arg in args:
+                    argv.append(await eval_(arg))
+                frame = call_frame(fn, argv, environment.memo)
+                key = None
+                if fn.cache is not None:
+                    key = fn.cache.key(argv, frame)
+                    if key is not None:
+                        v = fn.cache.get(key)
+                        if v is not missing:
+                            return v
+                if tail:
+                    return TailCall(fn, frame, key)
+                pending = []
+                while True:
+                    if key is not None:
+                        pending.append((fn.cache, key))
+                    v = await self.evaluate(fn.body, frame, True)
+                    if type(v) is not TailCall:
+                        break
+                    fn, frame, key = v.fn, v.frame, v.key
+                for cache, key in pending:
+                    cache.put(key, v)
+                return v
+            case Print(e1):
+                v = await eval_(e1)
+                await self.print(v)
+                return v
+            case Put(Variable(name), e1):
+                environment.update(name, await eval_(e1))
+                return environment.get(name)
+            case Assign(Variable(name), e1):
+                environment.add(name, await eval_(e1))
+                return name
+            case BinOp(op, left, right) if op in binary:
+                left = await eval_(left)
+                return binary[op](left, await eval_(right))
+            case Two_Str_concatenation():
+                # a chain of them in a loop, as evaluate does it
+                operands = concatenation_operands(program)
+                value = await eval_(operands[0])
+                for operand in operands[1:]:
+                    value = concat(value, await eval_(operand))
+                return value
+            case Str_slicing(str1, start, end):
+                str1 = await eval_(str1)
+                start = await eval_(start)
+                return slice_string(str1, start, await eval_(end))
+            case UBoolOp(Variable(name), expr):
+                await eval_(expr)
+                v = environment.get(name)
+                if is_string(v):
+                    return v != ""
+                return v != 0
+        # anything else is left to eval
+        return evaluate(program, environment, tail)
+
+
+async def async_eval(program, environment: Environment = None, sink=None, yield_every=1000,
+                     time_slice=0.005, timeout=None, memo=None):
+    # timeout: seconds of wall time, after which TimeoutError is raised;
+    # memo as for eval
+    if environment is None:
+        environment = Environment()
+    evaluator = AsyncEvaluator(sink, yield_every, time_slice)
+    bounded_costs(program, evaluator.costs)
+    saved, environment.memo = environment.memo, memo
+    try:
+        async with asyncio.timeout(timeout):
+            return as_str(await evaluator.evaluate(program, environment))
+    finally:
+        environment.memo = saved
+
+
+async def run_all(programs, sink=None, return_exceptions=False, **options):
+    # the values of programs, run interleaved on this event loop, in order
+    return await asyncio.gather(*(async_eval(program, sink=sink, **options) for program in programs),
+                                return_exceptions=return_exceptions)
+
+
+def printing_loop(name, n):
+    # prints name n times
+    i = Variable("i")
+    return LetMut(i, NumLiteral(0), while_loop(BinOp("<", Get(i), NumLiteral(n)),
+                  Seq([Print(StringLiteral(name)), Put(i, BinOp("+", Get(i), NumLiteral(1)))])))
+
+
+def test_async_matches_eval():
+    for program, expected in example_programs():
+        assert asyncio.run(async_eval(program, yield_every=3)) == expected
+    a = Variable("a")
+    f = Variable("f")
+    # a long chain of tail calls, yielding on the way
+    e = LetFun(f, [a], if_else(BinOp("<", a, NumLiteral(1)), StringLiteral("done"), FunCall(f, [BinOp("-", a, NumLiteral(1))])),
+               FunCall(f, [NumLiteral(5000)]))
+    assert asyncio.run(async_eval(e, yield_every=100)) == "done"
+    chain = StringLiteral("")
+    for k in range(5000):
+        chain = Two_Str_concatenation(chain, StringLiteral("ab"))
+    assert asyncio.run(async_eval(chain, yield_every=100)) == "ab" * 5000
+
+def test_async_interleaves():
+    printed = []
+    async def sink(text):
+        printed.append(text)
+    results = asyncio.run(run_all([printing_loop("a", 50), printing_loop("b", 50)], sink, yield_every=20))
+    assert results == [None, None]
+    assert sorted(printed) == ["a"] * 50 + ["b"] * 50
+    # neither program ran to the end before the other started
+    assert printed.index("b") < printed.index("a") + 50 and printed.index("a") < 50 - printed[::-1].index("b")
+
+def test_async_cancel_and_timeout():
+    import pytest
+    forever = while_loop(BoolLiteral(True), NumLiteral(0))
+    async def main():
+        ticks = 0
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0)
+        clock = asyncio.create_task(ticker())
+        task = asyncio.create_task(async_eval(forever, yield_every=100))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        with pytest.raises(TimeoutError):
+            await async_eval(forever, timeout=0.05)
+        # no loop, but 2**40 additions: it yields on the way all the same
+        shared = NumLiteral(1)
+        for _ in range(40):
+            shared = BinOp("+", shared, shared)
+        with pytest.raises(TimeoutError):
+            await async_eval(shared, timeout=0.05)
+        clock.cancel()
+        return ticks
+    # the event loop kept running while the loops did
+    assert asyncio.run(main()) > 10
+
+
+print("test_async_matches_eval(): ", test_async_matches_eval())
+print("test_async_interleaves(): ", test_async_interleaves())
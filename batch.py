@@ -0,0 +1,297 @@
+# Evaluation of one program over many rows of inputs at once.
+#
+# batch_eval(program, columns) gives the column of values eval gives for
+# program on each row, where row r binds every free variable `name` to
+# columns[name][r]. Rather than walking the tree once per row, it walks it
+# once and does each node's work for all the rows together. With NumPy a node
+# is one array operation over float64 columns.
+#
+# An if_else evaluates each branch for the rows that take it and no others,
+# like eval does row by row, so a division by zero in the branch a row does
+# not take is no error.
+#
+# Floats are not eval's exact numbers: 1/3 comes out as 0.333... With
+# exact=True (or when NumPy is not installed) a column is a list and every
+# operation is done on ints and Fractions as eval does it, so the results are
+# eval's, without the walk over the tree for each row.
+#
+# Literals, variables, arithmetic, comparisons, Let and if_else are
+# vectorized. Any other program is left to eval, one row at a time.
+
+from fractions import Fraction
+import operator
+import random
+import time
+
+from code1 import (NumLiteral, BoolLiteral, BinOp, Variable, Let, LetMut, if_else, Get, Print,
+                   Environment, InvalidProgram, divide, eval)
+
+try:
+    import numpy
+except ImportError:     # exact mode only
+    numpy = None
+
+
+exact_operators = {
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    "/": divide,
+    ">": operator.gt,
+    "<": operator.lt,
+    "==": operator.eq,
+}
+float_operators = {**exact_operators, "/": operator.truediv}
+
+
+def vectorizable(program) -> bool:
+    seen = set()    # a shared subtree is looked at once
+    todo = [program]
+    while todo:
+        program = todo.pop()
+        if id(program) in seen:
+            continue
+        seen.add(id(program))
+        match program:
+            case NumLiteral() | BoolLiteral() | Variable() | Get(Variable()):
+                pass
+            case BinOp(op, left, right) if op in exact_operators:
+                todo += [left, right]
+            case Let(Variable(), e1, e2) | LetMut(Variable(), e1, e2):
+                # without a Put, a LetMut is a Let
+                todo += [e1, e2]
+            case if_else(expr, et, ef):
+                todo += [expr, et, ef]
+            case _:
+                return False
+    return True
+
+
+def as_list(column):
+    # NumPy scalars would leak into eval's arithmetic
+    return column.tolist() if hasattr(column, "tolist") else list(column)
+
+
+# A value that is the same in every row (a literal, say) is kept as one
+# value, not as a column; the operations below take either.
+
+class ExactColumns:
+    def column(self, values):
+        return as_list(values)
+
+    def constant(self, value):
+        return value
+
+    def is_column(self, value):
+        return type(value) is list
+
+    def apply(self, op, left, right):
+        fn = exact_operators[op]
+        if type(left) is list:
+            if type(right) is list:
+                return [fn(x, y) for x, y in zip(left, right)]
+            return [fn(x, right) for x in left]
+        if type(right) is list:
+            return [fn(left, y) for y in right]
+        return fn(left, right)
+
+    def split(self, condition):
+        # the rows that take the true branch and those that take the false one
+        taken = []
+        other = []
+        for r, value in enumerate(condition):
+            (taken if value == True else other).append(r)
+        return taken, other
+
+    def take(self, value, rows):
+        if type(value) is list:
+            return [value[r] for r in rows]
+        return value
+
+    def merge(self, n, rows1, values1, rows2, values2):
+        result = [None] * n
+        for rows, values in ((rows1, values1), (rows2, values2)):
+            if type(values) is not list:
+                values = [values] * len(rows)
+            for r, value in zip(rows, values):
+                result[r] = value
+        return result
+
+    def full(self, n, value):
+        return [value] * n
+
+
+class FloatColumns:
+    def column(self, values):
+        array = numpy.asarray(values)
+        if array.dtype.kind in "iuf":
+            # float64 rather than int64, which would overflow without a word
+            return array.astype(numpy.float64)
+        return array
+
+    def constant(self, value):
+        return value if isinstance(value, bool) else float(value)
+
+    def is_column(self, value):
+        return isinstance(value, numpy.ndarray)
+
+    def apply(self, op, left, right):
+        if op == "/" and numpy.any(numpy.asarray(right) == 0):
+            raise ZeroDivisionError()
+        return float_operators[op](left, right)
+
+    def split(self, condition):
+        mask = numpy.asarray(condition == True)
+        return numpy.flatnonzero(mask), numpy.flatnonzero(~mask)
+
+    def take(self, value, rows):
+        if isinstance(value, numpy.ndarray):
+            return value[rows]
+        return value
+
+    def merge(self, n, rows1, values1, rows2, values2):
+        result = numpy.empty(n, dtype=numpy.result_type(values1, values2))
+        result[rows1] = values1
+        result[rows2] = values2
+        return result
+
+    def full(self, n, value):
+        return numpy.full(n, value)
+
+
+class Batch:
+    def __init__(self, columns):
+        self.columns = columns
+
+    def eval(self, program, scope, n):
+        # the value of program for each of the n rows the columns in scope hold
+        columns = self.columns
+        def eval_(program):
+            return self.eval(program, scope, n)
+        match program:
+            case NumLiteral(value) | BoolLiteral(value):
+                return columns.constant(value)
+            case Variable(name) | Get(Variable(name)):
+                return scope[name]
+            case BinOp(op, left, right):
+                return columns.apply(op, eval_(left), eval_(right))
+            case Let(Variable(name), e1, e2) | LetMut(Variable(name), e1, e2):
+                return self.eval(e2, {**scope, name: eval_(e1)}, n)
+            case if_else(expr, et, ef):
+                condition = eval_(expr)
+                if not columns.is_column(condition):
+                    return eval_(et) if condition == True else eval_(ef)
+                taken, other = columns.split(condition)
+                if len(other) == 0:
+                    return eval_(et)
+                if len(taken) == 0:
+                    return eval_(ef)
+                values = []
+                for rows, branch in ((taken, et), (other, ef)):
+                    branch_scope = {name: columns.take(value, rows) for name, value in scope.items()}
+                    values.append(self.eval(branch, branch_scope, len(rows)))
+                return columns.merge(n, taken, values[0], other, values[1])
+        raise InvalidProgram()
+
+
+def rows_eval(program, columns, n):
+    values = {name: as_list(column) for name, column in columns.items()}
+    results = []
+    for r in range(n):
+        env = Environment()
+        for name, column in values.items():
+            env.add(name, column[r])
+        results.append(eval(program, env))
+    return results
+
+
+def batch_eval(program, columns, exact=False, rows=None):
+    # columns: name -> sequence (or NumPy array) of that variable's values, one
+    # per row. rows is only needed when there are no columns.
+    lengths = {len(column) for column in columns.values()}
+    if rows is not None:
+        lengths.add(rows)
+    if len(lengths) != 1:
+        raise ValueError("every column needs one value per row")
+    n = lengths.pop()
+    exact = exact or numpy is None
+    if not vectorizable(program):
+        results = rows_eval(program, columns, n)
+        return results if exact else numpy.asarray(results)
+    kind = ExactColumns() if exact else FloatColumns()
+    scope = {name: kind.column(column) for name, column in columns.items()}
+    value = Batch(kind).eval(program, scope, n)
+    return value if kind.is_column(value) else kind.full(n, value)
+
+
+def parse_example():
+    # if a+b > 2*d then a*b - c + d else e*f/g end, as test_parse in code2.py parses it
+    a, b, c, d, e, f, g = (Variable(name) for name in "abcdefg")
+    return if_else(BinOp(">", BinOp("+", a, b), BinOp("*", NumLiteral(2), d)),
+                   BinOp("+", BinOp("-", BinOp("*", a, b), c), d),
+                   BinOp("/", BinOp("*", e, f), g))
+
+
+def random_columns(n, seed=0):
+    rng = random.Random(seed)
+    return {name: [rng.randint(-20, 20) for _ in range(n)] for name in "abcdefg"}
+
+
+def bench_batch(n=10000, repeat=3):
+    program = parse_example()
+    columns = random_columns(n)
+    # the else branch divides by g
+    columns["g"] = [value or 1 for value in columns["g"]]
+    t_eval = min(timeit_(lambda: rows_eval(program, columns, n)) for _ in range(repeat))
+    t_batch = min(timeit_(lambda: batch_eval(program, columns, exact=True)) for _ in range(repeat))
+    return t_eval, t_batch, t_eval / t_batch
+
+
+def timeit_(f):
+    start = time.perf_counter()
+    f()
+    return time.perf_counter() - start
+
+
+def test_batch_exact():
+    program = parse_example()
+    columns = random_columns(500)
+    columns["g"] = [value or 1 for value in columns["g"]]
+    assert batch_eval(program, columns, exact=True) == rows_eval(program, columns, 500)
+    a = Variable("a")
+    e = Let(a, BinOp("/", a, NumLiteral(3)), BinOp("+", a, NumLiteral(1)))
+    assert batch_eval(e, {"a": [3, 4]}, exact=True) == [2, Fraction(7, 3)]
+    assert batch_eval(NumLiteral(5), {}, exact=True, rows=3) == [5, 5, 5]
+
+def test_batch_branches():
+    # a row only evaluates the branch it takes
+    a = Variable("a")
+    e = if_else(BinOp("==", a, NumLiteral(0)), NumLiteral(0), BinOp("/", NumLiteral(1), a))
+    assert batch_eval(e, {"a": [0, 2, 0]}, exact=True) == [0, Fraction(1, 2), 0]
+    import pytest
+    with pytest.raises(ZeroDivisionError):
+        batch_eval(BinOp("/", NumLiteral(1), a), {"a": [1, 0]}, exact=True)
+    with pytest.raises(ValueError):
+        batch_eval(a, {"a": [1], "b": [1, 2]})
+
+def test_batch_fallback():
+    # not vectorized, but still one value per row
+    a = Variable("a")
+    e = Print(BinOp("+", a, NumLiteral(1)))
+    assert not vectorizable(e) and vectorizable(parse_example())
+    assert batch_eval(e, {"a": [1, 2]}, exact=True) == [2, 3]
+
+def test_batch_numpy():
+    import pytest
+    pytest.importorskip("numpy")
+    program = parse_example()
+    columns = random_columns(500)
+    columns["g"] = [value or 1 for value in columns["g"]]
+    exact = batch_eval(program, columns, exact=True)
+    floats = batch_eval(program, {name: numpy.array(column) for name, column in columns.items()})
+    assert isinstance(floats, numpy.ndarray) and numpy.allclose(floats, [float(x) for x in exact])
+
+
+# print(bench_batch()) # Uncomment to compare eval row by row with batch_eval.
+print("test_batch_exact(): ", test_batch_exact())
+print("test_batch_branches(): ", test_batch_branches())
@@ -0,0 +1,479 @@
+# Closure compiler for the language in code1.py.
+#
+# compile_to_closure walks the AST once and turns every node into a Python
+# function of one argument, the frame it runs in, which calls the functions of
+# the node's children. All the decisions eval makes each time it visits a
+# node (which case of the `match`, where a variable lives, whether an operand
+# is a constant) are made here, once; running the program is then nothing but
+# calls between these functions.
+#
+# Frames are the lists of resolver.py, the same as in vm.py, and variables are
+# resolved to slots while compiling. break and continue are the BreakLoop and
+# ContinueLoop exceptions of code1.py, caught by the closure of the loop.
+#
+# A call in tail position returns a TailCall instead of calling the function,
+# and the call that is already running runs it in a loop, so tail-recursive
+# functions take no Python stack.
+
+from dataclasses import dataclass, field
+from typing import Callable, List
+
+from code1 import (NumLiteral, BoolLiteral, StringLiteral, BinOp, Variable, Let, LetMut,
+                   if_else, while_loop, for_loop, Break, Continue, Two_Str_concatenation, Str_slicing,
+                   Seq, Put, Get, Assign, Print, LetFun, FunCall, LetAnd, UBoolOp,
+                   Environment, InvalidProgram, BreakLoop, ContinueLoop, TailCall, eval, example_programs,
+                   as_number, as_str, is_string, concat, slice_string, concatenation_operands)
+from resolver import Scope, FRAME_HEADER, unbound, lookup_name
+from vm import binary_operators, counting_loop, timeit_
+
+
+@dataclass
+class Function:
+    name: str
+    params: List[str]
+    body: Callable = field(repr=False)
+    template: list = field(repr=False)
+
+
+@dataclass
+class Closure:
+    # a function together with the frame of its LetFun, the parent of the
+    # frames its calls run in
+    function: Function
+    frame: list = field(repr=False)
+
+
+@dataclass
+class CompiledProgram:
+    run: Callable = field(repr=False)     # takes the top-level frame
+    template: list = field(repr=False)
+
+    def __call__(self, frame):
+        return as_str(self.run(frame))
+
+    def new_frame(self, parent=None):
+        frame = self.template.copy()
+        frame[0] = parent
+        return frame
+
+
+def compile_to_closure(program) -> CompiledProgram:
+    scope = Scope()
+    run = compile_closure(program, scope)
+    return CompiledProgram(run, scope.template())
+
+
+def closure_eval(program, environment: Environment = None):
+    # environment supplies the variables the program uses without binding them
+    if environment is None:
+        environment = Environment()
+    compiled = compile_to_closure(program)
+    frames = []
+    parent = None
+    for scope in environment.env:
+        parent = [parent, list(scope)] + list(scope.values())
+        frames.append(parent)
+    try:
+        return compiled(compiled.new_frame(parent))
+    finally:
+        # Put may have changed them, and a for_loop at the top level added to the last
+        for frame, scope in zip(frames, environment.env):
+            for k, name in enumerate(frame[1]):
+                if name in scope:
+                    scope[name] = frame[FRAME_HEADER + k]
+                else:
+                    environment.add(name, frame[FRAME_HEADER + k])
+
+
+def load(name, scope: Scope):
+    where = scope.resolve(name)
+    if where is None:
+        def load_name(frame):
+            found = lookup_name(frame, name)
+            if found is None:
+                raise KeyError(name)
+            return found[0][found[1]]
+        return load_name
+    hops, index, check = where
+    if check or hops > 1:
+        def load_slot(frame):
+            f = frame
+            for _ in range(hops):
+                f = f[0]
+            value = f[index]
+            if value is unbound:
+                # not bound here yet: the variable is the one further out, if any
+                found = lookup_name(frame, name)
+                if found is None:
+                    raise KeyError(name)
+                return found[0][found[1]]
+            return value
+        return load_slot
+    if hops == 0:
+        return lambda frame: frame[index]
+    return lambda frame: frame[0][index]
+
+
+def store(name, scope: Scope):
+    # a function (frame, value) that stores value in the variable
+    where = scope.resolve(name)
+    if where is None:
+        def store_name(frame, value):
+            found = lookup_name(frame, name)
+            if found is None:
+                raise KeyError(name)
+            found[0][found[1]] = value
+        return store_name
+    hops, index, check = where
+    if check:
+        def store_checked(frame, value):
+            f = frame
+            for _ in range(hops):
+                f = f[0]
+            if f[index] is unbound:
+                # as in load: the variable is the one further out
+                found = lookup_name(frame, name)
+                if found is None:
+                    raise KeyError(name)
+                f, index_ = found
+                f[index_] = value
+            else:
+                f[index] = value
+        return store_checked
+    if hops == 0:
+        def store_local(frame, value):
+            frame[index] = value
+        return store_local
+    def store_slot(frame, value):
+        for _ in range(hops):
+            frame = frame[0]
+        frame[index] = value
+    return store_slot
+
+
+def store_or_bind(name, scope: Scope):
+    # eval's for_loop and LetAnd: update the variable if it is visible, the
+    # environment's included, and bind it in the current frame otherwise
+    where = scope.resolve(name)
+    if where is not None and not where[2]:
+        return store(name, scope)
+    index = scope.declare(name, maybe_unbound=True)
+    # at the top level the current scope is the environment's last one
+    top = scope.parent is None
+    def bind(frame, value):
+        if frame[index] is not unbound:
+            frame[index] = value
+            return
+        found = lookup_name(frame, name)
+        if found is not None:
+            found[0][found[1]] = value
+        elif top and frame[0] is not None:
+            frame[0][1].append(name)
+            frame[0].append(value)
+        else:
+            frame[index] = value
+    return bind
+
+
+def compile_closure(program, scope: Scope, tail=False):
+    # tail: program is in tail position in a function body
+    match program:
+        case NumLiteral(value):
+            value = as_number(value)
+            return lambda frame: value
+
+        case BoolLiteral(value) | StringLiteral(value):
+            return lambda frame: value
+
+        case Variable(name) | Get(Variable(name)):
+            return load(name, scope)
+
+        case Put(Variable(name), e1):
+            e1 = compile_closure(e1, scope)
+            set_ = store(name, scope)
+            def put(frame):
+                value = e1(frame)
+                set_(frame, value)
+                return value
+            return put
+
+        case Assign(Variable(name), e1):
+            e1 = compile_closure(e1, scope)
+            index = scope.declare(name, maybe_unbound=True)
+            def assign(frame):
+                value = e1(frame)
+                assert frame[index] is unbound
+                frame[index] = value
+                return name
+            return assign
+
+        case Let(Variable(name), e1, e2) | LetMut(Variable(name), e1, e2):
+            e1 = compile_closure(e1, scope)
+            inner = Scope(scope)
+            index = inner.declare(name)
+            e2 = compile_closure(e2, inner, tail)
+            # the frame size is only known once the whole body has been compiled
+            template = inner.template()
+            def let(frame):
+                new = template.copy()
+                new[0] = frame
+                new[index] = e1(frame)
+                return e2(new)
+            return let
+
+        case LetAnd(Variable(name1), expr1, Variable(name2), expr2, expr3):
+            expr1 = compile_closure(expr1, scope)
+            expr2 = compile_closure(expr2, scope)
+            inner = Scope(scope)
+            set2 = store_or_bind(name2, inner)
+            set1 = store_or_bind(name1, inner)
+            expr3 = compile_closure(expr3, inner, tail)
+            template = inner.template()
+            def let_and(frame):
+                v1 = expr1(frame)
+                v2 = expr2(frame)
+                new = template.copy()
+                new[0] = frame
+                set2(new, v2)
+                set1(new, v1)
+                return expr3(new)
+            return let_and
+
+        case BinOp(op, left, right):
+            if op not in binary_operators:
+                raise InvalidProgram()
+            fn = binary_operators[op]
+            left = compile_closure(left, scope)
+            if isinstance(right, NumLiteral):
+                # `a + 1`, `i < 10`, ...: no call for the constant
+                constant = as_number(right.value)
+                return lambda frame: fn(left(frame), constant)
+            right = compile_closure(right, scope)
+            return lambda frame: fn(left(frame), right(frame))
+
+        case Two_Str_concatenation():
+            operands = [compile_closure(operand, scope) for operand in concatenation_operands(program)]
+            if len(operands) == 2:
+                str1, str2 = operands
+                return lambda frame: concat(str1(frame), str2(frame))
+            # a chain of them is one closure with a loop, not one closure per link
+            first, rest = operands[0], operands[1:]
+            def concatenation(frame):
+                value = first(frame)
+                for operand in rest:
+                    value = concat(value, operand(frame))
+                return value
+            return concatenation
+
+        case Str_slicing(str1, start, end):
+            str1 = compile_closure(str1, scope)
+            start = compile_closure(start, scope)
+            end = compile_closure(end, scope)
+            return lambda frame: slice_string(str1(frame), start(frame), end(frame))
+
+        case if_else(expr, et, ef):
+            expr = compile_closure(expr, scope)
+            et = compile_closure(et, scope, tail)
+            ef = compile_closure(ef, scope, tail)
+            return lambda frame: et(frame) if expr(frame) == True else ef(frame)
+
+        case while_loop(condition, body):
+            condition = compile_closure(condition, scope)
+            body = compile_closure(body, scope)
+            def loop(frame):
+                # a Let left by break/continue needs no unwinding: its frame
+                # was only ever passed down
+                while condition(frame) == True:
+                    try:
+                        body(frame)
+                    except BreakLoop:
+                        break
+                    except ContinueLoop:
+                        pass
+                return None
+            return loop
+
+        case for_loop(Variable(name), e1, condition, updt, body):
+            e1 = compile_closure(e1, scope)
+            set_ = store_or_bind(name, scope)
+            condition = compile_closure(condition, scope)
+            updt = compile_closure(updt, scope)
+            body = compile_closure(body, scope)
+            def loop(frame):
+                set_(frame, e1(frame))
+                while condition(frame) == True:
+                    try:
+                        body(frame)
+                    except BreakLoop:
+                        break
+                    except ContinueLoop:
+                        pass
+                    set_(frame, updt(frame))
+                return None
+            return loop
+
+        case Break():
+            def break_(frame):
+                raise BreakLoop()
+            return break_
+
+        case Continue():
+            def continue_(frame):
+                raise ContinueLoop()
+            return continue_
+
+        case Seq([]):
+            return lambda frame: None
+
+        case Seq(body):
+            first = [compile_closure(item, scope) for item in body[:-1]]
+            last = compile_closure(body[-1], scope, tail)
+            def seq(frame):
+                for item in first:
+                    item(frame)
+                return last(frame)
+            return seq
+
+        case Print(e1):
+            e1 = compile_closure(e1, scope)
+            def print_(frame):
+                value = e1(frame)
+                print(value)
+                return value
+            return print_
+
+        case LetFun(Variable(name), params, body, expr):
+            # the frame that binds the function's name is the parent of the
+            # frame of every call, so the body sees the variables around the
+            # LetFun, itself included
+            inner = Scope(scope)
+            index = inner.declare(name)
+            fscope = Scope(inner)
+            for p in params:
+                fscope.declare(p.name)
+            fn = Function(name, [p.name for p in params], compile_closure(body, fscope, True), fscope.template())
+            expr = compile_closure(expr, inner, tail)
+            template = inner.template()
+            def let_fun(frame):
+                new = template.copy()
+                new[0] = frame
+                new[index] = Closure(fn, new)
+                return expr(new)
+            return let_fun
+
+        case FunCall(Variable(name), args):
+            get_fn = load(name, scope)
+            args = [compile_closure(arg, scope) for arg in args]
+            count = len(args)
+            def call_frame(frame):
+                closure = get_fn(frame)
+                if type(closure) is not Closure or len(closure.function.params) != count:
+                    raise InvalidProgram()
+                fn = closure.function
+                new = fn.template.copy()
+                new[0] = closure.frame
+                new[FRAME_HEADER:FRAME_HEADER + count] = [arg(frame) for arg in args]
+                return fn, new
+            if tail:
+                return lambda frame: TailCall(*call_frame(frame))
+            def call(frame):
+                fn, new = call_frame(frame)
+                result = fn.body(new)
+                while type(result) is TailCall:
+                    result = result.fn.body(result.frame)
+                return result
+            return call
+
+        case UBoolOp(Variable(name), expr):
+            expr = compile_closure(expr, scope)
+            get = load(name, scope)
+            def ubool(frame):
+                expr(frame)
+                value = get(frame)
+                # strings are true when non-empty, numbers when non-zero
+                if is_string(value):
+                    return value != ""
+                return value != 0
+            return ubool
+
+    raise InvalidProgram()
+
+
+def bench_closures(n=1000, repeat=5):
+    program = counting_loop(n)
+    compiled = compile_to_closure(program)
+    t_eval = min(timeit_(lambda: eval(program)) for _ in range(repeat))
+    t_closure = min(timeit_(lambda: compiled(compiled.new_frame())) for _ in range(repeat))
+    return t_eval, t_closure, t_eval / t_closure
+
+
+def test_closures_match_eval():
+    for program, expected in example_programs():
+        assert closure_eval(program) == eval(program) == expected
+
+def test_closure_functions():
+    a=Variable('a')
+    b=Variable('b')
+    x=Variable('x')
+    f=Variable('f')
+    e=LetFun(f,[a,b],BinOp("+",a,b),FunCall(f,[NumLiteral(15),NumLiteral(2)]))
+    assert closure_eval(e)==17
+    # the body sees the variables around its LetFun, not those of its caller
+    e=Let(a,NumLiteral(1),LetFun(f,[x],BinOp("+",x,a),Let(a,NumLiteral(5),FunCall(f,[NumLiteral(1)]))))
+    assert closure_eval(e)==2
+    # a tail-recursive function runs in constant Python stack
+    loop=if_else(BinOp("<",x,NumLiteral(1)),a,FunCall(f,[BinOp("-",x,NumLiteral(1)),BinOp("+",a,NumLiteral(2))]))
+    assert closure_eval(LetFun(f,[x,a],loop,FunCall(f,[NumLiteral(100000),NumLiteral(0)])))==200000
+    import pytest
+    with pytest.raises(InvalidProgram):
+        closure_eval(LetFun(f,[a],a,FunCall(f,[])))
+
+def test_closure_strings():
+    a=Variable('a')
+    expr = Str_slicing(StringLiteral("abcdefg"), NumLiteral(0), NumLiteral(4))
+    assert closure_eval(expr) == 'abcd'
+    assert closure_eval(Let(a,StringLiteral(""),UBoolOp(a,NumLiteral(0)))) == False
+    chain = StringLiteral("")
+    for k in range(5000):
+        chain = Two_Str_concatenation(chain, StringLiteral("ab"))
+    assert closure_eval(chain) == "ab" * 5000
+    # each link reads the string as it is when the link is reached
+    e = LetMut(a,StringLiteral("x"),Two_Str_concatenation(Two_Str_concatenation(Get(a),Seq([Put(a,StringLiteral("y")),Get(a)])),Get(a)))
+    assert closure_eval(e) == eval(e) == "xyy"
+
+def test_closure_environment():
+    a=Variable('a')
+    env=Environment()
+    env.add("a",10)
+    assert closure_eval(Put(a,BinOp("+",a,NumLiteral(1))),env)==11
+    assert env.get("a")==11
+    # a for_loop or LetAnd updates a variable of the environment, and binds
+    # one where eval would when there is none
+    zz=Variable('zz')
+    q=Variable('q')
+    f=Variable('f')
+    loop=for_loop(zz,NumLiteral(0),BinOp("<",zz,NumLiteral(3)),Put(zz,BinOp("+",zz,NumLiteral(1))),NumLiteral(0))
+    for e in (loop,Seq([loop,zz]),Let(q,NumLiteral(1),Seq([loop,zz])),
+              LetAnd(zz,NumLiteral(5),q,NumLiteral(6),BinOp("+",zz,q)),
+              LetFun(f,[q],Seq([loop,BinOp("+",zz,q)]),FunCall(f,[NumLiteral(1)]))):
+        for bound in (False,True):
+            env1,env2=Environment(),Environment()
+            if bound:
+                env1.add("zz",100)
+                env2.add("zz",100)
+            assert closure_eval(e,env1)==eval(e,env2)
+            assert env1.env==env2.env
+
+def test_closure_reuse():
+    # compiled once, run with a fresh frame each time
+    compiled = compile_to_closure(counting_loop(10))
+    assert compiled(compiled.new_frame()) == compiled(compiled.new_frame()) == 90
+    assert closure_eval(counting_loop(100000)) == 9999900000
+
+
+# print(bench_closures()) # Uncomment to compare eval and the closures on a loop.
+print("test_closures_match_eval(): ", test_closures_match_eval())
+print("test_closure_functions(): ", test_closure_functions())
+print("test_closure_strings(): ", test_closure_strings())
+print("test_closure_environment(): ", test_closure_environment())
+print("test_closure_reuse(): ", test_closure_reuse())
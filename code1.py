@@ -1,41 +1,173 @@
-from dataclasses import dataclass
+from collections import OrderedDict
+from dataclasses import dataclass, field, fields, make_dataclass
 from fractions import Fraction
 
 from typing import Union, Mapping,  Optional  #Union is used to specify that a variable can have one of several types and Mapping is a type hint for dictionaries or mappings.
-from typing import List
+from typing import ClassVar, List
+import time
+import weakref
 
 
 
-@dataclass
+# frozen so that instances are hashable and can be used as field defaults
+@dataclass(frozen=True)
 class NumType:
     pass
 
-@dataclass
+@dataclass(frozen=True)
 class BoolType:
     pass
-@dataclass
+@dataclass(frozen=True)
 class StringType:
     pass
+# the type of loops, which evaluate to None
+@dataclass(frozen=True)
+class UnitType:
+    pass
 
-SimType = NumType | BoolType | StringType
+SimType = NumType | BoolType | StringType | UnitType
 
 
-@dataclass
-#  The _init_ method takes any number of arguments and passes them to the Fraction constructor to create a new Fraction object, which is then stored in the value field.
+# Numbers are plain ints for as long as they are whole, and only become a Fraction
+# when a division does not come out even. int arithmetic is many times cheaper than
+# Fraction arithmetic and an int compares equal to the same Fraction.
+def as_number(value):
+    if value.denominator == 1:
+        return value.numerator
+    return value
+
+exact_numbers = (int, Fraction)
+
+def divide(left, right):
+    if type(left) is int and type(right) is int and right != 0 and left % right == 0:
+        return left // right
+    if type(left) in exact_numbers and type(right) in exact_numbers:
+        return as_number(Fraction(left) / right)
+    # anything else (a string, say) fails as it would without ints
+    return left / right
+
+
+# Strings built by repeated concatenation. A Rope keeps its pieces in a list and
+# only joins them when the whole string is needed. Appending to the newest Rope
+# over a list adds to that list instead of copying it, so a loop that grows a
+# string one piece at a time does O(n) work instead of O(n^2). Ropes only live
+# inside eval: the value eval returns is always a plain str.
+class Rope:
+    __slots__ = ("pieces", "count", "length", "joined")
+
+    def __init__(self, pieces, count, length):
+        self.pieces = pieces    # shared with the Ropes this one was appended to
+        self.count = count      # this Rope is pieces[:count]
+        self.length = length
+        self.joined = None
+
+    def append(self, piece: str) -> 'Rope':
+        if self.count == len(self.pieces):
+            # nothing has been appended after this Rope yet
+            self.pieces.append(piece)
+            return Rope(self.pieces, self.count + 1, self.length + len(piece))
+        return Rope(self.pieces[:self.count] + [piece], self.count + 1, self.length + len(piece))
+
+    def __str__(self):
+        if self.joined is None:
+            self.joined = "".join(self.pieces[:self.count])
+        return self.joined
+
+    def __repr__(self):
+        return repr(str(self))
+
+    def __len__(self):
+        return self.length
+
+    def __hash__(self):
+        return hash(str(self))
+
+    def __eq__(self, other):
+        return str(self) == as_str(other)
+
+    def __lt__(self, other):
+        return str(self) < as_str(other)
+
+    def __gt__(self, other):
+        return str(self) > as_str(other)
+
+    def __add__(self, other):
+        return concat(self, other)
+
+    def __radd__(self, other):
+        return concat(other, self)
+
+
+rope_threshold = 1024   # shorter strings are cheaper to copy than to keep in pieces
+
+def as_str(value):
+    if isinstance(value, Rope):
+        return str(value)
+    return value
+
+def is_string(value):
+    return isinstance(value, (str, Rope))
+
+def concat(left, right):
+    if isinstance(left, Rope):
+        return left.append(as_str(right))
+    right = as_str(right)
+    if not isinstance(left, str) or not isinstance(right, str):
+        raise TypeError("can only concatenate strings")
+    if len(left) + len(right) < rope_threshold:
+        return left + right
+    return Rope([left, right], 2, len(left) + len(right))
+
+def is_index(value):
+    return isinstance(value, (int, Fraction)) and not isinstance(value, bool) and value.denominator == 1
+
+def slice_string(value, start, end):
+    # native slicing: O(end - start), whatever the length of the string
+    value = as_str(value)
+    if not isinstance(value, str) or not is_index(start) or not is_index(end):
+        raise InvalidProgram()
+    return value[int(start):int(end)]
+
+
+# AST nodes have __slots__ instead of an instance dict, and a literal keeps its
+# type on its class, so a node takes no more memory than its fields. Variables,
+# booleans and small whole numbers are interned: Variable("a") or NumLiteral(1)
+# gives back the node built before, if there is one. Nodes are never changed
+# once built (typecheck only fills in the type of a BinOp or an if_else), so
+# sharing them is safe.
+small_numbers = range(-5, 257)
+numbers = {}
+booleans = {}
+variables = weakref.WeakValueDictionary()   # a name is forgotten with its last Variable
+
+@dataclass(slots=True)
+#  The _init_ method takes any number of arguments and passes them to the Fraction constructor, and keeps the result as an int when it is whole.
 class NumLiteral:
     value: Fraction
-    type: SimType = NumType()
+    type: ClassVar[SimType] = NumType()
+
+    def __new__(cls, *args):
+        if len(args) == 1 and type(args[0]) is int and args[0] in small_numbers:
+            node = numbers.get(args[0])
+            if node is None:
+                node = numbers[args[0]] = object.__new__(cls)
+            return node
+        return object.__new__(cls)
+
     def __init__(self, *args):
-        self.value = Fraction(*args)
+        if len(args) == 1 and type(args[0]) is int:
+            self.value = args[0]
+        else:
+            self.value = as_number(Fraction(*args))
 
 
-@dataclass
+@dataclass(slots=True)
 class StringLiteral:
     word : str 
-    type: SimType = StringType()
+    type: ClassVar[SimType] = StringType()
 
 
-@dataclass
+@dataclass(slots=True)
 # this is kind of binary operation
 class BinOp:                      
     operator: str      # '+' is the operator in addition
@@ -46,30 +178,41 @@ class BinOp:
     type: Optional[SimType] = None
 
 
-@dataclass
+@dataclass(slots=True, weakref_slot=True)
 class Variable:
     name: str
 
-
-@dataclass
-class StringLiteral:
-    word : str 
-
+    def __new__(cls, name=None):
+        if name is None:    # copy and pickle build the node first, then fill it in
+            return object.__new__(cls)
+        node = variables.get(name)
+        if node is None:
+            node = object.__new__(cls)
+            variables[name] = node
+        return node
 
 
-@dataclass
+@dataclass(slots=True)
 class Let:
     var: 'AST'
     e1: 'AST'
     e2: 'AST'
 
-@dataclass
+@dataclass(slots=True)
 class BoolLiteral:
     value: bool
-    type: SimType = BoolType()
+    type: ClassVar[SimType] = BoolType()
 
+    def __new__(cls, value=None):
+        if type(value) is not bool:
+            return object.__new__(cls)
+        node = booleans.get(value)
+        if node is None:
+            node = booleans[value] = object.__new__(cls)
+        return node
 
-@dataclass
+
+@dataclass(slots=True)
 class if_else:
     expr: 'AST'
     et: 'AST'    #statement if expr is true
@@ -77,13 +220,13 @@ class if_else:
     type: Optional[SimType] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class while_loop:
     condition: 'AST'
     body: 'AST'
 
 
-@dataclass
+@dataclass(slots=True)
 class for_loop:
     var: 'AST'
     expr: 'AST'
@@ -92,12 +235,22 @@ class for_loop:
     body: 'AST'
 
 
-@dataclass
+@dataclass(slots=True)
+class Break:
+    pass
+
+
+@dataclass(slots=True)
+class Continue:
+    pass
+
+
+@dataclass(slots=True)
 class Two_Str_concatenation:
     str1: 'AST'
     str2: 'AST'
 
-@dataclass
+@dataclass(slots=True)
 
 class Str_slicing:
     str1: 'AST'
@@ -105,68 +258,77 @@ class Str_slicing:
     end: 'AST'
 
 
-@dataclass
+@dataclass(slots=True)
 class LetMut:
     var: 'AST'
     e1: 'AST'
     e2: 'AST'
 
 
-@dataclass
+@dataclass(slots=True)
 class Seq:
     body: List['AST']
 
-@dataclass
-class LetMut:
-    var: 'AST'
-    e1: 'AST'
-    e2: 'AST'
-
-@dataclass
+@dataclass(slots=True)
 class Put:
     var: 'AST'
     e1: 'AST'
 
-@dataclass
+@dataclass(slots=True)
 
 class Assign:
     var: 'AST'
     e1: 'AST'
 
-@dataclass
+@dataclass(slots=True)
 
 class Get:
     var: 'AST'
 
-@dataclass
+@dataclass(slots=True)
 class Print:
     e1: 'AST'
 
-@dataclass
+@dataclass(slots=True)
 class LetFun:
     name:'AST'
     params:List['AST']
     body:'AST'
     expr:'AST'
 
-@dataclass
+@dataclass(slots=True)
 class FunCall:
     fn:'AST'
     args: List['AST']
 
+# A function value. It keeps the scopes it was defined in, so its body sees the
+# variables around the LetFun and not those of whoever calls it.
 @dataclass
 class FnObject:
     params: List['AST']
     body: 'AST'
+    env: List = field(default=None, repr=False, compare=False)
+    cache: 'FunctionCache' = field(default=None, repr=False, compare=False)   # see Memo
 
-@dataclass
+# What a call in tail position evaluates to: the function and the frame to run
+# it in. The FunCall that made the call runs them in a loop, so a chain of tail
+# calls, however long, takes no Python stack.
+class TailCall:
+    __slots__ = ("fn", "frame", "key")
+
+    def __init__(self, fn, frame, key=None):
+        self.fn = fn
+        self.frame = frame
+        self.key = key      # the call's key in fn.cache, if fn is memoized
+
+@dataclass(slots=True)
 class LetAnd:
     var1:'AST'
     expr1: 'AST'
     var2:'AST'
     expr2:'AST'
     expr3:'AST'
-@dataclass
+@dataclass(slots=True)
 class UBoolOp:
     var:'AST'  
     expr: 'AST' 
@@ -175,47 +337,65 @@ class UBoolOp:
 class Environment:
     env: List
 
-    def __init__(self):
-        self.env=[{}]
+    def __init__(self, env=None):
+        # env: the scopes to start from, a call frame's are those of the function
+        self.env=[{}] if env is None else env
+        self.memo=None      # the Memo of the run, if it memoizes functions
+        self.budget=None    # the Budget of the run, if it has limits
+        self.calls=0        # the calls evaluate is running inside one another, for FunCall
+        # name -> the scope (dict) that currently holds it. Entering a scope
+        # cannot invalidate an entry, since the new scope is empty; add() points
+        # the name at the innermost scope and exit_scope() drops the entries of
+        # the scope being popped.
+        self.cache={}
 
     def enter_scope(self):
         self.env.append({})
 
     def exit_scope(self):
         assert self.env
-        self.env.pop()
+        scope=self.env.pop()
+        for name in scope:
+            self.cache.pop(name,None)
+
+    def unwind(self,depth):
+        # drop every scope entered since the environment had `depth` scopes,
+        # used when a break/continue jumps out of nested Lets
+        while len(self.env) > depth:
+            self.exit_scope()
+
+    def lookup(self,name):
+        # the innermost scope that binds name, or None if it is not bound at all
+        scope=self.cache.get(name)
+        if scope is not None:
+            return scope
+        for scope in reversed(self.env):
+            if name in scope:
+                self.cache[name]=scope
+                return scope
+        return None
 
     def add(self,name,value):
         assert name not in self.env[-1]
         self.env[-1][name]=value
+        self.cache[name]=self.env[-1]
 
     def check(self,name):
-        for dict in reversed(self.env):
-            if name in dict:
-                return True
-            else:
-                return False
+        return self.lookup(name) is not None
             
     def get(self,name):
-        for dict in reversed(self.env):
-            if name in dict:
-                return dict[name]
-        raise KeyError()
+        scope=self.lookup(name)
+        if scope is None:
+            raise KeyError(name)
+        return scope[name]
     
     def update(self,name,value):
+        scope=self.lookup(name)
+        if scope is None:
+            raise KeyError(name)
+        scope[name]=value
 
-        for dict in reversed(self.env):
-            if name in dict:
-                dict[name]=value
-                return
-
-        raise KeyError()
-
-AST = NumLiteral | BinOp | Variable | Let | if_else | LetMut | Put | Get |Seq | Print | while_loop    
-        raise KeyError()
-    
-
-AST = NumLiteral | BinOp | Variable | Let | if_else | LetMut | Put | Get | Assign |Seq | Print | while_loop | FunCall | StringLiteral | UBoolOp
+AST = NumLiteral | BoolLiteral | BinOp | Variable | Let | if_else | LetMut | Put | Get | Assign |Seq | Print | while_loop | for_loop | Break | Continue | FunCall | LetFun | LetAnd | StringLiteral | Two_Str_concatenation | Str_slicing | UBoolOp
 
 
 
@@ -223,65 +403,571 @@ AST = NumLiteral | BinOp | Variable | Let | if_else | LetMut | Put | Get | Assig
 
 
 
-Value = Fraction | bool | str
+Value = int | Fraction | bool | str
 
 
 # The InvalidProgram exception is defined. This exception will be raised when an invalid program is encountered during evaluation.
 class InvalidProgram(Exception):
     pass
 
+# Break and Continue are raised as exceptions and caught by the innermost loop.
+# They derive from InvalidProgram so that a break outside of any loop is reported as one.
+class BreakLoop(InvalidProgram):
+    pass
+
+class ContinueLoop(InvalidProgram):
+    pass
+
 # environment is a mapping of variable names to their values and is used to keep track of the state of the program during evaluation. 
 # The function returns the final value of the program.
 
 # Type check
-def typecheck(program: AST, env = None) -> AST:
-    match program:
-        case NumLiteral() as t: # already typed.
-            return t
-        case BoolLiteral() as t: # already typed.
-            return t
-        case StringLiteral() as t:
-            return t
-        case BinOp(op, left, right) if op in "+*-/":
-            tleft = typecheck(left)
-            tright = typecheck(right)
-            if tleft.type != NumType() or tright.type != NumType():
-                raise TypeError()
-            return BinOp(op, left, right, NumType())
-        case BinOp("<", left, right):
-            tleft = typecheck(left)
-            tright = typecheck(right)
-            if tleft.type != NumType() or tright.type != NumType():
-                raise TypeError()
-            return BinOp("<", left, right, BoolType())
-        case BinOp("=", left, right):
-            tleft = typecheck(left)
-            tright = typecheck(right)
-            if tleft.type != tright.type:
-                raise TypeError()
-            return BinOp("=", left, right, BoolType())
-        case if_else(c, t, f): # We have to typecheck both branches.
-            tc = typecheck(c)
-            if tc.type != BoolType():
-                raise TypeError()
-            tt = typecheck(t)
-            tf = typecheck(f)
-            if tt.type != tf.type: # Both branches must have the same type.
-                raise TypeError()
-            return if_else(tc, tt, tf, tt.type) # The common type becomes the type of the if-else.
+# typecheck works out the types bottom-up in a single pass. It writes each
+# node's type into the node's `type` field, where it has one, and returns the
+# program itself. Variables get the type of the value bound to them; a mutable
+# variable has to keep that type. Functions are typed at each call, from the
+# types of the arguments, since a LetFun does not say what its parameters are.
+# env, if given, maps the free variables of program to their types.
+#
+# The type of every subtree is recorded in `types`, keyed by the node's id(),
+# together with the types of the variables from outside the subtree it read.
+# A subtree that occurs more than once (the same e2 used twice, say) is
+# checked again only where one of those variables has another type. Subtrees
+# that change a variable from outside or call a function are not recorded.
+# Passing the same table to several calls shares that work between them.
+def typecheck(program: AST, env: Environment = None, types = None) -> AST:
+    TypeChecker(env, types).type_of(program)
+    return program
+
+
+# The type of an expression may be None while it is being worked out: Break
+# and Continue never produce a value, and neither does a recursive call whose
+# result is still being typed. None fits wherever a type is expected.
+def unify(t1, t2):
+    if t1 is None:
+        return t2
+    if t2 is None or t1 == t2:
+        return t1
     raise TypeError()
 
 
+class Uses:
+    # what the type of a node being checked depends on from outside the node,
+    # where the scopes of env below `depth` are outside it
+    __slots__ = ("env", "depth", "reads", "changes", "calls")
+
+    def __init__(self, env: Environment):
+        self.env = env
+        self.depth = len(env.env)
+        self.reads = {}         # name -> (index of its scope, its type)
+        self.changes = False    # whether it gave a variable from outside a type
+        self.calls = False      # whether it called a function
+
+    def read(self, env, index, name, t):
+        if env is self.env and index < self.depth:
+            self.reads[name] = (index, t)
+
+    def changed(self, env, index):
+        if env is not self.env or index < self.depth:
+            self.changes = True
+
+    def add(self, inner: 'Uses'):
+        # what a node inside this one depends on
+        if inner.env is not self.env:
+            self.calls = True
+            return
+        self.calls = self.calls or inner.calls
+        self.changes = self.changes or inner.changes
+        for name, (index, t) in inner.reads.items():
+            self.read(inner.env, index, name, t)
+
+
+class TypeChecker:
+    def __init__(self, env: Environment = None, types = None):
+        self.env = env if env is not None else Environment()
+        # id(node) -> (node, [(the types it read, its type), ...]); the node is
+        # kept alongside so that its id cannot be reused
+        self.types = types if types is not None else {}
+        self.uses = [Uses(self.env)]    # one for every node being checked, innermost last
+        # (function body, argument types) of the calls being typed
+        self.calls = set()
+
+    def scope_index(self, name):
+        scopes = self.env.env
+        for index in range(len(scopes) - 1, -1, -1):
+            if name in scopes[index]:
+                return index
+        return None
+
+    def lookup(self, name):
+        index = self.scope_index(name)
+        if index is None:
+            raise TypeError()
+        t = self.env.env[index][name]
+        if isinstance(t, FnObject):   # functions can only be called
+            raise TypeError()
+        self.uses[-1].read(self.env, index, name, t)
+        return t
+
+    def changed(self, name):
+        # name's variable has just been given a type
+        self.uses[-1].changed(self.env, self.scope_index(name))
+
+    def bind(self, name, t):
+        # like eval, bind in the innermost scope, or update a visible binding
+        if self.env.check(name):
+            self.env.update(name, unify(self.lookup(name), t))
+        else:
+            self.env.add(name, t)
+        self.changed(name)
+
+    def recorded(self, program: AST):
+        # the type recorded for program, if the variables it read have the same
+        # types here; those reads are then reads of the node being checked
+        for reads, t in self.types[id(program)][1]:
+            here = []
+            for name, (_, t_read) in reads.items():
+                index = self.scope_index(name)
+                if index is None or self.env.env[index][name] != t_read:
+                    break
+                here.append((index, name, t_read))
+            else:
+                for index, name, t_read in here:
+                    self.uses[-1].read(self.env, index, name, t_read)
+                return t
+        return missing
+
+    def type_of(self, program: AST) -> Optional[SimType]:
+        key = id(program)
+        if key in self.types:
+            t = self.recorded(program)
+            if t is not missing:
+                return t
+        uses = Uses(self.env)
+        self.uses.append(uses)
+        try:
+            t = self.check(program)
+        finally:
+            self.uses.pop()
+        if t is not getattr(program, "type", t):
+            program.type = t
+        self.uses[-1].add(uses)
+        if not uses.calls and not uses.changes:
+            self.types.setdefault(key, (program, []))[1].append((uses.reads, t))
+        return t
+
+    def check(self, program: AST) -> Optional[SimType]:
+        type_of = self.type_of
+        match program:
+            case NumLiteral() | BoolLiteral() | StringLiteral(): # already typed.
+                return program.type
+
+            case BinOp(op, left, right) if op in ("+", "-", "*", "/"):
+                unify(type_of(left), NumType())
+                unify(type_of(right), NumType())
+                return NumType()
+            case BinOp("<" | ">", left, right):
+                # numbers, or strings in dictionary order
+                if unify(type_of(left), type_of(right)) not in (None, NumType(), StringType()):
+                    raise TypeError()
+                return BoolType()
+            case BinOp("=" | "==", left, right):
+                unify(type_of(left), type_of(right))
+                return BoolType()
+
+            case if_else(c, et, ef): # We have to typecheck both branches.
+                unify(type_of(c), BoolType())
+                return unify(type_of(et), type_of(ef)) # Both branches must have the same type.
+
+            case Variable(name) | Get(Variable(name)):
+                return self.lookup(name)
+
+            case Put(Variable(name), e1):
+                t = type_of(e1)
+                self.env.update(name, unify(self.lookup(name), t))
+                self.changed(name)
+                return t
+
+            case Assign(Variable(name), e1):
+                t = type_of(e1)
+                # eval adds the name to the innermost scope
+                if name in self.env.env[-1]:
+                    self.env.update(name, unify(self.env.get(name), t))
+                else:
+                    self.env.add(name, t)
+                self.changed(name)
+                return StringType()     # Assign evaluates to the name
+
+            case Let(Variable(name), e1, e2) | LetMut(Variable(name), e1, e2):
+                t1 = type_of(e1)
+                self.env.enter_scope()
+                self.env.add(name, t1)
+                t2 = type_of(e2)
+                self.env.exit_scope()
+                return t2
+
+            case LetAnd(Variable(name1), expr1, Variable(name2), expr2, expr3):
+                t1 = type_of(expr1)
+                t2 = type_of(expr2)
+                self.env.enter_scope()
+                self.bind(name1, t1)
+                self.bind(name2, t2)
+                t3 = type_of(expr3)
+                self.env.exit_scope()
+                return t3
+
+            case Seq(body):
+                t = UnitType()
+                for item in body:
+                    t = type_of(item)
+                return t
+
+            case while_loop(condition, body):
+                unify(type_of(condition), BoolType())
+                type_of(body)
+                return UnitType()
+
+            case for_loop(Variable(name), e1, condition, updt, body):
+                self.bind(name, type_of(e1))
+                unify(type_of(condition), BoolType())
+                type_of(body)
+                self.bind(name, type_of(updt))
+                return UnitType()
+
+            case Break() | Continue():
+                return None
+
+            case Two_Str_concatenation(str1, str2):
+                unify(type_of(str1), StringType())
+                unify(type_of(str2), StringType())
+                return StringType()
+
+            case Str_slicing(str1, start, end):
+                unify(type_of(str1), StringType())
+                unify(type_of(start), NumType())
+                unify(type_of(end), NumType())
+                return StringType()
+
+            case LetFun(Variable(name), params, body, expr):
+                self.env.enter_scope()
+                self.env.add(name, FnObject(params, body, self.env.env.copy()))
+                t = type_of(expr)
+                self.env.exit_scope()
+                return t
+
+            case FunCall(Variable(name), args):
+                self.uses[-1].calls = True
+                fn = self.env.get(name) if self.env.check(name) else None
+                if not isinstance(fn, FnObject) or len(fn.params) != len(args):
+                    raise TypeError()
+                arg_types = tuple(type_of(arg) for arg in args)
+                call = (id(fn.body), arg_types)
+                if call in self.calls:
+                    return None     # a recursive call: its type is the one being worked out
+                self.calls.add(call)
+                # the body is typed in the scopes of its LetFun, like eval runs it
+                caller, self.env = self.env, Environment(fn.env + [{}])
+                for par, t in zip(fn.params, arg_types):
+                    self.env.add(par.name, t)
+                try:
+                    t = type_of(fn.body)
+                finally:
+                    self.env = caller
+                    self.calls.remove(call)
+                return t
+
+            case UBoolOp(Variable(name), expr):
+                type_of(expr)
+                if self.lookup(name) not in (NumType(), StringType()):
+                    raise TypeError()
+                return BoolType()
+
+            case Print(e1):
+                return type_of(e1)
+
+        raise TypeError()
+
 
 #typecheck
 
 
-def eval(program: AST, environment: Environment = None) -> Value:
+def eval(program: AST, environment: Environment = None, memo: 'Memo' = None, budget: 'Budget' = None) -> Value:
+    # memo: memoize the pure functions the program defines, see Memo
+    # budget: stop the run with BudgetExceeded once it goes over, see Budget
     if environment is None:
         environment = Environment()
-
+    if budget is not None:
+        budget.start()
+    saved = environment.memo, environment.budget
+    environment.memo, environment.budget = memo, budget
+    try:
+        return as_str(evaluate(program, environment))
+    finally:
+        environment.memo, environment.budget = saved
+
+
+# Memoization of pure functions, for eval(program, memo=Memo()).
+#
+# A function is pure when its body cannot Print, Assign, Break or Continue,
+# changes only variables of its own and calls only itself, functions it
+# defines and other memoized functions that read nothing from around their
+# LetFun. Its result then depends on nothing but its arguments and the
+# variables it reads from around its LetFun, which together are the key of
+# its cache: a variable changed between two calls gives another key.
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+
+
+class FunctionCache:
+    # the results of one function value, least recently used first
+    __slots__ = ("free", "results", "maxsize", "stats")
+
+    def __init__(self, free, maxsize, stats):
+        self.free = free        # the names the body reads from around its LetFun
+        self.results = OrderedDict()
+        self.maxsize = maxsize
+        self.stats = stats
+
+    def key(self, argv, frame):
+        # None when the call cannot be cached: a free name is not bound, or a
+        # value (a function, say) cannot be hashed
+        try:
+            values = argv + [frame.get(name) for name in self.free]
+        except KeyError:
+            return None
+        # the type too, so that 1 and True, which compare equal, are told apart
+        key = tuple((type(value), value) for value in values)
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def get(self, key):
+        results = self.results
+        if key in results:
+            results.move_to_end(key)
+            self.stats.hits += 1
+            return results[key]
+        self.stats.misses += 1
+        return missing
+
+    def put(self, key, value):
+        self.results[key] = value
+        if len(self.results) > self.maxsize:
+            self.results.popitem(last=False)
+
+
+missing = object()
+
+
+class Memo:
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize      # results kept per function value
+        self.stats = {}             # function name -> CacheStats
+        self.effects = {}           # id(LetFun) -> (LetFun, function_effects of it)
+
+    def cache_for(self, program, environment) -> Optional[FunctionCache]:
+        # a cache for the function program defines in environment, or None if it is not pure
+        found = self.effects.get(id(program))
+        if found is None or found[0] is not program:
+            found = self.effects[id(program)] = (program, function_effects(program))
+        effects = found[1]
+        if effects is None:
+            return None
+        free, callees = effects
+        for name in callees:
+            fn = environment.get(name) if environment.check(name) else None
+            if not isinstance(fn, FnObject) or fn.cache is None or fn.cache.free:
+                return None
+        stats = self.stats.setdefault(program.name.name, CacheStats())
+        return FunctionCache(free, self.maxsize, stats)
+
+
+def function_effects(program: 'LetFun'):
+    # (free, callees) for a pure function: the names its body reads from
+    # around the LetFun and the functions from there that it calls; None if
+    # the function may have an effect
+    free = set()
+    callees = set()
+    bound = frozenset([program.name.name] + [p.name for p in program.params])
+    todo = [(program.body, bound)]
+    while todo:
+        node, bound = todo.pop()
+        match node:
+            case Print() | Assign() | Break() | Continue():
+                return None
+            case Put(Variable(name), _) | for_loop(Variable(name), _, _, _, _) if name not in bound:
+                return None
+            case LetAnd(Variable(name1), _, Variable(name2), _, _) if name1 not in bound or name2 not in bound:
+                return None
+            case Variable(name) | Get(Variable(name)) | UBoolOp(Variable(name), _) if name not in bound:
+                free.add(name)
+            case FunCall(Variable(name), _) if name not in bound:
+                callees.add(name)
+        match node:
+            case Let(Variable(name), e1, e2) | LetMut(Variable(name), e1, e2):
+                todo.append((e1, bound))
+                todo.append((e2, bound | {name}))
+            case LetFun(Variable(name), params, body, expr):
+                todo.append((body, bound | {name} | {p.name for p in params}))
+                todo.append((expr, bound | {name}))
+            case FunCall(_, args):
+                todo.extend((arg, bound) for arg in args)
+            case _:
+                for value in [getattr(node, f.name) for f in fields(node)]:
+                    if isinstance(value, list):
+                        todo.extend((item, bound) for item in value if isinstance(item, AST))
+                    elif isinstance(value, AST):
+                        todo.append((value, bound))
+    return tuple(sorted(free)), callees
+
+
+# Limits on a run of untrusted code, for eval(program, budget=Budget(...)).
+#
+# steps counts the nodes evaluate visits, other than literals and variables,
+# and every time round a loop; seconds is wall time; string_length and
+# number_bits cap the size of any one string or number a BinOp or a
+# concatenation makes, which is where the memory of a run goes. A limit of
+# None is no limit. The run stops with BudgetExceeded at the node it was
+# evaluating when it went over. A string repeated by a number is measured
+# before it is made, as is a product of ints that is too long whatever
+# its exact value, so that a run never holds a value far over its limit.
+#
+# evaluate only adds one to a counter per node and compares it with
+# check_at; the limits themselves are looked at when the counter gets there,
+# which is every `interval` steps when there is a time limit, so the clock is
+# read once per interval and not once per node.
+class BudgetExceeded(InvalidProgram):
+    def __init__(self, limit, used, maximum, node, steps):
+        super().__init__(f"{limit} budget exceeded: {used} > {maximum} at {type(node).__name__} after {steps} steps")
+        self.limit = limit          # "steps", "seconds", "string_length" or "number_bits"
+        self.used = used
+        self.maximum = maximum
+        self.node = node            # the node being evaluated
+        self.steps = steps          # nodes evaluated until then
+
+
+class Budget:
+    __slots__ = ("steps", "seconds", "string_length", "number_bits", "used", "began", "check_at")
+    interval = 1024     # steps between two looks at the clock
+
+    def __init__(self, steps=None, seconds=None, string_length=None, number_bits=None):
+        self.steps = steps
+        self.seconds = seconds
+        self.string_length = string_length
+        self.number_bits = number_bits
+        self.start()
+
+    def start(self):
+        # a new run: count from 0 and start the clock
+        self.used = 0
+        self.began = time.monotonic()
+        self.check_at = self.next_check()
+
+    def elapsed(self):
+        return time.monotonic() - self.began
+
+    def next_check(self):
+        check_at = self.used + self.interval if self.seconds is not None else float("inf")
+        if self.steps is not None:
+            check_at = min(check_at, self.steps + 1)
+        return check_at
+
+    def check(self, node):
+        # evaluate calls this when used reaches check_at
+        if self.steps is not None and self.used > self.steps:
+            raise BudgetExceeded("steps", self.used, self.steps, node, self.used)
+        if self.seconds is not None:
+            elapsed = self.elapsed()
+            if elapsed > self.seconds:
+                raise BudgetExceeded("seconds", elapsed, self.seconds, node, self.used)
+        self.check_at = self.next_check()
+
+    def check_product(self, left, right, node):
+        # before left * right is computed
+        if is_string(right):
+            left, right = right, left
+        if is_string(left):
+            if self.string_length is not None and isinstance(right, int):
+                size, limit = len(left) * max(right, 0), "string_length"
+            else:
+                return
+        elif self.number_bits is not None and type(left) is int and type(right) is int and left and right:
+            # an a-bit int times a b-bit int has at least a + b - 1 bits
+            size, limit = left.bit_length() + right.bit_length() - 1, "number_bits"
+        else:
+            return
+        maximum = getattr(self, limit)
+        if size > maximum:
+            raise BudgetExceeded(limit, size, maximum, node, self.used)
+
+    def check_size(self, value, node):
+        # value is what node made
+        if type(value) is int:
+            size, limit = value.bit_length(), "number_bits"
+            if self.number_bits is None or size <= self.number_bits:
+                return
+        elif type(value) is Fraction:
+            size, limit = value.numerator.bit_length() + value.denominator.bit_length(), "number_bits"
+        elif is_string(value):
+            size, limit = len(value), "string_length"
+        else:
+            return
+        maximum = getattr(self, limit)
+        if maximum is not None and size > maximum:
+            raise BudgetExceeded(limit, size, maximum, node, self.used)
+
+
+def call_frame(fn, argv, memo=None, budget=None) -> Environment:
+    # the environment a call runs in: the scopes fn was defined in and one
+    # more for the parameters
+    if not isinstance(fn, FnObject) or len(fn.params) != len(argv):
+        raise InvalidProgram()
+    frame = Environment(fn.env + [{}])
+    frame.memo = memo
+    frame.budget = budget
+    for par, arg in zip(fn.params, argv):
+        frame.add(par.name, arg)
+    return frame
+
+
+def concatenation_operands(program):
+    # the operands of a chain of Two_Str_concatenations, left to right, found
+    # with a stack rather than recursion, so a chain can be as long as eval's
+    operands=[]
+    todo=[program]
+    while todo:
+        item=todo.pop()
+        if isinstance(item,Two_Str_concatenation):
+            todo.append(item.str2)
+            todo.append(item.str1)
+        else:
+            operands.append(item)
+    return operands
+
+
+# what evaluate does not count as a step
+leaves = (NumLiteral, BoolLiteral, StringLiteral, Variable, Get)
+
+# calls evaluate runs on the Python stack before it goes on with run_steps
+max_nested_calls = 50
+
+# node type -> function(node, environment, tail) giving its value, for the
+# node types defined outside this file (parallel.py registers its Fork)
+evaluators = {}
+
+
+def evaluate(program: AST, environment: Environment, tail: bool = False) -> Value:
+    # tail: program is in tail position in a function body, where a FunCall
+    # returns a TailCall instead of running the function
     def eval_(program):
-        return eval(program, environment) 
+        return evaluate(program, environment)
+
+    def eval_tail(program):
+        return evaluate(program, environment, tail)
        
     match program:
         case NumLiteral(value):
@@ -294,13 +980,21 @@ def eval(program: AST, environment: Environment = None) -> Value:
 
         case Variable(name):
             return environment.get(name)
-            
+
+        case Get(Variable(name)):
+            return environment.get(name)
+
+    # the leaves above take no time of their own and are not counted
+    budget=environment.budget
+    if budget is not None:
+        budget.used+=1
+        if budget.used>=budget.check_at:
+            budget.check(program)
+
+    match program:
         case Put(Variable(name),e1): 
             environment.update(name,eval_(e1))
             return environment.get(name)
-        
-        case Get(Variable(name)):
-            return environment.get(name)
 
         case Assign(Variable(name),e1):
             environment.add(name,eval_(e1))
@@ -312,40 +1006,62 @@ def eval(program: AST, environment: Environment = None) -> Value:
                 
             else:
                environment.add(name,eval_(e1))
-            
-            v2=eval_(condition)
-            if v2 == True:
-                eval_(body)
-                e2=eval_(updt)
-                eval_(for_loop(name,e2,condition,updt,body))
+
+            # iterate in place: no new node and no extra stack frame per iteration
+            depth=len(environment.env)
+            idle=budget is not None and isinstance(condition,leaves) and isinstance(updt,leaves) and isinstance(body,leaves)
+            while eval_(condition) == True:
+                if idle:
+                    budget.used+=1
+                    if budget.used>=budget.check_at:
+                        budget.check(program)
+                try:
+                    eval_(body)
+                except BreakLoop:
+                    environment.unwind(depth)
+                    break
+                except ContinueLoop:
+                    environment.unwind(depth)
+                environment.update(name,eval_(updt))
 
             return None
 
+        case Break():
+            raise BreakLoop()
+
+        case Continue():
+            raise ContinueLoop()
+
 
         case Let(Variable(name), e1, e2) | LetMut(Variable(name),e1, e2):
 
             v1 = eval_(e1)
             environment.enter_scope()
             environment.add(name,v1)
-            v2=eval_(e2)
+            v2=eval_tail(e2)
             environment.exit_scope()
             return v2
         
         case Two_Str_concatenation(str1,str2):
-            result_str = eval_(str1) + eval_(str2)
+            # a long chain of concatenations is walked with a stack, not recursion
+            result_str = missing    # nothing evaluated yet: a None on the left is an operand
+            todo = [str2, str1]
+            while todo:
+                item = todo.pop()
+                if isinstance(item, Two_Str_concatenation):
+                    todo.append(item.str2)
+                    todo.append(item.str1)
+                elif result_str is missing:
+                    # kept as it is, so a Rope on the left is appended to, not joined
+                    result_str = eval_(item)
+                else:
+                    result_str = concat(result_str, eval_(item))
+            if budget is not None:
+                budget.check_size(result_str, program)
             return result_str
 
         case Str_slicing(str1,start,end):
-            result_str = StringLiteral("")
-            i = Variable("i")
-            i = start
-            body1 = LetMut(i,Get(i),BinOp("+",i,NumLiteral(1)))
-            body2 = LetMut(result_str,Get(result_str),Two_Str_concatenation(result_str,str1[Get(i)]))
-            body = Seq([body1,body2])
-            condition = BinOp("<",i,end)
-            eval_(while_loop(condition,body))
-            return result_str
-
+            return slice_string(eval_(str1),eval_(start),eval_(end))
 
         case LetAnd(Variable(name1),expr1,Variable(name2),expr2,expr3):
             v1=eval_(expr1)
@@ -363,73 +1079,97 @@ def eval(program: AST, environment: Environment = None) -> Value:
             else:
                environment.add(name2,v2)
             
-            v3=eval_(expr3)
+            v3=eval_tail(expr3)
             environment.exit_scope()
             return v3
 
         case LetFun(Variable(name),params, body,expr):
             environment.enter_scope()
-            environment.add(name, FnObject(params,body))
-            v=eval_(expr)
+            # the scope the function is in is captured too, so it can call itself
+            fn=FnObject(params,body,environment.env.copy())
+            environment.add(name, fn)
+            if environment.memo is not None:
+                fn.cache=environment.memo.cache_for(program,environment)
+            v=eval_tail(expr)
             environment.exit_scope()
             return v
-        
-        # case FnObject(params,body):
-        #     for par in params:
-        #         if(par is )
+
         case FunCall(Variable(name),args):
             fn=environment.get(name)
             argv=[]
             for arg in args:
                 argv.append(eval_(arg))
-            environment.enter_scope()
-            for par,arg in zip(fn.params,argv):
-                environment.add(par,arg)
-            v=eval_(fn.body)
-            environment.exit_scope()
+            frame=call_frame(fn,argv,environment.memo,budget)
+            key=None
+            if fn.cache is not None:
+                key=fn.cache.key(argv,frame)
+                if key is not None:
+                    v=fn.cache.get(key)
+                    if v is not missing:
+                        return v
+            if tail:
+                return TailCall(fn,frame,key)
+            # every call of a chain of tail calls has the value of the last one
+            calls=environment.calls+1
+            pending=[]
+            while True:
+                if key is not None:
+                    pending.append((fn.cache,key))
+                frame.calls=calls
+                if calls>max_nested_calls:
+                    # deep recursion: the rest of it runs in constant Python stack
+                    v=run_steps(fn.body,frame,True)
+                else:
+                    v=evaluate(fn.body,frame,True)
+                if type(v) is not TailCall:
+                    break
+                fn,frame,key=v.fn,v.frame,v.key
+            for cache,key in pending:
+                cache.put(key,v)
             return v
             
         case UBoolOp(Variable(name),expr):
-            v2=eval_(expr)
-            z=NumLiteral(10)
-            print("name: ",environment.check(name))
-            if environment.check(name):
-                v1=environment.get(name)
-                print("v1",v2.type)
-                print("typecheck: ", typecheck(NumLiteral(5)))
-                if typecheck(NumLiteral(5)).type==NumType():
-                    if v1 !=0:
-                        print("yes")
-                        return True
-                    else:
-                        return False
-                elif typecheck(NumLiteral(5)).type==StringType():
-                    if v1 == "":
-                        return False
-                    else:
-                        return True
-            else:
-                print("error")
+            eval_(expr)
+            v1=environment.get(name)
+            # strings are true when non-empty, numbers when non-zero
+            if is_string(v1):
+                return v1 != ""
+            return v1 != 0
 
-        case Two_Str_concatenation(str1,str2):
-            result_str = eval_(str1) + eval_(str2)
-            return result_str
-     
 
         case Seq(body):
-            v1=None
-            for item in body:
-                v1=eval_(item)
-            return v1    
-
+            if not body:
+                return None
+            for item in body[:-1]:
+                eval_(item)
+            return eval_tail(body[-1])
+
+        # an int sum or difference is at most a bit longer than its longer
+        # operand, so it grows no faster than the steps are counted
         case BinOp("+", left, right):
-            return eval_(left) + eval_(right)
+            v=eval_(left) + eval_(right)
+            if budget is not None and type(v) is not int:
+                budget.check_size(v,program)
+            return v
         case BinOp("-", left, right):
-            return eval_(left) - eval_(right)
+            v=eval_(left) - eval_(right)
+            if budget is not None and type(v) is not int:
+                budget.check_size(v,program)
+            return v
         case BinOp("*", left, right):
-            return eval_(left) * eval_(right)
+            if budget is None:
+                return eval_(left) * eval_(right)
+            v1=eval_(left)
+            v2=eval_(right)
+            budget.check_product(v1,v2,program)
+            v=v1 * v2
+            budget.check_size(v,program)
+            return v
         case BinOp("/", left, right):
-            return eval_(left) / eval_(right)
+            v=divide(eval_(left), eval_(right))
+            if budget is not None:
+                budget.check_size(v,program)
+            return v
         case BinOp(">",left,right):
             return eval_(left) > eval_(right)
         case BinOp("<", left,right):
@@ -440,17 +1180,28 @@ def eval(program: AST, environment: Environment = None) -> Value:
         case if_else(expr,et,ef):
             v1 = eval_(expr)
             if v1 == True:
-                return eval_(et)
+                return eval_tail(et)
             else:
-                return eval_(ef)
+                return eval_tail(ef)
                 
         case while_loop(condition,e1):
-            v1 = eval_(condition)
-            
-            if v1 == True:
-                eval_(e1) 
-                eval_(while_loop(condition,e1))
-            
+            depth=len(environment.env)
+            # the condition or the body is a step every time round, unless
+            # both are leaves, and then the loop is
+            idle=budget is not None and isinstance(condition,leaves) and isinstance(e1,leaves)
+            while eval_(condition) == True:
+                if idle:
+                    budget.used+=1
+                    if budget.used>=budget.check_at:
+                        budget.check(program)
+                try:
+                    eval_(e1)
+                except BreakLoop:
+                    environment.unwind(depth)
+                    break
+                except ContinueLoop:
+                    environment.unwind(depth)
+
             return None
 
         case Print(e1):
@@ -458,8 +1209,243 @@ def eval(program: AST, environment: Environment = None) -> Value:
             print(v1)
             return v1
 
+    evaluate_node=evaluators.get(type(program))
+    if evaluate_node is not None:
+        return evaluate_node(program,environment,tail)
     raise InvalidProgram()
 
+# evaluate, one node at a time, on a stack of its own. evaluate_steps is
+# evaluate written as a generator: where evaluate calls itself for the value
+# of a child, it yields (child, environment, tail) and run_steps sends the
+# value back (or throws the child's exception in). The Python stack stays the
+# same height however deeply the program's functions recurse. It is slower
+# than evaluate, so FunCall only switches to it once max_nested_calls calls
+# are running inside one another.
+def evaluate_steps(program: AST, environment: Environment, tail: bool = False):
+    budget=environment.budget
+    if budget is not None:
+        budget.used+=1
+        if budget.used>=budget.check_at:
+            budget.check(program)
+
+    match program:
+        case Put(Variable(name),e1):
+            environment.update(name,(yield e1,environment,False))
+            return environment.get(name)
+
+        case Assign(Variable(name),e1):
+            environment.add(name,(yield e1,environment,False))
+            return name
+
+        case for_loop(Variable(name),e1,condition,updt,body):
+            v=yield e1,environment,False
+            if environment.check(name):
+                environment.update(name,v)
+            else:
+                environment.add(name,v)
+            depth=len(environment.env)
+            idle=budget is not None and isinstance(condition,leaves) and isinstance(updt,leaves) and isinstance(body,leaves)
+            while (yield condition,environment,False) == True:
+                if idle:
+                    budget.used+=1
+                    if budget.used>=budget.check_at:
+                        budget.check(program)
+                try:
+                    yield body,environment,False
+                except BreakLoop:
+                    environment.unwind(depth)
+                    break
+                except ContinueLoop:
+                    environment.unwind(depth)
+                environment.update(name,(yield updt,environment,False))
+            return None
+
+        case Break():
+            raise BreakLoop()
+
+        case Continue():
+            raise ContinueLoop()
+
+        case Let(Variable(name), e1, e2) | LetMut(Variable(name),e1, e2):
+            v1=yield e1,environment,False
+            environment.enter_scope()
+            environment.add(name,v1)
+            v2=yield e2,environment,tail
+            environment.exit_scope()
+            return v2
+
+        case Two_Str_concatenation():
+            result_str=missing
+            for item in concatenation_operands(program):
+                v=yield item,environment,False
+                result_str=v if result_str is missing else concat(result_str,v)
+            if budget is not None:
+                budget.check_size(result_str,program)
+            return result_str
+
+        case Str_slicing(str1,start,end):
+            str1=yield str1,environment,False
+            start=yield start,environment,False
+            return slice_string(str1,start,(yield end,environment,False))
+
+        case LetAnd(Variable(name1),expr1,Variable(name2),expr2,expr3):
+            v1=yield expr1,environment,False
+            v2=yield expr2,environment,False
+            environment.enter_scope()
+            for name,v in ((name1,v1),(name2,v2)):
+                if environment.check(name):
+                    environment.update(name,v)
+                else:
+                    environment.add(name,v)
+            v3=yield expr3,environment,tail
+            environment.exit_scope()
+            return v3
+
+        case LetFun(Variable(name),params,body,expr):
+            environment.enter_scope()
+            fn=FnObject(params,body,environment.env.copy())
+            environment.add(name,fn)
+            if environment.memo is not None:
+                fn.cache=environment.memo.cache_for(program,environment)
+            v=yield expr,environment,tail
+            environment.exit_scope()
+            return v
+
+        case FunCall(Variable(name),args):
+            fn=environment.get(name)
+            argv=[]
+            for arg in args:
+                argv.append((yield arg,environment,False))
+            frame=call_frame(fn,argv,environment.memo,budget)
+            key=None
+            if fn.cache is not None:
+                key=fn.cache.key(argv,frame)
+                if key is not None:
+                    v=fn.cache.get(key)
+                    if v is not missing:
+                        return v
+            if tail:
+                return TailCall(fn,frame,key)
+            pending=[]
+            while True:
+                if key is not None:
+                    pending.append((fn.cache,key))
+                v=yield fn.body,frame,True
+                if type(v) is not TailCall:
+                    break
+                fn,frame,key=v.fn,v.frame,v.key
+            for cache,key in pending:
+                cache.put(key,v)
+            return v
+
+        case UBoolOp(Variable(name),expr):
+            yield expr,environment,False
+            v1=environment.get(name)
+            if is_string(v1):
+                return v1 != ""
+            return v1 != 0
+
+        case Seq(body):
+            if not body:
+                return None
+            for item in body[:-1]:
+                yield item,environment,False
+            return (yield body[-1],environment,tail)
+
+        case BinOp(op,left,right) if op in ("+","-","*","/",">","<","=="):
+            v1=yield left,environment,False
+            v2=yield right,environment,False
+            match op:
+                case "+":
+                    v=v1 + v2
+                case "-":
+                    v=v1 - v2
+                case "*":
+                    if budget is not None:
+                        budget.check_product(v1,v2,program)
+                    v=v1 * v2
+                case "/":
+                    v=divide(v1,v2)
+                case ">":
+                    return v1 > v2
+                case "<":
+                    return v1 < v2
+                case "==":
+                    return v1 == v2
+            if budget is not None and (op in "*/" or type(v) is not int):
+                budget.check_size(v,program)
+            return v
+
+        case if_else(expr,et,ef):
+            if (yield expr,environment,False) == True:
+                return (yield et,environment,tail)
+            return (yield ef,environment,tail)
+
+        case while_loop(condition,e1):
+            depth=len(environment.env)
+            idle=budget is not None and isinstance(condition,leaves) and isinstance(e1,leaves)
+            while (yield condition,environment,False) == True:
+                if idle:
+                    budget.used+=1
+                    if budget.used>=budget.check_at:
+                        budget.check(program)
+                try:
+                    yield e1,environment,False
+                except BreakLoop:
+                    environment.unwind(depth)
+                    break
+                except ContinueLoop:
+                    environment.unwind(depth)
+            return None
+
+        case Print(e1):
+            v1=yield e1,environment,False
+            print(v1)
+            return v1
+
+    evaluate_node=evaluators.get(type(program))
+    if evaluate_node is not None:
+        return evaluate_node(program,environment,tail)
+    raise InvalidProgram()
+
+
+def run_steps(program: AST, environment: Environment, tail: bool = False) -> Value:
+    # what evaluate(program, environment, tail) gives, with a generator per
+    # node being evaluated on `stack`; leaves are left to evaluate
+    if isinstance(program,leaves):
+        return evaluate(program,environment,tail)
+    stack=[evaluate_steps(program,environment,tail)]
+    value=None
+    error=None
+    while True:
+        try:
+            if error is None:
+                child,child_environment,child_tail=stack[-1].send(value)
+            else:
+                thrown,error=error,None
+                child,child_environment,child_tail=stack[-1].throw(thrown)
+        except StopIteration as stop:
+            stack.pop()
+            if not stack:
+                return stop.value
+            value=stop.value
+            continue
+        except Exception as e:
+            # the node's parent gets it where it asked for the node's value
+            stack.pop()
+            if not stack:
+                raise
+            error=e
+            continue
+        if isinstance(child,leaves):
+            try:
+                value=evaluate(child,child_environment,child_tail)
+            except Exception as e:
+                error=e
+        else:
+            stack.append(evaluate_steps(child,child_environment,child_tail))
+            value=None
+
 
 def test_eval():
     e1 = NumLiteral(2)
@@ -471,6 +1457,15 @@ def test_eval():
     e7 = BinOp("*", e1, e6)
     assert eval(e7) == Fraction(32, 5)
 
+def test_integral_numbers():
+    assert type(eval(BinOp("+", NumLiteral(2), NumLiteral(3)))) is int
+    assert type(eval(BinOp("/", NumLiteral(6), NumLiteral(3)))) is int
+    e = BinOp("/", NumLiteral(7), NumLiteral(2))
+    assert eval(e) == Fraction(7, 2) and type(eval(e)) is Fraction
+    assert eval(BinOp("*", e, NumLiteral(2))) == 7
+    assert NumLiteral(Fraction(4, 2)).value == 2 and type(NumLiteral(Fraction(4, 2)).value) is int
+    assert NumLiteral(1, 3).value == Fraction(1, 3)
+
 def test_string_slicing():
     str1 = StringLiteral("abcdefg")
     start = NumLiteral(0)
@@ -478,6 +1473,43 @@ def test_string_slicing():
     expr = Str_slicing(str1,start,end)
     assert eval(expr) == 'abcd'
 
+def test_string_engine():
+    s=Variable('s')
+    i=Variable('i')
+    # a 4 MB string: slicing copies only the slice
+    big = StringLiteral("abcd" * 1000000)
+    assert eval(Str_slicing(big,NumLiteral(2000000),NumLiteral(2000006))) == "abcdab"
+    # a loop that grows a string one piece at a time builds a Rope, not 20000 copies
+    grow = Let(s,StringLiteral(""),Seq([
+        for_loop(i,NumLiteral(0),BinOp("<",i,NumLiteral(20000)),BinOp("+",i,NumLiteral(1)),
+                 Put(s,Two_Str_concatenation(s,StringLiteral("x" * 100)))),
+        Str_slicing(s,NumLiteral(1999990),NumLiteral(2000010))]))
+    assert eval(grow) == "x" * 10
+    # a 100000-deep chain of concatenations does not recurse
+    chain = StringLiteral("")
+    for k in range(100000):
+        chain = Two_Str_concatenation(chain, StringLiteral("ab"))
+    result = eval(chain)
+    assert type(result) is str and result == "ab" * 100000
+    rope = concat("a" * 1000, "b" * 1000)
+    assert isinstance(rope, Rope) and rope + "c" == "a" * 1000 + "b" * 1000 + "c" and rope == "a" * 1000 + "b" * 1000
+    # string comparisons
+    assert eval(BinOp("<",StringLiteral("apple"),StringLiteral("banana"))) == True
+    assert eval(BinOp("==",StringLiteral("ab"),Two_Str_concatenation(StringLiteral("a"),StringLiteral("b")))) == True
+    assert eval(BinOp(">",StringLiteral("ab"),StringLiteral("b"))) == False
+    assert typecheck(BinOp("<",StringLiteral("a"),StringLiteral("b"))).type == BoolType()
+    import pytest
+    with pytest.raises(InvalidProgram):
+        eval(Str_slicing(big,NumLiteral(1,2),NumLiteral(3)))
+    # a string is not a number, however it reads
+    for text in ("12", " 3/4 ", "abc"):
+        with pytest.raises(TypeError):
+            eval(BinOp("/",StringLiteral(text),NumLiteral(3)))
+    # a first operand that evaluates to None is not skipped
+    for first in (Seq([]),while_loop(BoolLiteral(False),NumLiteral(0))):
+        with pytest.raises(TypeError):
+            eval(Two_Str_concatenation(first,StringLiteral("ab")))
+
 
 def test_let_eval():
     a  = Variable("a")
@@ -560,6 +1592,42 @@ def test_for_eval():
     e5=LetMut(a,e1, for_loop(i,e2,BinOp(">",Get(i),e2),e3,e4))
     assert eval(e5)==None
 
+def test_for_loop_runs():
+    a=Variable("a")
+    i=Variable("i")
+    loop=for_loop(i,NumLiteral(0),BinOp("<",Get(i),NumLiteral(5)),Put(i,BinOp("+",Get(i),NumLiteral(1))),Put(a,BinOp("+",Get(i),Get(a))))
+    e=LetMut(a,NumLiteral(10),Seq([loop,Get(a)]))
+    assert eval(e)==20
+
+def test_long_loops():
+    # far more iterations than the recursion limit would have allowed
+    a=Variable("a")
+    i=Variable("i")
+    e1=LetMut(a,NumLiteral(0),Seq([while_loop(BinOp("<",Get(a),NumLiteral(20000)),Put(a,BinOp("+",Get(a),NumLiteral(1)))),Get(a)]))
+    assert eval(e1)==20000
+    loop=for_loop(i,NumLiteral(0),BinOp("<",Get(i),NumLiteral(20000)),Put(i,BinOp("+",Get(i),NumLiteral(1))),Put(a,BinOp("+",Get(a),NumLiteral(2))))
+    e2=LetMut(a,NumLiteral(0),Seq([loop,Get(a)]))
+    assert eval(e2)==40000
+
+def test_break_continue():
+    import pytest
+    a=Variable("a")
+    s=Variable("s")
+    i=Variable("i")
+    # sum of 1..9, leaving the loop with a break
+    body=Seq([Put(a,BinOp("+",Get(a),NumLiteral(1))),
+              if_else(BinOp(">",Get(a),NumLiteral(9)),Break(),NumLiteral(0)),
+              Put(s,BinOp("+",Get(s),Get(a)))])
+    e=LetMut(a,NumLiteral(0),LetMut(s,NumLiteral(0),Seq([while_loop(BoolLiteral(True),body),Get(s)])))
+    assert eval(e)==45
+    # continue inside a Let: the scope it entered has to be dropped
+    body=Let(s,Get(i),if_else(BinOp("<",Get(i),NumLiteral(3)),Continue(),Put(a,BinOp("+",Get(a),Get(s)))))
+    loop=for_loop(i,NumLiteral(0),BinOp("<",Get(i),NumLiteral(6)),Put(i,BinOp("+",Get(i),NumLiteral(1))),body)
+    e=LetMut(a,NumLiteral(0),Seq([loop,Get(a)]))
+    assert eval(e)==12
+    with pytest.raises(InvalidProgram):
+        eval(Break())
+
 
 def test_print():
     a=Variable("a")
@@ -592,6 +1660,177 @@ def test_Letfun():
     e=LetFun(f,[a,b],BinOp("+",a,b),FunCall(f,[NumLiteral(15),NumLiteral(2)]))
     assert eval(e)==17    
 
+def test_Letfun_closures():
+    a=Variable('a')
+    x=Variable('x')
+    f=Variable('f')
+    # the body sees the a around the LetFun, not the one where it is called
+    e=Let(a,NumLiteral(1),LetFun(f,[x],BinOp("+",x,a),Let(a,NumLiteral(5),FunCall(f,[NumLiteral(1)]))))
+    assert eval(e)==2
+    # and can change it
+    e=LetMut(a,NumLiteral(0),LetFun(f,[],Put(a,BinOp("+",Get(a),NumLiteral(1))),Seq([FunCall(f,[]),FunCall(f,[]),Get(a)])))
+    assert eval(e)==2
+    import pytest
+    with pytest.raises(InvalidProgram):
+        eval(LetFun(f,[a],a,FunCall(f,[])))
+    with pytest.raises(KeyError):
+        eval(LetFun(f,[],a,Let(a,NumLiteral(5),FunCall(f,[]))))
+
+def test_memo():
+    n=Variable('n')
+    k=Variable('k')
+    x=Variable('x')
+    f=Variable('f')
+    fib_body=if_else(BinOp("<",n,NumLiteral(2)),n,
+                     BinOp("+",FunCall(f,[BinOp("-",n,NumLiteral(1))]),FunCall(f,[BinOp("-",n,NumLiteral(2))])))
+    fib=lambda m: LetFun(f,[n],fib_body,FunCall(f,[NumLiteral(m)]))
+    assert eval(fib(15))==610
+    memo=Memo()
+    assert eval(fib(15),memo=memo)==610
+    assert (memo.stats["f"].hits, memo.stats["f"].misses)==(13,16)
+    # out of reach without the cache
+    assert eval(fib(100),memo=Memo())==354224848179261915075
+    # a variable the body reads is part of the key
+    e=LetMut(k,NumLiteral(1),LetFun(f,[x],BinOp("+",x,k),
+             Seq([FunCall(f,[NumLiteral(1)]),Put(k,NumLiteral(10)),FunCall(f,[NumLiteral(1)])])))
+    memo=Memo()
+    assert eval(e,memo=memo)==11
+    assert (memo.stats["f"].hits, memo.stats["f"].misses)==(0,2)
+    # impure bodies are not memoized, and a function calling one is not either
+    g=Variable('g')
+    e=LetMut(k,NumLiteral(0),LetFun(g,[],Put(k,BinOp("+",k,NumLiteral(1))),LetFun(f,[x],Seq([FunCall(g,[]),k]),
+             Seq([FunCall(f,[NumLiteral(1)]),FunCall(f,[NumLiteral(1)])]))))
+    memo=Memo()
+    assert eval(e,memo=memo)==eval(e)==2
+    assert memo.stats=={}
+    # the least recently used result goes first
+    e=LetFun(f,[x],BinOp("*",x,x),Seq([FunCall(f,[NumLiteral(v)]) for v in (1,2,1,3,1,2)]))
+    memo=Memo(maxsize=2)
+    assert eval(e,memo=memo)==4
+    assert (memo.stats["f"].hits, memo.stats["f"].misses)==(2,4)
+    # every call of a chain of tail calls is cached, with the value of the last one
+    loop=if_else(BinOp("<",n,NumLiteral(1)),k,FunCall(f,[BinOp("-",n,NumLiteral(1)),BinOp("+",k,NumLiteral(2))]))
+    e=LetFun(f,[n,k],loop,Seq([FunCall(f,[NumLiteral(3000),NumLiteral(0)]),FunCall(f,[NumLiteral(2000),NumLiteral(2000)])]))
+    memo=Memo(maxsize=5000)
+    assert eval(e,memo=memo)==6000
+    assert (memo.stats["f"].hits, memo.stats["f"].misses)==(1,3001)
+    assert function_effects(LetFun(f,[x],Let(k,x,Seq([Put(k,NumLiteral(2)),k])),x))==((),set())
+    assert function_effects(LetFun(f,[x],Print(x),x)) is None
+
+def bench_budget(n=300, repeat=400):
+    # eval of a counting loop with every limit of a Budget on, over eval
+    # without one: the median over runs taken in pairs, so both see the same
+    # load on the machine
+    import statistics
+    a=Variable('a')
+    s=Variable('s')
+    body=Seq([Put(s,BinOp("+",Get(s),BinOp("*",NumLiteral(2),Get(a)))),Put(a,BinOp("+",Get(a),NumLiteral(1)))])
+    program=LetMut(a,NumLiteral(0),LetMut(s,NumLiteral(0),Seq([while_loop(BinOp("<",Get(a),NumLiteral(n)),body),Get(s)])))
+    budget=Budget(steps=10**9,seconds=3600,string_length=10**6,number_bits=10**6)
+    ratios=[]
+    for _ in range(repeat):
+        start=time.perf_counter()
+        eval(program)
+        middle=time.perf_counter()
+        eval(program,budget=budget)
+        ratios.append((time.perf_counter()-middle)/(middle-start))
+    return statistics.median(ratios)
+
+def test_budget():
+    import pytest
+    i=Variable('i')
+    s=Variable('s')
+    forever=while_loop(BoolLiteral(True),NumLiteral(0))
+    with pytest.raises(BudgetExceeded) as stopped:
+        eval(forever,budget=Budget(steps=100))
+    assert (stopped.value.limit,stopped.value.used,stopped.value.maximum,stopped.value.steps)==("steps",101,100,101)
+    # a runaway loop is also a program error, for callers that catch those
+    assert isinstance(stopped.value,InvalidProgram) and type(stopped.value.node) is while_loop
+    with pytest.raises(BudgetExceeded) as stopped:
+        eval(forever,budget=Budget(seconds=0.05))
+    assert stopped.value.limit=="seconds" and stopped.value.used>0.05
+    # a string doubling every time round the loop
+    doubling=LetMut(s,StringLiteral("ab"),LetMut(i,NumLiteral(0),while_loop(BinOp("<",Get(i),NumLiteral(100)),
+                    Seq([Put(s,Two_Str_concatenation(Get(s),Get(s))),Put(i,BinOp("+",Get(i),NumLiteral(1)))]))))
+    with pytest.raises(BudgetExceeded) as stopped:
+        eval(doubling,budget=Budget(string_length=1000))
+    assert (stopped.value.limit,stopped.value.used)==("string_length",1024)
+    assert type(stopped.value.node) is Two_Str_concatenation
+    # and numbers squared, and fractions whose denominators multiply
+    squaring=LetMut(s,NumLiteral(3),while_loop(BoolLiteral(True),Put(s,BinOp("*",Get(s),Get(s)))))
+    with pytest.raises(BudgetExceeded) as stopped:
+        eval(squaring,budget=Budget(number_bits=64))
+    assert stopped.value.limit=="number_bits" and 64<stopped.value.used<=128
+    # measured before they are made: a string of 10**12 characters would not
+    # even fit in memory
+    with pytest.raises(BudgetExceeded) as stopped:
+        eval(BinOp("*",StringLiteral("x"),NumLiteral(10**12)),budget=Budget(string_length=10))
+    assert (stopped.value.limit,stopped.value.used)==("string_length",10**12)
+    with pytest.raises(BudgetExceeded) as stopped:
+        eval(BinOp("*",NumLiteral(10),StringLiteral("ab")),budget=Budget(string_length=10))
+    assert (stopped.value.limit,stopped.value.used)==("string_length",20)
+    big=NumLiteral(1<<(10**6))
+    with pytest.raises(BudgetExceeded) as stopped:
+        eval(BinOp("*",big,big),budget=Budget(number_bits=64))
+    assert (stopped.value.limit,stopped.value.used)==("number_bits",2*10**6+1)
+    assert eval(BinOp("*",StringLiteral("ab"),NumLiteral(5)),budget=Budget(string_length=10))=="ab"*5
+    sums=LetMut(s,NumLiteral(0),for_loop(i,NumLiteral(1),BoolLiteral(True),BinOp("+",i,NumLiteral(1)),
+                Put(s,BinOp("+",Get(s),BinOp("/",NumLiteral(1),i)))))
+    with pytest.raises(BudgetExceeded) as stopped:
+        eval(sums,budget=Budget(number_bits=200))
+    assert stopped.value.limit=="number_bits"
+    # within its limits a run gives what it gives without them, and a budget
+    # starts again for every run
+    budget=Budget(steps=100000,seconds=60,string_length=1000,number_bits=1000)
+    for program,expected in example_programs():
+        assert eval(program,budget=budget)==expected
+    # function calls are counted too
+    n=Variable('n')
+    f=Variable('f')
+    countdown=LetFun(f,[n],if_else(BinOp("<",n,NumLiteral(1)),n,FunCall(f,[BinOp("-",n,NumLiteral(1))])),FunCall(f,[NumLiteral(10**6)]))
+    with pytest.raises(BudgetExceeded):
+        eval(countdown,budget=Budget(steps=10000))
+
+def test_tail_calls():
+    n=Variable('n')
+    acc=Variable('acc')
+    f=Variable('f')
+    even=Variable('even')
+    odd=Variable('odd')
+    # far deeper than the Python stack allows, through an if_else, a Let and a Seq
+    loop=if_else(BinOp("<",n,NumLiteral(1)),acc,
+                 Let(n,BinOp("-",n,NumLiteral(1)),Seq([acc,FunCall(f,[n,BinOp("+",acc,NumLiteral(2))])])))
+    assert eval(LetFun(f,[n,acc],loop,FunCall(f,[NumLiteral(20000),NumLiteral(0)])))==40000
+    # between two functions: odd is defined inside even's body and calls it back
+    is_odd=if_else(BinOp("==",n,NumLiteral(0)),BoolLiteral(False),FunCall(even,[BinOp("-",n,NumLiteral(1))]))
+    is_even=LetFun(odd,[n],is_odd,if_else(BinOp("==",n,NumLiteral(0)),BoolLiteral(True),FunCall(odd,[BinOp("-",n,NumLiteral(1))])))
+    assert eval(LetFun(even,[n],is_even,FunCall(even,[NumLiteral(5001)])))==False
+
+def test_deep_recursion():
+    import pytest
+    n=Variable('n')
+    f=Variable('f')
+    i=Variable('i')
+    # n + f(n-1) is not a tail call, and recurses far deeper than the Python stack allows
+    sum_to=LetFun(f,[n],if_else(BinOp("<",n,NumLiteral(1)),NumLiteral(0),BinOp("+",n,FunCall(f,[BinOp("-",n,NumLiteral(1))]))),
+                  FunCall(f,[NumLiteral(20000)]))
+    assert eval(sum_to)==20000*20001//2
+    assert eval(sum_to,memo=Memo())==20000*20001//2
+    with pytest.raises(BudgetExceeded):
+        eval(sum_to,budget=Budget(steps=50000))
+    # a loop broken out of deep down, and an error deep down
+    loop=LetMut(i,NumLiteral(0),Seq([while_loop(BoolLiteral(True),Seq([Put(i,BinOp("+",Get(i),NumLiteral(1))),
+                if_else(BinOp("<",Get(i),NumLiteral(3)),Continue(),Break())])),Get(i)]))
+    deep=LetFun(f,[n],if_else(BinOp("<",n,NumLiteral(1)),loop,BinOp("+",NumLiteral(1),FunCall(f,[BinOp("-",n,NumLiteral(1))]))),
+                FunCall(f,[NumLiteral(1000)]))
+    assert eval(deep)==1003
+    with pytest.raises(ZeroDivisionError):
+        eval(LetFun(f,[n],if_else(BinOp("<",n,NumLiteral(1)),BinOp("/",n,n),BinOp("+",n,FunCall(f,[BinOp("-",n,NumLiteral(1))]))),
+                    FunCall(f,[NumLiteral(1000)])))
+    # run_steps gives what evaluate gives, node for node
+    for program,expected in example_programs():
+        assert as_str(run_steps(program,Environment()))==expected
+
 def test_LetAnd():
     a=Variable('a')
     b=Variable('b')
@@ -608,6 +1847,196 @@ def test_UBoolOp():
     e3=UBoolOp(a,e2)
     assert eval(e3)==True
 
+
+def sample_tree(n, binop, variable, number):
+    # an n-node tree like the ones program generators produce:
+    # 0 + v0 * 0 + v1 * 1 + ..., over ten names and the numbers below 100
+    tree = number(0)
+    for k in range((n - 1) // 4):
+        tree = binop("+", tree, binop("*", variable(f"v{k % 10}"), number(k % 100)))
+    return tree
+
+def dict_classes():
+    # BinOp, Variable and NumLiteral the way they were before the nodes had
+    # slots: plain dataclasses with an instance dict, and nothing interned
+    binop = make_dataclass("BinOp", [("operator", str), ("left", object), ("right", object),
+                                     ("type", object, field(default=None))])
+    variable = make_dataclass("Variable", [("name", str)])
+    number = make_dataclass("NumLiteral", [("value", object)])
+    return binop, variable, number
+
+def bench_memory(n=1000000):
+    # bytes per node of sample_tree(n), with plain dataclasses and with the
+    # AST classes
+    import gc
+    import tracemalloc
+    def measure(classes):
+        gc.collect()
+        tracemalloc.start()
+        tree = sample_tree(n, *classes)
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return size / n
+    before = measure(dict_classes())
+    after = measure((BinOp, Variable, NumLiteral))
+    return before, after, before / after
+
+def test_node_memory():
+    assert Variable("a") is Variable("a") and NumLiteral(7) is NumLiteral(7) and BoolLiteral(True) is BoolLiteral(True)
+    assert NumLiteral(1,2) is not NumLiteral(1,2) and NumLiteral(1000) is not NumLiteral(1000)
+    assert not hasattr(BinOp("+",NumLiteral(1),NumLiteral(2)),"__dict__")
+    import copy
+    tree = sample_tree(41, BinOp, Variable, NumLiteral)
+    assert copy.deepcopy(tree) == tree
+    before, after, saving = bench_memory(100000)
+    assert saving >= 2
+
+
+# The programs from the tests above together with the value eval gives for them.
+# Other backends (vm.py, ...) are checked against this list so they stay in step with eval.
+def example_programs():
+    a=Variable("a")
+    b=Variable("b")
+    i=Variable("i")
+    f=Variable("f")
+    e2=BinOp("+",a,a)
+    return [
+        (BinOp("*",NumLiteral(2),BinOp("/",BinOp("+",NumLiteral(7),NumLiteral(9)),NumLiteral(5))), Fraction(32,5)),
+        (Let(a,NumLiteral(5),e2), 10),
+        (Let(a,NumLiteral(5),Let(a,e2,e2)), 20),
+        (Let(a,NumLiteral(5),BinOp("+",a,Let(a,e2,e2))), 25),
+        (Let(a,NumLiteral(5),BinOp("+",Let(a,e2,e2),a)), 25),
+        (BinOp("+",Let(a,NumLiteral(5),e2),Let(a,NumLiteral(6),e2)), 22),
+        (LetMut(b,NumLiteral(2),Put(b,BinOp("+",Get(b),NumLiteral(1)))), 3),
+        (LetMut(a,NumLiteral(2),while_loop(BinOp("<",Get(a),NumLiteral(10)),Put(a,BinOp("+",Get(a),NumLiteral(2))))), None),
+        (if_else(BinOp(">",BinOp("*",NumLiteral(5),NumLiteral(10)),BinOp("*",NumLiteral(6),NumLiteral(6))),BinOp("*",NumLiteral(5),NumLiteral(10)),BinOp("*",NumLiteral(6),NumLiteral(6))), 50),
+        (LetMut(a,NumLiteral(5),Put(a,BinOp("+",Get(a),NumLiteral(6)))), 11),
+        (LetMut(a,NumLiteral(5),Seq([LetMut(b,NumLiteral(4),Seq([Put(a,BinOp("+",Get(a),Get(b))),Put(b,BinOp("+",Get(a),Get(b)))])),Get(a)])), 9),
+        (LetMut(a,NumLiteral(10),for_loop(i,NumLiteral(0),BinOp(">",Get(i),NumLiteral(0)),Put(i,BinOp("+",Get(i),NumLiteral(1))),Put(a,BinOp("+",Get(i),Get(a))))), None),
+        (Print(LetMut(a,NumLiteral(5),Put(a,BinOp("+",Get(a),NumLiteral(6))))), 11),
+        (Two_Str_concatenation(StringLiteral("ab"),StringLiteral("cd")), 'abcd'),
+        (LetMut(a,NumLiteral(5),LetAnd(a,NumLiteral(3),b,BinOp("+",a,NumLiteral(1)),BinOp("+",a,b))), 9),
+        (UBoolOp(a,Assign(a,NumLiteral(5))), True),
+        (LetMut(a,NumLiteral(10),Seq([for_loop(i,NumLiteral(0),BinOp("<",Get(i),NumLiteral(5)),Put(i,BinOp("+",Get(i),NumLiteral(1))),Put(a,BinOp("+",Get(i),Get(a)))),Get(a)])), 20),
+        (LetMut(a,NumLiteral(0),LetMut(b,NumLiteral(0),Seq([while_loop(BoolLiteral(True),Seq([Put(a,BinOp("+",Get(a),NumLiteral(1))),
+            if_else(BinOp(">",Get(a),NumLiteral(6)),Break(),Let(i,Get(a),if_else(BinOp("<",Get(i),NumLiteral(3)),Continue(),Put(b,BinOp("+",Get(b),Get(i))))))])),Get(b)]))), 18),
+        (LetMut(i,NumLiteral(100),Seq([Let(b,NumLiteral(0),for_loop(i,NumLiteral(0),BinOp("<",Get(i),NumLiteral(3)),Put(i,BinOp("+",Get(i),NumLiteral(1))),Get(i))),Get(i)])), 3),
+        (LetMut(a,NumLiteral(5),Seq([LetAnd(a,NumLiteral(3),b,BinOp("+",a,NumLiteral(1)),BinOp("+",a,b)),Get(a)])), 3),
+        (LetFun(f,[a,b],BinOp("+",a,b),FunCall(f,[NumLiteral(15),NumLiteral(2)])), 17),
+        (Let(b,NumLiteral(1),LetFun(f,[a],BinOp("+",a,b),Let(b,NumLiteral(5),FunCall(f,[NumLiteral(1)])))), 2),
+        (LetMut(b,NumLiteral(0),LetFun(f,[],Put(b,BinOp("+",Get(b),NumLiteral(1))),Seq([FunCall(f,[]),FunCall(f,[]),Get(b)]))), 2),
+        (LetFun(f,[a,b],if_else(BinOp("<",a,NumLiteral(1)),b,FunCall(f,[BinOp("-",a,NumLiteral(1)),BinOp("+",b,a)])),
+                FunCall(f,[NumLiteral(3000),NumLiteral(0)])), 4501500),
+    ]
+
+def test_environment():
+    env=Environment()
+    env.add("a",1)
+    env.enter_scope()
+    assert env.check("a")          # visible from an inner scope
+    assert not env.check("b")
+    env.add("a",2)
+    assert env.get("a")==2
+    env.update("a",3)
+    env.exit_scope()
+    assert env.get("a")==1         # the shadowing binding went away with its scope
+    env.enter_scope()
+    env.update("a",4)
+    env.add("b",5)
+    env.exit_scope()
+    assert env.get("a")==4
+    assert not env.check("b")
+
+def test_for_loop_outer_var():
+    # the loop variable already exists further out, so the loop updates it
+    i=Variable("i")
+    b=Variable("b")
+    loop=for_loop(i,NumLiteral(0),BinOp("<",Get(i),NumLiteral(3)),Put(i,BinOp("+",Get(i),NumLiteral(1))),Get(i))
+    e=LetMut(i,NumLiteral(100),Seq([Let(b,NumLiteral(0),loop),Get(i)]))
+    assert eval(e)==3
+
+def test_example_programs():
+    for program, expected in example_programs():
+        assert eval(program) == expected
+
+def test_typecheck():
+    import pytest
+    te = typecheck(BinOp("<", BinOp("+", NumLiteral(2), NumLiteral(3)), NumLiteral(7)))
+    assert te.type == BoolType() and te.left.type == NumType()
+    e = if_else(BinOp("=", BoolLiteral(True), BoolLiteral(False)), StringLiteral("a"), StringLiteral("b"))
+    assert typecheck(e).type == StringType()
+    with pytest.raises(TypeError):
+        typecheck(BinOp("+", NumLiteral(2), BinOp("<", NumLiteral(2), NumLiteral(3))))
+
+def test_typecheck_programs():
+    types = {int: NumType(), Fraction: NumType(), bool: BoolType(), str: StringType(), type(None): UnitType()}
+    for program, expected in example_programs():
+        assert TypeChecker().type_of(program) == types[type(expected)]
+    a=Variable("a")
+    b=Variable("b")
+    f=Variable("f")
+    n=Variable("n")
+    # functions are typed at the call, recursive ones included
+    fact=if_else(BinOp("<",n,NumLiteral(1)),NumLiteral(1),BinOp("*",n,FunCall(f,[BinOp("-",n,NumLiteral(1))])))
+    e=LetFun(f,[n],fact,FunCall(f,[NumLiteral(5)]))
+    assert TypeChecker().type_of(e)==NumType()
+    e=LetFun(f,[a,b],Two_Str_concatenation(a,b),FunCall(f,[StringLiteral("x"),StringLiteral("y")]))
+    assert TypeChecker().type_of(e)==StringType()
+    e=Let(a,StringLiteral("abc"),Str_slicing(a,NumLiteral(0),NumLiteral(2)))
+    assert TypeChecker().type_of(e)==StringType()
+    e=Let(a,NumLiteral(2),if_else(BinOp("<",a,NumLiteral(3)),a,NumLiteral(0)))
+    assert typecheck(e).e2.type==NumType()
+    env=Environment()
+    env.add("a",NumType())
+    assert TypeChecker(env).type_of(BinOp("+",a,NumLiteral(1)))==NumType()
+
+def test_typecheck_errors():
+    import pytest
+    a=Variable("a")
+    f=Variable("f")
+    bad=[
+        a,                                                         # unbound
+        LetMut(a,NumLiteral(1),Put(a,StringLiteral("x"))),         # a mutable variable keeps its type
+        Let(a,StringLiteral("x"),BinOp("+",a,NumLiteral(1))),
+        while_loop(NumLiteral(1),NumLiteral(2)),
+        LetFun(f,[a],a,FunCall(f,[])),                             # wrong number of arguments
+        Let(f,NumLiteral(1),FunCall(f,[NumLiteral(2)])),           # not a function
+        Str_slicing(StringLiteral("abc"),StringLiteral("a"),NumLiteral(2)),
+    ]
+    for program in bad:
+        with pytest.raises(TypeError):
+            TypeChecker().type_of(program)
+
+def test_typecheck_shared():
+    # 2**60 paths through the tree, but only 61 distinct nodes
+    e = NumLiteral(1)
+    for k in range(60):
+        e = BinOp("+", e, e)
+    types = {}
+    assert typecheck(e, types=types).type == NumType()
+    assert len(types) == 61
+
+    # e2 reads a, bound outside it: its type is recorded with a's type, so it
+    # is checked once where a has the same type, and again where it has another
+    class Counting(TypeChecker):
+        def check(self, program):
+            checked.append(program)
+            return super().check(program)
+    a  = Variable("a")
+    e2 = BinOp("+", a, a)
+    checked = []
+    Counting().type_of(Let(a, NumLiteral(5), Let(a, e2, e2)))
+    assert sum(node is e2 for node in checked) == 1
+    e3 = BinOp("<", a, a)
+    types = {}
+    checked = []
+    Counting(types=types).type_of(Let(a, NumLiteral(5), e3))
+    Counting(types=types).type_of(Let(a, StringLiteral("x"), e3))
+    Counting(types=types).type_of(Let(a, NumLiteral(6), e3))
+    assert sum(node is e3 for node in checked) == 2
+    assert [reads["a"][1] for reads, _ in types[id(e3)][1]] == [NumType(), StringType()]
+
+# print(bench_budget()) # Uncomment to see what a Budget costs eval on a loop (about 1.035 here).
 print("test_eval(): ",test_eval())
 print("test_if_else_eval(): ", test_if_else_eval())
 print("test_let_eval(): ",test_let_eval())
@@ -615,9 +2044,14 @@ print("test_letmut_eg1(): ",test_letmut_eg1())
 print("test_letmut_eg2(): ",test_letmut_eg2())
 print("test_print(): ",test_print())
 print("test_letmut(): ",test_letmut())
+print("test_string_slicing(): ",test_string_slicing())
 print("test_while_eval(): ",test_while_eval())
 print("test_for_eval(): ",test_for_eval())
-# print("test_Letfun(): ",test_Letfun())
+print("test_Letfun(): ",test_Letfun())
+print("test_Letfun_closures(): ",test_Letfun_closures())
 print("test_LetAnd(): ",test_LetAnd())
 print("test_UBoolOp(): ",test_UBoolOp())
+print("test_typecheck(): ",test_typecheck())
+print("test_typecheck_shared(): ",test_typecheck_shared())
+print("test_typecheck_programs(): ",test_typecheck_programs())
 
@@ -1,6 +1,16 @@
 from fractions import Fraction
 from dataclasses import dataclass
 from typing import Optional, NewType
+from array import array
+from collections import OrderedDict
+import bisect
+import codecs
+import hashlib
+import os
+import re
+import tempfile
+
+from serialize import Codec
 
 # A minimal example to illustrate typechecking.
 
@@ -14,14 +24,63 @@ class Stream:
     # Stream contains the string and positon
     source: str  
     # This is an instance variable of the class, which stores the string data of the stream.
+    # For a stream read from a file it only holds the current chunk.
     pos: int
     #  stores the current position in the stream.
+    file: object = None
+    # where more source comes from (anything with .read(n), e.g. an open file
+    # or an mmap); None once it is exhausted or for a plain string
+    chunk_size: int = 1 << 16
+    decoder: object = None
+
     def from_string(s):
         return Stream(s, 0)
     # create stream object
+
+    def from_file(f, chunk_size=1 << 16):
+        # read f in chunks, so memory stays bounded however big the file is
+        s = Stream("", 0, f, chunk_size)
+        s.fill()
+        return s
+
+    def fill(self):
+        # Drop what has been consumed (but keep one character for unget) and
+        # append the next chunk. Returns False when there is no more input.
+        if self.file is None:
+            return False
+        chunk = self.file.read(self.chunk_size)
+        if isinstance(chunk, bytes):
+            # mmaps and binary files hand out bytes; a character may be split
+            # between two chunks, which the incremental decoder takes care of
+            if self.decoder is None:
+                self.decoder = codecs.getincrementaldecoder("utf-8")()
+            chunk = self.decoder.decode(chunk, final=not chunk)
+        if not chunk:
+            self.file = None
+            return False
+        keep = max(self.pos - 1, 0)
+        self.source = self.source[keep:] + chunk
+        self.pos = self.pos - keep
+        return True
+
+    def rest(self):
+        # everything not consumed yet, reading the remainder of a file in one go
+        text = self.source[self.pos:]
+        if self.file is not None:
+            more = self.file.read()
+            if isinstance(more, bytes):
+                if self.decoder is None:
+                    self.decoder = codecs.getincrementaldecoder("utf-8")()
+                more = self.decoder.decode(more, final=True)
+            text = text + more
+            self.file = None
+        self.source = text
+        self.pos = len(text)
+        return text
+
     def next_char(self):
     #gets the next char from the stream
-        if self.pos >= len(self.source):
+        if self.pos >= len(self.source) and not self.fill():
             raise EndOfStream()
         self.pos = self.pos + 1
         return self.source[self.pos - 1]
@@ -62,8 +121,18 @@ class EndOfTokens(Exception):
 keywords = "if then else end while do done".split()
 symbolic_operators = "+ - * / < > ≤ ≥ = ≠".split()
 word_operators = "and or not quot rem".split()
+brackets = "( )".split()
 whitespace = " \t\n"
 
+# One match skips the whitespace in front of a token and then reads a number,
+# a word, or any other single character.
+token_re = re.compile("[{0}]*(?:(\\d+)|([^\\W\\d_]+)|([^{0}]))".format(re.escape(whitespace)))
+# For a stream read in chunks, whitespace is skipped a chunk at a time, and a
+# number or word that runs into the end of a chunk is carried on with these.
+spaces_re = re.compile("[{0}]*".format(re.escape(whitespace)))
+digits_re = re.compile("\\d*")
+letters_re = re.compile("[^\\W\\d_]*")
+
 def word_to_token(word):
     if word in keywords:
         return Keyword(word)
@@ -88,37 +157,35 @@ class Lexer:
 
     def next_token(self) -> Token:
         # returns the next token in the input stream
-        try:
-            match self.stream.next_char():
-                case c if c in symbolic_operators: return Operator(c)
-                case c if c.isdigit():
-                    n = int(c)
-                    while True:
-                        try:
-                            c = self.stream.next_char()
-                            if c.isdigit():
-                                n = n*10 + int(c)
-                            else:
-                                self.stream.unget()
-                                return Num(n)
-                        except EndOfStream:
-                            return Num(n)
-                case c if c.isalpha():
-                    s = c
-                    while True:
-                        try:
-                            c = self.stream.next_char()
-                            if c.isalpha():
-                                s = s + c
-                            else:
-                                self.stream.unget()
-                                return word_to_token(s)
-                        except EndOfStream:
-                            return word_to_token(s)
-                case c if c in whitespace:
-                    return self.next_token()
-        except EndOfStream:
+        stream = self.stream
+        # Skip whitespace up to the end of the buffer, then read more: only
+        # what is left of the current chunk is ever held.
+        while True:
+            stream.pos = spaces_re.match(stream.source, stream.pos).end()
+            if stream.pos < len(stream.source) or not stream.fill():
+                break
+        m = token_re.match(stream.source, stream.pos)
+        if m is None:
             raise EndOfTokens
+        stream.pos = m.end()
+        number, word, other = m.groups()
+        if other is not None:
+            if other in symbolic_operators or other in brackets:
+                return Operator(other)
+            raise TokenError(other)
+        # A number or word that runs into the end of the buffer may continue
+        # in the next chunk. Its pieces are collected here, so the buffer is
+        # not kept growing and rescanned from the token's start.
+        parts = [m.group()]
+        rest = digits_re if number is not None else letters_re
+        while stream.pos == len(stream.source) and stream.fill():
+            m = rest.match(stream.source, stream.pos)
+            parts.append(m.group())
+            stream.pos = m.end()
+        text = "".join(parts)
+        if number is not None:
+            return Num(int(text))
+        return word_to_token(text)
 
     def peek_token(self) -> Token:
 
@@ -153,103 +220,208 @@ class Lexer:
         except EndOfTokens:
             raise StopIteration
 
+# A whole program's tokens at once, without a Token object per token: each
+# token is its kind, a small int, plus the offsets of its text in the source.
+# Line and column numbers are only worked out when someone asks for them.
+
+NUM, BOOL, KEYWORD, IDENTIFIER, OPERATOR, END = range(6)
+
+word_kinds = dict.fromkeys(keywords, KEYWORD) | dict.fromkeys(word_operators, OPERATOR) | {"True": BOOL, "False": BOOL}
+
+@dataclass
+class TokenBuffer:
+    source: str
+    kinds: array
+    starts: array
+    ends: array
+    line_starts: list = None
+    # offsets at which each line begins, filled in the first time it is needed
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def text(self, i):
+        return self.source[self.starts[i]:self.ends[i]]
+
+    def token(self, i) -> Token:
+        # the token as the Lexer would have returned it
+        kind = self.kinds[i]
+        if kind == END:
+            raise EndOfTokens
+        if kind == NUM:
+            return Num(int(self.text(i)))
+        if kind == BOOL:
+            return Bool(self.text(i) == "True")
+        return (Keyword, Identifier, Operator)[kind - KEYWORD](self.text(i))
+
+    def position(self, i):
+        # (line, column) of token i, both counted from 1
+        if self.line_starts is None:
+            self.line_starts = [0] + [m.end() for m in re.finditer("\n", self.source)]
+        offset = self.starts[i]
+        line = bisect.bisect_right(self.line_starts, offset)
+        return line, offset - self.line_starts[line - 1] + 1
+
+
+def tokenize_all(source: str) -> TokenBuffer:
+    kinds = array("b")
+    starts = array("q")
+    ends = array("q")
+    pos = 0
+    match_ = token_re.match
+    while (m := match_(source, pos)) is not None:
+        pos = m.end()
+        number, word, other = m.groups()
+        if number is not None:
+            kinds.append(NUM)
+        elif word is not None:
+            kinds.append(word_kinds.get(word, IDENTIFIER))
+        elif other in symbolic_operators or other in brackets:
+            kinds.append(OPERATOR)
+        else:
+            start = pos - 1
+            line = source.count("\n", 0, start) + 1
+            column = start - source.rfind("\n", 0, start)
+            raise TokenError(f"line {line}, column {column}: unexpected {other!r}")
+        starts.append(m.start(m.lastindex))
+        ends.append(pos)
+    # an END token at the end saves the parser from checking the length
+    kinds.append(END)
+    starts.append(len(source))
+    ends.append(len(source))
+    return TokenBuffer(source, kinds, starts, ends)
+
+
 @dataclass
 class Parser:
-    lexer: Lexer
+    tokens: TokenBuffer
+    i: int = 0
+    # index of the next token
 
     def from_lexer(lexer):
-        return Parser(lexer)
+        # A parse needs the whole program anyway, so the rest of the lexer's
+        # stream is tokenized in one go.
+        return Parser(tokenize_all(lexer.stream.rest()))
+
+    def from_string(s):
+        return Parser(tokenize_all(s))
+
+    def kind(self):
+        return self.tokens.kinds[self.i]
+
+    def text(self):
+        return self.tokens.text(self.i)
+
+    def error(self, expected):
+        line, column = self.tokens.position(self.i)
+        found = "end of input" if self.kind() == END else repr(self.text())
+        return TokenError(f"line {line}, column {column}: expected {expected}, found {found}")
+
+    def match(self, kind, text):
+        # consume the next token if it is the expected one
+        if self.kind() != kind or self.text() != text:
+            raise self.error(repr(text))
+        self.i += 1
 
     def parse_if(self):
-        #The match method is called on the Lexer object to check that the 
+        #The match method is called to check that the 
         # next token in the stream
-        self.lexer.match(Keyword("if"))
+        self.match(KEYWORD, "if")
         c = self.parse_expr()
-        self.lexer.match(Keyword("then"))
+        self.match(KEYWORD, "then")
         t = self.parse_expr()
-        self.lexer.match(Keyword("else"))
+        self.match(KEYWORD, "else")
         f = self.parse_expr()
-        self.lexer.match(Keyword("end"))
+        self.match(KEYWORD, "end")
         return IfElse(c, t, f)
 
     def parse_while(self):
-        self.lexer.match(Keyword("while"))
+        self.match(KEYWORD, "while")
         c = self.parse_expr()
-        self.lexer.match(Keyword("do"))
+        self.match(KEYWORD, "do")
         b = self.parse_expr()
-        self.lexer.match(Keyword("done"))
+        self.match(KEYWORD, "done")
         return While(c, b)
 
     def parse_atom(self):
         # checks the type of the next token
-        match self.lexer.peek_token():
-            case Identifier(name):
-                self.lexer.advance()
-                return Variable(name)
-            case Num(value):
-                self.lexer.advance()
-                return NumLiteral(value)
-            case Bool(value):
-                self.lexer.advance()
-                return BoolLiteral(value)
-
-    def parse_mult(self):
-        left = self.parse_atom()
-        while True:
-            match self.lexer.peek_token():
-                case Operator(op) if op in "*/":
-                    self.lexer.advance()
-                    m = self.parse_atom()
-                    left = BinOp(op, left, m)
-                case _:
-                    break
-        return left
-
-    def parse_add(self):
-        left = self.parse_mult()
-        while True:
-            match self.lexer.peek_token():
-                case Operator(op) if op in "+-":
-                    self.lexer.advance()
-                    m = self.parse_mult()
-                    left = BinOp(op, left, m)
-                case _:
-                    break
-        return left
-
-    def parse_cmp(self):
-        left = self.parse_add()
-        match self.lexer.peek_token():
-            case Operator(op) if op in "<>":
-                self.lexer.advance()
-                right = self.parse_add()
-                return BinOp(op, left, right)
+        kind = self.kind()
+        if kind == IDENTIFIER:
+            node = Variable(self.text())
+        elif kind == NUM:
+            node = NumLiteral(int(self.text()))
+        elif kind == BOOL:
+            node = BoolLiteral(self.text() == "True")
+        elif kind == OPERATOR and self.text() == "(":
+            self.i += 1
+            node = self.parse_expr()
+            self.match(OPERATOR, ")")
+            return node
+        elif kind == KEYWORD and self.text() == "if":
+            return self.parse_if()
+        elif kind == KEYWORD and self.text() == "while":
+            return self.parse_while()
+        else:
+            raise self.error("an expression")
+        self.i += 1
+        return node
+
+    def parse_unary(self):
+        if self.kind() == OPERATOR and self.text() in prefix_precedence:
+            op = self.text()
+            self.i += 1
+            # the operand extends over every operator that binds tighter
+            return UnOp(op, self.parse_binary(prefix_precedence[op]))
+        return self.parse_atom()
+
+    def parse_binary(self, min_precedence=0):
+        # precedence climbing: one loop per level actually used, instead of
+        # one method per level for every atom
+        left = self.parse_unary()
+        while self.kind() == OPERATOR:
+            op = self.text()
+            precedence = infix_precedence.get(op)
+            if precedence is None or precedence < min_precedence:
+                break
+            self.i += 1
+            # all infix operators are left associative, so the right operand
+            # may only contain operators that bind tighter
+            right = self.parse_binary(precedence + 1)
+            left = BinOp(op, left, right)
+            if op in comparison_operators and self.kind() == OPERATOR and self.text() in comparison_operators:
+                raise self.error("no second comparison (comparisons do not chain)")
         return left
 
-    def parse_simple(self):
-        return self.parse_cmp()
-
     def parse_expr(self):
         #which handles the different cases for a valid expression: 
-        # if-else, while loop or 
-        # simple expression (a combination of basic mathematical operations 
-        # like addition, subtraction, multiplication, and division and comparison operations like less than, greater than).
-        match self.lexer.peek_token():
-            case Keyword("if"):
-                return self.parse_if()
-            case Keyword("while"):
-                return self.parse_while()
-            case _:
-                return self.parse_simple()
-
-@dataclass
+        # if-else, while loop, a parenthesized expression or any combination
+        # of them with the operators in infix_precedence and prefix_precedence.
+        return self.parse_binary()
+
+
+# How tightly each operator binds; a higher number binds tighter.
+infix_precedence = {
+    "or": 1,
+    "and": 2,
+    "<": 4, ">": 4, "≤": 4, "≥": 4, "=": 4, "≠": 4,
+    "+": 5, "-": 5,
+    "*": 6, "/": 6, "quot": 6, "rem": 6,
+}
+prefix_precedence = {
+    "not": 3,   # not a = b  is  not (a = b)
+    "-": 7,     # -a * b     is  (-a) * b
+}
+comparison_operators = "< > ≤ ≥ = ≠".split()
+
+# frozen so that instances are hashable and can be used as field defaults
+@dataclass(frozen=True)
 class NumType:
     pass
 
-@dataclass
+@dataclass(frozen=True)
 class BoolType:
     pass
-@dataclass
+@dataclass(frozen=True)
 class StringType:
     pass
 
@@ -293,9 +465,15 @@ class While:
 class Variable:
     name: str
 
+@dataclass
+class UnOp:
+    operator: str   # '-' or 'not'
+    operand: 'AST'
+    type: Optional[SimType] = None
 
 
-AST = NumLiteral | BoolLiteral | StringLiteral | BinOp | IfElse | While | Variable
+
+AST = NumLiteral | BoolLiteral | StringLiteral | BinOp | UnOp | IfElse | While | Variable
 # TypedAST = NewType('TypedAST', AST)
 
 
@@ -303,47 +481,116 @@ class TypeError(Exception):
     pass
 
 # Since we don't have variables, environment is not needed.
-def typecheck(program: AST, env = None) -> AST:
+# typecheck works out the types bottom-up in a single pass. It writes each
+# node's type into the node's `type` field, where it has one, and returns the
+# program itself. It also records every node's type in `types`, keyed by the
+# node's id(), so a subtree that occurs more than once (the same e2 used twice,
+# say) is checked only once. Passing the same table to several calls shares
+# that work between them.
+def typecheck(program: AST, env = None, types = None) -> AST:
+    if types is None:
+        types = {}
+    type_of(program, types)
+    return program
+
+def type_of(program: AST, types) -> SimType:
+    key = id(program)
+    if key in types:
+        return types[key][1]
     match program:
-        case NumLiteral() as t: # already typed.
-            return t
-        case BoolLiteral() as t: # already typed.
-            return t
-        case StringLiteral() as t:
-            return t
+        case NumLiteral() | BoolLiteral() | StringLiteral(): # already typed.
+            t = program.type
         case BinOp(op, left, right) if op in "+*-/":
-            tleft = typecheck(left)
-            tright = typecheck(right)
-            if tleft.type != NumType() or tright.type != NumType():
+            if type_of(left, types) != NumType() or type_of(right, types) != NumType():
                 raise TypeError()
-            return BinOp(op, left, right, NumType())
+            t = program.type = NumType()
         case BinOp("<", left, right):
-            tleft = typecheck(left)
-            tright = typecheck(right)
-            if tleft.type != NumType() or tright.type != NumType():
+            if type_of(left, types) != NumType() or type_of(right, types) != NumType():
                 raise TypeError()
-            return BinOp("<", left, right, BoolType())
+            t = program.type = BoolType()
         case BinOp("=", left, right):
-            tleft = typecheck(left)
-            tright = typecheck(right)
-            if tleft.type != tright.type:
+            if type_of(left, types) != type_of(right, types):
                 raise TypeError()
-            return BinOp("=", left, right, BoolType())
-        case IfElse(c, t, f): # We have to typecheck both branches.
-            tc = typecheck(c)
-            if tc.type != BoolType():
+            t = program.type = BoolType()
+        case IfElse(c, et, ef): # We have to typecheck both branches.
+            if type_of(c, types) != BoolType():
                 raise TypeError()
-            tt = typecheck(t)
-            tf = typecheck(f)
-            if tt.type != tf.type: # Both branches must have the same type.
+            t = type_of(et, types)
+            if type_of(ef, types) != t: # Both branches must have the same type.
                 raise TypeError()
-            return IfElse(tc, tt, tf, tt.type) # The common type becomes the type of the if-else.
-    raise TypeError()
+            program.type = t # The common type becomes the type of the if-else.
+        case _:
+            raise TypeError()
+    # the node is kept alongside its type so that its id cannot be reused
+    types[key] = (program, t)
+    return t
+
+
+# Parsed programs keyed by a hash of their source. The in-memory layer keeps
+# the most recently used trees; the optional on-disk layer keeps every tree it
+# has seen in the compact form from serialize.py, so a program parsed by an
+# earlier run is loaded instead of lexed and parsed again.
+# The trees handed out are shared between callers and must not be modified.
+
+ast_codec = Codec([NumLiteral, BoolLiteral, StringLiteral, BinOp, UnOp, IfElse, While, Variable,
+                   NumType, BoolType, StringType])
+
+class ParseCache:
+    def __init__(self, maxsize=256, directory=None):
+        self.maxsize = maxsize
+        self.directory = directory
+        self.trees = OrderedDict()
+        self.hits = 0           # found in memory
+        self.disk_hits = 0      # loaded from the directory
+        self.misses = 0         # parsed
+
+    def key(self, source: str) -> str:
+        return hashlib.blake2b(source.encode("utf-8"), digest_size=16).hexdigest()
+
+    def parse(self, source: str):
+        key = self.key(source)
+        tree = self.trees.get(key)
+        if tree is not None:
+            self.trees.move_to_end(key)
+            self.hits += 1
+            return tree
+        tree = self.load(key)
+        if tree is not None:
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            tree = Parser.from_string(source).parse_expr()
+            self.store(key, tree)
+        self.trees[key] = tree
+        if len(self.trees) > self.maxsize:
+            self.trees.popitem(last=False)
+        return tree
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".ast")
+
+    def load(self, key):
+        if self.directory is None:
+            return None
+        try:
+            with open(self.path(key), "rb") as f:
+                return ast_codec.loads(f.read())
+        except (OSError, ValueError, EOFError):
+            # missing, truncated or written for other AST classes: parse again
+            return None
+
+    def store(self, key, tree):
+        if self.directory is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        # write to a temporary file first so a reader never sees half a tree
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(ast_codec.dumps(tree))
+        os.replace(tmp, self.path(key))
 
 def test_typecheck():
     import pytest
-    t5=typecheck(a)
-    print("t5: ",t5)
     te = typecheck(BinOp("+", NumLiteral(2), NumLiteral(3)))
     print("te: ",te)
     assert te.type == NumType()
@@ -352,6 +599,125 @@ def test_typecheck():
     assert te.type == BoolType()
     with pytest.raises(TypeError):
         typecheck(BinOp("+", BinOp("*", NumLiteral(2), NumLiteral(3)), BinOp("<", NumLiteral(2), NumLiteral(3))))
+    # the same subtree used twice at every level is typed once
+    e = NumLiteral(1)
+    for k in range(60):
+        e = IfElse(BinOp("=", e, e), e, e)
+    types = {}
+    assert typecheck(e, types=types).type == NumType()
+    assert len(types) == 121
+
+def test_lexer():
+    tokens = list(Lexer.from_stream(Stream.from_string("if a1 ≤ 20 then\tx else  False end\n")))
+    assert tokens == [Keyword("if"), Identifier("a"), Num(1), Operator("≤"), Num(20), Keyword("then"),
+                      Identifier("x"), Keyword("else"), Bool(False), Keyword("end")]
+    # a 200000 letter identifier used to take quadratic time
+    tokens = list(Lexer.from_stream(Stream.from_string("x" * 200000 + " + 1")))
+    assert tokens == [Identifier("x" * 200000), Operator("+"), Num(1)]
+    import pytest
+    with pytest.raises(TokenError):
+        list(Lexer.from_stream(Stream.from_string("a $ b")))
+
+def test_lexer_chunks():
+    # tokens split across chunk boundaries, read from a text file and from an mmap
+    import io, mmap, tempfile
+    source = " ".join(f"while abc{k} ≠ {k * 7919} do x * y done" for k in range(200)) + "  "
+    expected = list(Lexer.from_stream(Stream.from_string(source)))
+    for chunk_size in (1, 3, 7, 64):
+        tokens = list(Lexer.from_stream(Stream.from_file(io.StringIO(source), chunk_size)))
+        assert tokens == expected
+    with tempfile.TemporaryFile() as f:
+        f.write(source.encode("utf-8"))
+        f.flush()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            tokens = list(Lexer.from_stream(Stream.from_file(m, 5)))
+    assert tokens == expected
+    # long runs of whitespace and a long word spanning many chunks: the buffer
+    # holds no more than a chunk and the character kept for unget
+    class Reader(io.StringIO):
+        def read(self, n=-1):
+            longest[0] = max(longest[0], len(stream.source))
+            return super().read(n)
+    longest = [0]
+    source = "a" + " \n\t" * 30000 + "b" * 100000 + "   " + "9" * 4000 + " " * 100000
+    stream = Stream("", 0, Reader(source), 16)
+    tokens = list(Lexer.from_stream(stream))
+    assert tokens == [Identifier("a"), Identifier("b" * 100000), Num(int("9" * 4000))]
+    assert longest[0] <= 17
+
+def test_tokenize_all():
+    source = "if a ≤ 20\nthen x else\n  False end"
+    tokens = tokenize_all(source)
+    assert list(tokens.kinds) == [KEYWORD, IDENTIFIER, OPERATOR, NUM, KEYWORD, IDENTIFIER, KEYWORD, BOOL, KEYWORD, END]
+    assert [tokens.token(i) for i in range(len(tokens) - 1)] == list(Lexer.from_stream(Stream.from_string(source)))
+    assert tokens.text(3) == "20"
+    assert tokens.position(0) == (1, 1)
+    assert tokens.position(5) == (2, 6)
+    assert tokens.position(7) == (3, 3)
+    import pytest
+    with pytest.raises(TokenError, match="line 2, column 3"):
+        tokenize_all("a +\nb $ c")
+
+def test_parse_by_index():
+    import io, pytest
+    assert Parser.from_string("1 + 2 * x").parse_expr() == BinOp("+", NumLiteral(1), BinOp("*", NumLiteral(2), Variable("x")))
+    stream = Stream.from_file(io.StringIO("while i < 10 do i + 1 done"), 4)
+    assert Parser.from_lexer(Lexer.from_stream(stream)).parse_expr() == While(BinOp("<", Variable("i"), NumLiteral(10)), BinOp("+", Variable("i"), NumLiteral(1)))
+    with pytest.raises(TokenError, match="line 2, column 1: expected 'then', found 'else'"):
+        Parser.from_string("if a\nelse b end").parse_expr()
+
+def test_parse_operators():
+    import pytest
+    a, b, c, d = Variable("a"), Variable("b"), Variable("c"), Variable("d")
+    parse = lambda s: Parser.from_string(s).parse_expr()
+    assert parse("a + b * c - d") == BinOp("-", BinOp("+", a, BinOp("*", b, c)), d)
+    assert parse("a quot b rem c") == BinOp("rem", BinOp("quot", a, b), c)
+    assert parse("not a = b or c and d") == BinOp("or", UnOp("not", BinOp("=", a, b)), BinOp("and", c, d))
+    assert parse("-(a + b) * -c") == BinOp("*", UnOp("-", BinOp("+", a, b)), UnOp("-", c))
+    assert parse("a ≤ b and c ≠ d") == BinOp("and", BinOp("≤", a, b), BinOp("≠", c, d))
+    assert parse("a - - b") == BinOp("-", a, UnOp("-", b))
+    assert parse("(if a then b else c end) + 1") == BinOp("+", IfElse(a, b, c), NumLiteral(1))
+    # nesting is only limited by the parenthesized depth, not by the number of levels
+    deep = "(" * 150 + "a" + ")" * 150
+    assert parse(deep) == a
+    long = " + ".join(["a"] * 5000)
+    assert parse(long).operator == "+"
+    with pytest.raises(TokenError):
+        parse("a < b < c")
+    with pytest.raises(TokenError):
+        parse("(a + b")
+
+def test_parse_cache():
+    source = "if a+b > 2*d then a*b - c + d else e*f/g end"
+    cache = ParseCache(maxsize=2)
+    tree = cache.parse(source)
+    assert tree == Parser.from_string(source).parse_expr()
+    assert cache.parse(source) is tree
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.parse("1 + 2")
+    cache.parse("3 * 4")     # pushes the first program out
+    cache.parse(source)
+    assert cache.misses == 4
+    with tempfile.TemporaryDirectory() as directory:
+        big = " + ".join(f"(x * {k} - not y)" for k in range(300))
+        first = ParseCache(directory=directory)
+        expected = first.parse(big)
+        # a second cache reads the tree from the directory and does not parse at all
+        again = ParseCache(directory=directory)
+        from_string = Parser.from_string
+        def refuse(source):
+            raise AssertionError("parsed again")
+        Parser.from_string = refuse
+        try:
+            tree = again.parse(big)
+        finally:
+            Parser.from_string = from_string
+        assert tree == expected
+        assert (again.disk_hits, again.misses) == (1, 0)
+        # a damaged file is parsed again rather than trusted
+        with open(again.path(again.key(big)), "wb") as f:
+            f.write(b"AST2 garbage")
+        assert ParseCache(directory=directory).parse(big) == expected
 
 def test_parse():
     def parse(string):
@@ -365,5 +731,10 @@ def test_parse():
     print(parse("if a+b > 2*d then a*b - c + d else e*f/g end"))
 
 # test_parse() # Uncomment to see the created ASTs.
+print(test_lexer())
+print(test_lexer_chunks())
+print(test_tokenize_all())
+print(test_parse_by_index())
+print(test_parse_operators())
 print(test_parse())
 print(test_typecheck())
\ No newline at end of file
@@ -179,6 +179,10 @@ def eval(program: AST, environment: Environment = None) -> Value:
             result_str = eval_(str1) + eval_(str2)
             return result_str
 
+        case Str_slicing(str1,start,end):
+            # native slicing, O(end - start)
+            return eval_(str1)[int(eval_(start)):int(eval_(end))]
+
         case Seq(body):
             v1=None
             for item in body:
@@ -201,15 +201,8 @@ def eval(program: AST, environment: Environment = None) -> Value:
             return result_str
 
         case Str_slicing(str1,start,end):
-            result_str = StringLiteral("")
-            i = Variable("i")
-            i = start
-            body1 = LetMut(i,Get(i),BinOp("+",i,NumLiteral(1)))
-            body2 = LetMut(result_str,Get(result_str),Two_Str_concatenation(result_str,str1[Get(i)]))
-            body = Seq([body1,body2])
-            condition = BinOp("<",i,end)
-            eval_(while_loop(condition,body))
-            return result_str
+            # native slicing, O(end - start)
+            return eval_(str1)[int(eval_(start)):int(eval_(end))]
 
         # case Str_slicing(word,start,end):
         #     return word[start:end]
@@ -273,7 +266,7 @@ def test_string_slicing():
     program = Str_slicing(StringLiteral("Hello, world!"), NumLiteral(0), NumLiteral(5))
     # program = Str_slicing("Hello, world!", NumLiteral(0), NumLiteral(5))
     result = eval(program)
-    assert eval(result) == 'Hello'
+    assert result == 'Hello'
 
 def test_let_eval():
     a  = Variable("a")
@@ -0,0 +1,563 @@
+# AST-to-AST optimizations for the language in code1.py.
+#
+# fold() returns a new tree in which constant subexpressions have been
+# computed once, ahead of evaluation: BinOps over literals, string
+# concatenations of literals and if_else nodes whose condition is known.
+# It also applies the usual algebraic identities (x+0, x*1, x/1, ...) where x
+# is known to be a number: a NumLiteral, a BinOp typecheck found to be one, or
+# arithmetic on those. "a"+0 fails and 0+(1<2) is 1, so neither is rewritten.
+# x*0 is left alone: x may still fail (1/0, or a variable that is not bound),
+# and folding it to 0 would hide that.
+# The input tree is never modified, so subtrees shared with other programs stay
+# intact.
+#
+# eliminate() removes repeated work: a pure subexpression that occurs more than
+# once in a scope is computed once, and one that does not depend on anything a
+# loop changes is computed once before the loop.
+
+from dataclasses import fields, is_dataclass, replace
+from fractions import Fraction
+
+from code1 import (NumLiteral, BoolLiteral, StringLiteral, BinOp, Variable, Let, LetMut,
+                   if_else, while_loop, for_loop, Break, Continue, Two_Str_concatenation,
+                   Str_slicing, Seq, Put, Get, Assign, Print, LetFun, FunCall, LetAnd,
+                   NumType, BoolType, StringType, InvalidProgram, Environment, eval, typecheck,
+                   example_programs)
+
+
+def is_node(value):
+    return is_dataclass(value) and not isinstance(value, (NumType, BoolType, StringType))
+
+
+def children(program):
+    for fld in fields(program):
+        value = getattr(program, fld.name)
+        if isinstance(value, list):
+            yield from (item for item in value if is_node(item))
+        elif is_node(value):
+            yield value
+
+
+def walk(program):
+    todo = [program]
+    while todo:
+        program = todo.pop()
+        yield program
+        todo.extend(children(program))
+
+
+def size(program):
+    return sum(1 for _ in walk(program))
+
+
+def map_children(program, f):
+    # a copy of program with f applied to each of its child nodes
+    changes = {}
+    for fld in fields(program):
+        value = getattr(program, fld.name)
+        if isinstance(value, list):
+            changes[fld.name] = [f(item) for item in value]
+        elif is_node(value):
+            changes[fld.name] = f(value)
+    if not changes:
+        return program
+    return replace(program, **changes)
+
+
+def is_literal(program):
+    return isinstance(program, (NumLiteral, BoolLiteral, StringLiteral))
+
+
+def literal(value):
+    if isinstance(value, bool):
+        return BoolLiteral(value)
+    if isinstance(value, str):
+        return StringLiteral(value)
+    return NumLiteral(value)
+
+
+def is_number(program, n):
+    # BoolLiteral(False) == 0 in Python, so check the node type as well
+    return isinstance(program, NumLiteral) and program.value == n
+
+
+def is_numeric(program):
+    # True if program can only evaluate to a number (or fail)
+    match program:
+        case NumLiteral():
+            return True
+        case BinOp(op, left, right):
+            return program.type == NumType() or (op in "+-*/" and is_numeric(left) and is_numeric(right))
+    return False
+
+
+def is_pure(program):
+    # True if evaluating program cannot change a variable, print or fail to
+    # terminate, so it may be dropped or evaluated any number of times
+    match program:
+        case NumLiteral() | BoolLiteral() | StringLiteral() | Variable() | Get():
+            return True
+        case BinOp(_, left, right) | Two_Str_concatenation(left, right):
+            return is_pure(left) and is_pure(right)
+        case if_else(expr, et, ef) | Str_slicing(expr, et, ef):
+            return is_pure(expr) and is_pure(et) and is_pure(ef)
+        case Let(_, e1, e2) | LetMut(_, e1, e2):
+            return is_pure(e1) and is_pure(e2)
+        case Seq(body):
+            return all(is_pure(item) for item in body)
+    return False
+
+
+def fold(program):
+    match program:
+        case NumLiteral() | BoolLiteral() | StringLiteral() | Variable():
+            return program
+
+        case BinOp(op, left, right):
+            left = fold(left)
+            right = fold(right)
+            if is_literal(left) and is_literal(right):
+                try:
+                    return literal(eval(BinOp(op, left, right)))
+                except Exception:
+                    pass    # leave the error to happen at run time
+            match op:
+                case "+" if is_number(right, 0) and is_numeric(left):
+                    return left
+                case "+" if is_number(left, 0) and is_numeric(right):
+                    return right
+                case "-" if is_number(right, 0) and is_numeric(left):
+                    return left
+                case "*" if is_number(right, 1) and is_numeric(left):
+                    return left
+                case "*" if is_number(left, 1) and is_numeric(right):
+                    return right
+                case "/" if is_number(right, 1) and is_numeric(left):
+                    return left
+            return BinOp(op, left, right, program.type)
+
+        case if_else(expr, et, ef):
+            expr = fold(expr)
+            if is_literal(expr):
+                # eval takes the true branch exactly when the condition == True
+                value = expr.word if isinstance(expr, StringLiteral) else expr.value
+                return fold(et) if value == True else fold(ef)
+            return if_else(expr, fold(et), fold(ef), program.type)
+
+        case Two_Str_concatenation(str1, str2):
+            str1 = fold(str1)
+            str2 = fold(str2)
+            if isinstance(str1, StringLiteral) and isinstance(str2, StringLiteral):
+                return StringLiteral(str1.word + str2.word)
+            return Two_Str_concatenation(str1, str2)
+
+    return map_children(program, fold)
+
+
+# Common subexpressions and loop invariants.
+#
+# Both rewrites bind a pure subexpression to a fresh name ("$0", "$1", ...,
+# which no parsed program can contain) in a Let around the code that uses it.
+# They only take a subexpression from a place where it is evaluated every time
+# the surrounding code is: not from an if_else branch, a loop body or anything
+# after a Break, so nothing is computed that would not have been. It may be
+# computed earlier, which like fold assumes that the arithmetic in it does not
+# fail. Code that calls a function is left alone, since the function may Put a
+# variable around its LetFun, and so is code that could add a name to the scope
+# the new Let would close (an Assign, or a for_loop over a name not bound
+# around it).
+
+SAME, REGION, SCOPE = range(3)
+
+
+def bind(bound, *variables):
+    # bound is the set of names bound around a piece of code, or None in a
+    # function body, where it depends on the caller
+    if bound is None:
+        return None
+    return bound | {var.name for var in variables}
+
+
+def layout(program, bound):
+    # (field, how, names bound around it) for each child of program, in the
+    # order eval evaluates them. SAME children are evaluated whenever program
+    # is; the others start a region of their own, which is entered at most once
+    # (REGION) or in a new scope (SCOPE) each time program runs.
+    match program:
+        case Let(var, _, _) | LetMut(var, _, _):
+            return [("e1", SAME, bound), ("e2", SCOPE, bind(bound, var))]
+        case LetAnd(var1, _, var2, _, _):
+            return [("expr1", SAME, bound), ("expr2", SAME, bound), ("expr3", SCOPE, bind(bound, var1, var2))]
+        case LetFun(name, _, _, _):
+            return [("body", SCOPE, None), ("expr", SCOPE, bind(bound, name))]
+        case if_else():
+            return [("expr", SAME, bound), ("et", REGION, bound), ("ef", REGION, bound)]
+        case while_loop():
+            return [("condition", SAME, bound), ("body", REGION, bound)]
+        case for_loop(var, _, _, _, _):
+            inner = bind(bound, var)
+            return [("expr", SAME, bound), ("condition", SAME, inner), ("updt", REGION, inner), ("body", REGION, inner)]
+    return [(fld.name, SAME, bound) for fld in fields(program)
+            if is_node(getattr(program, fld.name)) or isinstance(getattr(program, fld.name), list)]
+
+
+def jumps(program):
+    # True if program may Break or Continue out of the loop around it
+    match program:
+        case Break() | Continue():
+            return True
+        case while_loop(condition, _):
+            return jumps(condition)
+        case for_loop(_, e1, condition, _, _):
+            return jumps(e1) or jumps(condition)
+    return any(jumps(child) for child in children(program))
+
+
+def split(program, bound, same, region):
+    # Rebuilds program with same(child) for each SAME child and
+    # region(child, bound, scoped) for every other one. A child evaluated after
+    # one that may jump is not certain to run, so it counts as a region.
+    changes = {}
+    jumped = False
+    for name, how, inner in layout(program, bound):
+        value = getattr(program, name)
+        items = value if isinstance(value, list) else [value]
+        new_items = []
+        for item in items:
+            if not is_node(item):
+                new_items.append(item)
+            elif how == SAME and not jumped:
+                new_items.append(same(item))
+                jumped = jumps(item)
+            else:
+                new_items.append(region(item, inner, how == SCOPE))
+        if any(new is not old for new, old in zip(new_items, items)):
+            changes[name] = new_items if isinstance(value, list) else new_items[0]
+    if not changes:
+        return program
+    return replace(program, **changes)
+
+
+def keep(program, bound, scoped):
+    return program
+
+
+def always_evaluated(program, bound):
+    # the subtrees that are evaluated every time program is, in preorder
+    found = []
+    def same(child):
+        found.append(child)
+        return split(child, bound, same, keep)
+    same(program)
+    return found
+
+
+def substitute(program, bound, replacements):
+    # program with the always evaluated nodes in replacements (by id) replaced
+    def same(child):
+        if id(child) in replacements:
+            return replacements[id(child)]
+        return split(child, bound, same, keep)
+    return same(program)
+
+
+def is_simple(program):
+    # pure and binds no names, so it means the same wherever its variables do
+    match program:
+        case NumLiteral() | BoolLiteral() | StringLiteral() | Variable() | Get():
+            return True
+        case BinOp() | if_else() | Two_Str_concatenation() | Str_slicing():
+            return all(is_simple(child) for child in children(program))
+    return False
+
+
+def is_candidate(program):
+    # worth computing once: anything simple beyond a literal or a variable
+    return (is_simple(program)
+            and not isinstance(program, (NumLiteral, BoolLiteral, StringLiteral, Variable, Get)))
+
+
+def free_names(program):
+    return {node.name for node in walk(program) if isinstance(node, Variable)}
+
+
+def written_names(program):
+    # the names program may change
+    names = set()
+    for node in walk(program):
+        match node:
+            case Put(Variable(name), _) | Assign(Variable(name), _) | for_loop(Variable(name), _, _, _, _):
+                names.add(name)
+            case LetAnd(Variable(name1), _, Variable(name2), _, _):
+                names.update((name1, name2))
+    return names
+
+
+def calls(program):
+    return any(isinstance(node, FunCall) for node in walk(program))
+
+
+def leaks(program, bound):
+    # True if running program may add a name to the innermost scope
+    match program:
+        case Assign():
+            return True
+        case for_loop(Variable(name), _, _, _, _) if bound is None or name not in bound:
+            return True
+    found = False
+    def same(child):
+        nonlocal found
+        found = found or leaks(child, bound)
+        return child
+    def region(child, inner, scoped):
+        nonlocal found
+        if not scoped:
+            found = found or leaks(child, inner)
+        return child
+    split(program, bound, same, region)
+    return found
+
+
+class Shapes:
+    # numbers structurally identical subtrees alike, visiting each node once
+    def __init__(self):
+        self.numbers = {}
+        self.memo = {}
+
+    def number(self, program):
+        if id(program) in self.memo:
+            return self.memo[id(program)][1]
+        parts = [type(program)]
+        for fld in fields(program):
+            value = getattr(program, fld.name)
+            if fld.name != "type":
+                parts.append(self.number(value) if is_node(value) else value)
+        n = self.numbers.setdefault(tuple(parts), len(self.numbers))
+        # the node is kept so that its id cannot be reused
+        self.memo[id(program)] = (program, n)
+        return n
+
+
+def outermost(nodes, test):
+    # the nodes passing test that are not inside another one that does
+    taken = []
+    inside = set()
+    for node in nodes:
+        if id(node) not in inside and test(node):
+            taken.append(node)
+            inside.update(id(child) for child in walk(node))
+    return taken
+
+
+def wrap(bindings, program):
+    for name, expr in reversed(bindings):
+        program = Let(Variable(name), expr, program)
+    return program
+
+
+class Eliminator:
+    def __init__(self):
+        self.names = 0
+        self.shapes = Shapes()
+        # nodes no longer evaluated: once per extra occurrence of a common
+        # subexpression, once per iteration for a loop invariant
+        self.eliminated = 0
+
+    def fresh(self):
+        self.names += 1
+        return f"${self.names - 1}"
+
+    def cse(self, program, bound):
+        # the regions inside this one first, then this one
+        def same(child):
+            return split(child, bound, same, lambda child, inner, scoped: self.cse(child, inner))
+        program = same(program)
+        if calls(program) or leaks(program, bound):
+            return program
+        written = written_names(program)
+        groups = {}
+        for node in always_evaluated(program, bound):
+            if is_candidate(node) and not free_names(node) & written:
+                groups.setdefault(self.shapes.number(node), []).append(node)
+        bindings = []
+        replacements = {}
+        inside = set()
+        for group in sorted(groups.values(), key=lambda group: -size(group[0])):
+            group = [node for node in group if id(node) not in inside]
+            if len(group) < 2:
+                continue
+            name = self.fresh()
+            for node in group:
+                replacements[id(node)] = Variable(name)
+                inside.update(id(child) for child in walk(node))
+            bindings.append((name, group[0]))
+            self.eliminated += (len(group) - 1) * size(group[0])
+        if not bindings:
+            return program
+        return wrap(bindings, substitute(program, bound, replacements))
+
+    def hoist(self, program, bound):
+        # inner loops first, so what they hoist may leave the outer loop too
+        def same(child):
+            child = split(child, bound, same, lambda child, inner, scoped: self.hoist(child, inner))
+            if isinstance(child, (while_loop, for_loop)):
+                return self.hoist_loop(child, bound)
+            return child
+        return same(program)
+
+    def hoist_loop(self, loop, bound):
+        if calls(loop) or leaks(loop, bound):
+            return loop
+        written = written_names(loop)
+        invariant = lambda node: is_candidate(node) and not free_names(node) & written
+        match loop:
+            case while_loop(condition, body):
+                before = outermost(always_evaluated(condition, bound), invariant)
+                # The body may not run at all. Its invariants are computed
+                # only once the condition has held, which evaluates a pure
+                # condition one extra time.
+                inside = outermost(always_evaluated(body, bound), invariant) if is_pure(condition) else []
+            case for_loop(var, _, condition, _, _):
+                # the condition runs after the initial value is stored, so
+                # only it is certain to be evaluated before the loop exits
+                before = outermost(always_evaluated(condition, bind(bound, var)), invariant)
+                inside = []
+        names = {}
+        replacements = {}
+        outer, inner = [], []
+        for bindings, nodes in ((outer, before), (inner, inside)):
+            for node in nodes:
+                shape = self.shapes.number(node)
+                if shape not in names:
+                    names[shape] = self.fresh()
+                    bindings.append((names[shape], node))
+                replacements[id(node)] = Variable(names[shape])
+                self.eliminated += size(node)
+        if not replacements:
+            return loop
+        match loop:
+            case while_loop(condition, body):
+                condition = substitute(condition, bound, replacements)
+                loop = while_loop(condition, substitute(body, bound, replacements))
+                if inner:
+                    loop = if_else(condition, wrap(inner, loop), Seq([]))
+            case for_loop(var, e1, condition, updt, body):
+                loop = for_loop(var, e1, substitute(condition, bind(bound, var), replacements), updt, body)
+        return wrap(outer, loop)
+
+
+def eliminate(program):
+    # (the optimized program, the number of nodes eliminated)
+    eliminator = Eliminator()
+    program = eliminator.cse(program, frozenset())
+    program = eliminator.hoist(program, frozenset())
+    return program, eliminator.eliminated
+
+
+def test_fold_constants():
+    e7 = BinOp("*", NumLiteral(2), BinOp("/", BinOp("+", NumLiteral(7), NumLiteral(9)), NumLiteral(5)))
+    assert fold(e7) == NumLiteral(Fraction(32, 5))
+    assert fold(BinOp("<", NumLiteral(2), NumLiteral(3))) == BoolLiteral(True)
+    s = Two_Str_concatenation(StringLiteral("ab"), Two_Str_concatenation(StringLiteral("c"), StringLiteral("d")))
+    assert fold(s) == StringLiteral("abcd")
+    # a constant inside a loop body is folded once, here
+    a = Variable("a")
+    loop = while_loop(BinOp("<", Get(a), BinOp("*", NumLiteral(5), NumLiteral(2))), Put(a, BinOp("+", Get(a), NumLiteral(1))))
+    assert fold(loop).condition == BinOp("<", Get(a), NumLiteral(10))
+
+def test_fold_identities():
+    a = Variable("a")
+    x = BinOp("-", a, NumLiteral(2), NumType())    # as typecheck leaves it
+    assert fold(BinOp("+", x, NumLiteral(0))) == x
+    assert fold(BinOp("+", NumLiteral(0), x)) == x
+    assert fold(BinOp("*", BinOp("-", x, NumLiteral(0)), NumLiteral(1))) == x
+    assert fold(BinOp("/", x, BinOp("-", NumLiteral(3), NumLiteral(2)))) == x
+    assert fold(BinOp("+", BinOp("*", x, NumLiteral(3)), NumLiteral(0))) == BinOp("*", x, NumLiteral(3))
+    e = typecheck(Let(a, NumLiteral(2), BinOp("*", NumLiteral(1), BinOp("+", a, a))))
+    assert fold(e).e2 == BinOp("+", a, a, NumType())
+    # x*0 keeps x, which may fail or have an effect
+    for e in (BinOp("*", x, NumLiteral(0)), BinOp("*", Put(a, NumLiteral(1)), NumLiteral(0)),
+              BinOp("*", BinOp("/", NumLiteral(1), NumLiteral(0)), NumLiteral(0)),
+              BinOp("*", NumLiteral(0), BinOp("/", NumLiteral(1), NumLiteral(0)))):
+        assert fold(e) == e
+    # a boolean False is not the number 0
+    e = BinOp("+", x, BoolLiteral(False))
+    assert fold(e) == e
+    # nor is x rewritten when it is not known to be a number: it may be a string or a boolean
+    for e in (BinOp("+", a, NumLiteral(0)), BinOp("*", a, NumLiteral(0)), BinOp("/", a, NumLiteral(1)),
+              BinOp("+", NumLiteral(0), BinOp("<", a, NumLiteral(2)))):
+        assert fold(e) == e
+    assert eval(fold(BinOp("+", NumLiteral(0), BinOp("<", NumLiteral(1), NumLiteral(2))))) == 1
+    import pytest
+    with pytest.raises(TypeError):
+        eval(fold(BinOp("+", StringLiteral("a"), NumLiteral(0))))
+
+def test_fold_if_else():
+    a = Variable("a")
+    e = if_else(BinOp(">", NumLiteral(50), NumLiteral(36)), BinOp("+", a, NumLiteral(1)), Print(a))
+    assert fold(e) == BinOp("+", a, NumLiteral(1))
+    e = if_else(BoolLiteral(False), a, BinOp("*", NumLiteral(2), NumLiteral(3)))
+    assert fold(e) == NumLiteral(6)
+
+def test_fold_keeps_errors():
+    for e in (BinOp("/", NumLiteral(1), NumLiteral(0)), BinOp("/", StringLiteral("12"), NumLiteral(3))):
+        assert fold(e) == e
+    # an error in a branch that is not taken is no error at all
+    x = Variable("x")
+    e = if_else(x, BinOp("/", StringLiteral(""), NumLiteral(3)), NumLiteral(1))
+    env = Environment()
+    env.add("x", False)
+    assert eval(fold(e), env) == 1
+
+def test_fold_keeps_results():
+    for program, expected in example_programs():
+        assert eval(fold(program)) == expected
+
+def test_cse():
+    x, y = Variable("x"), Variable("y")
+    xy = lambda: BinOp("*", Get(x), Get(y))
+    e = LetMut(x, NumLiteral(3), Let(y, NumLiteral(4), BinOp("+", xy(), BinOp("-", xy(), xy()))))
+    program, eliminated = eliminate(e)
+    assert eliminated == 2 * size(xy())
+    assert program.e2.e2 == Let(Variable("$0"), xy(), BinOp("+", Variable("$0"), BinOp("-", Variable("$0"), Variable("$0"))))
+    assert eval(program) == 12
+    # not merged: the two a + a are in different scopes, and x * y changes in between
+    a = Variable("a")
+    e = BinOp("+", Let(a, NumLiteral(5), BinOp("+", a, a)), Let(a, NumLiteral(6), BinOp("+", a, a)))
+    assert eliminate(e) == (e, 0)
+    e = LetMut(x, NumLiteral(3), Let(y, NumLiteral(4), Seq([xy(), Put(x, NumLiteral(1)), xy()])))
+    assert eliminate(e) == (e, 0)
+
+def test_hoist():
+    a, n = Variable("a"), Variable("n")
+    loop = while_loop(BinOp("<", Get(a), BinOp("*", Get(n), NumLiteral(2))),
+                      Put(a, BinOp("+", Get(a), BinOp("*", Get(n), NumLiteral(3)))))
+    e = LetMut(a, NumLiteral(0), Let(n, NumLiteral(10), Seq([loop, Get(a)])))
+    program, eliminated = eliminate(e)
+    assert eliminated == 8
+    guarded = program.e2.e2.body[0]
+    assert guarded.e1 == BinOp("*", Get(n), NumLiteral(2))
+    assert guarded.e2.et == Let(Variable("$1"), BinOp("*", Get(n), NumLiteral(3)),
+                                while_loop(BinOp("<", Get(a), Variable("$0")), Put(a, BinOp("+", Get(a), Variable("$1")))))
+    assert eval(program) == eval(e) == 30
+    # n changes in the loop, the product after the Break may not run, and f may change n
+    f = Variable("f")
+    for body in (Put(n, BinOp("*", Get(n), NumLiteral(2))),
+                 Seq([if_else(BinOp(">", Get(a), NumLiteral(5)), Break(), Put(a, Get(a))), BinOp("*", Get(n), NumLiteral(3))]),
+                 FunCall(f, [])):
+        loop = while_loop(BinOp("<", Get(a), NumLiteral(9)), Seq([Put(a, BinOp("+", Get(a), NumLiteral(1))), body]))
+        e = LetMut(a, NumLiteral(0), Let(n, NumLiteral(10), LetFun(f, [], Put(n, NumLiteral(0)), loop)))
+        assert eliminate(e)[1] == 0
+
+def test_eliminate_keeps_results():
+    for program, expected in example_programs():
+        assert eval(eliminate(program)[0]) == expected
+
+
+print("test_fold_constants(): ", test_fold_constants())
+print("test_fold_identities(): ", test_fold_identities())
+print("test_fold_if_else(): ", test_fold_if_else())
+print("test_fold_keeps_results(): ", test_fold_keeps_results())
+print("test_cse(): ", test_cse())
+print("test_hoist(): ", test_hoist())
+print("test_eliminate_keeps_results(): ", test_eliminate_keeps_results())
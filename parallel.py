@@ -0,0 +1,388 @@
+# Parallel evaluation of the independent parts of a program.
+#
+# A pure subtree (see analyse) reads variables but never writes one, prints
+# or jumps out of a loop, and it always terminates, so two pure subtrees
+# cannot affect each other and may be evaluated at the same time. Where the
+# operands of a BinOp or a concatenation, or a run of consecutive items of a
+# Seq, are all pure and each costs at least min_cost nodes of work,
+# parallel_eval sends them to a pool of worker processes together with the
+# values of the variables they read, and waits for all of them.
+#
+# The merge is deterministic: the values are combined in program order, and
+# if parts fail, the error is the one from the first failing part in program
+# order, which is the one eval would have raised. The outcome is the same as
+# eval's, and everything that is not a parallel part runs in this process,
+# as in eval.
+#
+# Planning walks the whole program once, and sending a part to a worker
+# costs about as much as evaluating each of its nodes once, so this pays off
+# where evaluation does much more work than the size of the tree suggests: a
+# subtree shared by several parents is evaluated once for each, arithmetic
+# on big Fractions is slow, and a part in a loop body or a function is
+# evaluated many times. Parts are not sent with every request either. They
+# are kept in `registry` under a key. Workers forked after the program was
+# planned have them already, and any other worker asks for a part once, as
+# an arena.Arena (which keeps shared subtrees shared), and keeps it. After
+# that only the key and the variables' values travel.
+#
+# None of this pays off without several CPUs to run the workers on: with a
+# single one the parts still run one after the other, and the planning and
+# the sending come on top. There bench_parallel() measures parallel_eval at
+# a third (depth=16) to two thirds (depth=18) of the speed of eval.
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from fractions import Fraction
+from typing import Callable, List
+import itertools
+import multiprocessing
+import operator
+import os
+import time
+
+from code1 import (NumLiteral, BoolLiteral, StringLiteral, BinOp, Variable, Let, LetMut, if_else,
+                   Two_Str_concatenation, Str_slicing, Seq, Get, Put, Environment, eval, divide,
+                   concat, as_str, is_string, evaluators, InvalidProgram, example_programs)
+from arena import Arena, kinds, layouts, list_fields, child_nodes, from_tree, arena_eval
+from optimizer import map_children
+
+
+binary = {
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    "/": divide,
+    ">": operator.gt,
+    "<": operator.lt,
+    "==": operator.eq,
+}
+plain = (int, bool, str, Fraction)
+pure_classes = {NumLiteral, BoolLiteral, StringLiteral, Variable, Get, BinOp, if_else,
+                Two_Str_concatenation, Str_slicing, Let, LetMut, Seq}
+no_names = frozenset()
+
+# key -> part. In this process, the parts of the programs being run; in a
+# worker, also the parts it was sent, the most recently used last.
+registry = OrderedDict()
+registry_size = 64
+keys = itertools.count()
+MISSING = "missing"
+
+
+def child_getter(cls):
+    # a function from a node of class cls to the tuple of its children
+    layout = layouts[kinds[cls]]
+    if not layout:
+        return lambda node: ()
+    if any(name == list_fields.get(cls) for name in layout):
+        return lambda node: tuple(child_nodes(node, kinds[cls]))
+    getter = operator.attrgetter(*layout)
+    return getter if len(layout) > 1 else lambda node: (getter(node),)
+
+getters = {cls: child_getter(cls) for cls in kinds}
+
+
+def analyse(program):
+    # Effect analysis: id(node) -> (pure, cost, names) for every node of
+    # program. The nodes that can be pure are those optimizer.is_pure accepts:
+    # no Put, Assign, Print, loop, Break, Continue or function. cost is the
+    # size of the node's subtree counted the way eval walks it, a shared
+    # subtree once for every place it is used in. names are the variables a
+    # pure node reads (or binds).
+    facts = {}
+    todo = [(program, False)]
+    while todo:
+        node, expanded = todo.pop()
+        if id(node) in facts:
+            continue
+        getter = getters.get(type(node))
+        kids = () if getter is None else getter(node)
+        if not expanded:
+            todo.append((node, True))
+            todo.extend([(kid, False) for kid in kids])
+            continue
+        pure = type(node) in pure_classes
+        cost = 1
+        names = frozenset([node.name]) if type(node) is Variable else no_names
+        for kid in kids:
+            kid_pure, kid_cost, kid_names = facts[id(kid)]
+            pure = pure and kid_pure
+            cost += kid_cost
+            if kid_names and pure:
+                names = names | kid_names
+        facts[id(node)] = (pure, cost, names if pure else no_names)
+    return facts
+
+
+def evaluate_part(key, blob, bindings):
+    # in a worker: (True, value), (False, the exception eval raised), or
+    # (MISSING, None) when the worker does not have the part and was not sent it
+    program = registry.get(key)
+    if program is None:
+        if blob is None:
+            return MISSING, None
+        program = registry[key] = Arena.loads(blob)
+        if len(registry) > registry_size:
+            registry.popitem(last=False)
+    else:
+        registry.move_to_end(key)
+    environment = Environment()
+    for name, value in bindings.items():
+        environment.add(name, value)
+    try:
+        if isinstance(program, Arena):
+            return True, arena_eval(program, environment)
+        return True, eval(program, environment)
+    except Exception as e:
+        return False, e
+
+
+def last(values):
+    return values[-1]
+
+
+# Fork stands for the node it replaces in the tree parallel_eval runs: eval
+# calls its evaluate method (registered in code1.evaluators below), which
+# evaluates the parts in the pool and combines their values.
+@dataclass(eq=False)
+class Fork:
+    parts: List['AST']
+    combine: Callable = field(repr=False)
+    pool: 'Parallel' = field(repr=False)
+    keys: List[tuple] = field(default=None, repr=False)
+    names: List[List[str]] = field(default=None, repr=False)
+    blobs: List[bytes] = field(default=None, repr=False)    # encoded when a worker first asks
+
+    def evaluate(self, environment, tail=False):
+        return self.combine(self.pool.run(self, environment))
+
+    def blob(self, k):
+        if self.blobs is None:
+            self.blobs = [None] * len(self.parts)
+        if self.blobs[k] is None:
+            self.blobs[k] = from_tree(self.parts[k]).dumps()
+        return self.blobs[k]
+
+
+evaluators[Fork] = Fork.evaluate
+
+
+class Parallel:
+    def __init__(self, executor=None, min_cost=5000):
+        self.executor = executor
+        self.min_cost = min_cost
+        # True when the workers were forked after plan, with the registry in place
+        self.inherited = False
+        self.forks = 0          # parts sent to the pool, for the tests
+        self.facts = None
+        self.keys = []
+
+    def plan(self, program):
+        # program with Forks in place of the parts to evaluate in parallel
+        self.facts = analyse(program)
+        try:
+            return self.rewrite(program)
+        finally:
+            self.facts = None
+
+    def release(self):
+        # forget the parts of the plan
+        for key in self.keys:
+            registry.pop(key, None)
+        self.keys = []
+
+    def parallel(self, program):
+        pure, cost, names = self.facts[id(program)]
+        return pure and cost >= self.min_cost
+
+    def fork(self, parts, combine):
+        fork_keys = []
+        for part in parts:
+            key = (os.getpid(), next(keys))
+            registry[key] = part
+            fork_keys.append(key)
+        self.keys += fork_keys
+        return Fork(parts, combine, self, fork_keys, [sorted(self.facts[id(part)][2]) for part in parts])
+
+    def rewrite(self, program):
+        # a part is evaluated by eval in its worker, so there is nothing to
+        # rewrite inside one
+        match program:
+            case BinOp(op, left, right) if op in binary and self.parallel(left) and self.parallel(right):
+                fn = binary[op]
+                return self.fork([left, right], lambda values: fn(*values))
+            case Two_Str_concatenation(str1, str2) if self.parallel(str1) and self.parallel(str2):
+                return self.fork([str1, str2], lambda values: concat(*values))
+            case Seq(body):
+                items = []
+                run = []
+                for item in body + [None]:
+                    if item is not None and self.parallel(item):
+                        run.append(item)
+                        continue
+                    if len(run) > 1:
+                        items.append(self.fork(run, last))
+                    else:
+                        items.extend(self.rewrite(part) for part in run)
+                    run = []
+                    if item is not None:
+                        items.append(self.rewrite(item))
+                return Seq(items)
+        return map_children(program, self.rewrite)
+
+    def submit(self, fork, k, bindings, send):
+        blob = fork.blob(k) if send else None
+        self.forks += 1
+        return self.executor.submit(evaluate_part, fork.keys[k], blob, bindings)
+
+    def run(self, fork, environment):
+        # the parts' values, in order
+        futures = []
+        for k, names in enumerate(fork.names):
+            bindings = {}
+            for name in names:
+                # a name that is not bound is left for the part to fail on, in its turn
+                if environment.check(name):
+                    value = environment.get(name)
+                    bindings[name] = as_str(value) if is_string(value) else value
+            if all(isinstance(value, plain) for value in bindings.values()):
+                futures.append((self.submit(fork, k, bindings, not self.inherited), bindings))
+            else:
+                # a function value cannot be sent; evaluate the part here, in its turn
+                futures.append((None, None))
+        values = []
+        error = None
+        for k, (future, bindings) in enumerate(futures):
+            if future is not None:
+                ok, value = future.result()
+                if ok == MISSING:
+                    ok, value = self.submit(fork, k, bindings, True).result()
+            elif error is not None:
+                ok, value = True, None      # an earlier part failed, the value is not needed
+            else:
+                try:
+                    ok, value = True, eval(fork.parts[k], environment)
+                except Exception as e:
+                    ok, value = False, e
+            if not ok and error is None:
+                error = value
+            values.append(value)
+        if error is not None:
+            raise error
+        return values
+
+
+def parallel_eval(program, environment: Environment = None, executor=None, min_cost=5000):
+    # eval, with the parts analyse finds evaluated in a pool of worker
+    # processes: executor, or one forked for the run once the parts are known
+    planner = Parallel(executor, min_cost)
+    try:
+        planned = planner.plan(program)
+        if executor is not None:
+            return eval(planned, environment)
+        fork = "fork" in multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("fork") if fork else None
+        with ProcessPoolExecutor(mp_context=context) as planner.executor:
+            planner.inherited = fork
+            return eval(planned, environment)
+    finally:
+        planner.release()
+
+
+def pure_sum(n, start):
+    # start + 0 + 1 + ... + (n - 1), as a pure expression of about 2n nodes,
+    # balanced so that eval does not run out of stack
+    def total(lo, hi):
+        if hi - lo == 1:
+            return NumLiteral(lo)
+        mid = (lo + hi) // 2
+        return BinOp("+", total(lo, mid), total(mid, hi))
+    return BinOp("+", start, total(0, n))
+
+
+def shared_sum(depth, start):
+    # start * 2**depth, as a chain of e + e over one shared e: depth + 1
+    # distinct nodes, 2**(depth + 1) - 1 visits for eval
+    e = start
+    for k in range(depth):
+        e = BinOp("+", e, e)
+    return e
+
+
+def bench_parallel(depth=16, parts=4, repeat=3):
+    a = Variable("a")
+    program = Let(a, NumLiteral(1), Seq([shared_sum(depth, BinOp("+", a, NumLiteral(k))) for k in range(parts)]))
+    t_eval = min(timeit_(lambda: eval(program)) for _ in range(repeat))
+    t_parallel = min(timeit_(lambda: parallel_eval(program, min_cost=2 ** depth)) for _ in range(repeat))
+    return t_eval, t_parallel, t_eval / t_parallel
+
+
+def timeit_(f):
+    start = time.perf_counter()
+    f()
+    return time.perf_counter() - start
+
+
+def test_analyse():
+    a = Variable("a")
+    e = BinOp("+", Let(a, NumLiteral(5), BinOp("+", a, a)), Put(a, NumLiteral(1)))
+    facts = analyse(e)
+    assert facts[id(e.left)] == (True, 6, {"a"}) and facts[id(e.right)][:2] == (False, 3)
+    assert facts[id(e)][:2] == (False, 10)
+    # 2**30 paths through the tree: the analysis looks at each node once,
+    # the cost counts every visit eval would make
+    e = NumLiteral(1)
+    for k in range(30):
+        e = BinOp("+", e, e)
+    assert analyse(e)[id(e)] == (True, 2 ** 31 - 1, set())
+
+def test_parallel_eval():
+    a = Variable("a")
+    b = Variable("b")
+    with ProcessPoolExecutor(2) as executor:
+        for program, expected in example_programs():
+            assert parallel_eval(program, executor=executor, min_cost=2) == expected
+        planner = Parallel(executor, min_cost=100)
+        e = Let(a, NumLiteral(3), BinOp("*", pure_sum(100, a), Let(b, StringLiteral("x"), pure_sum(100, NumLiteral(1)))))
+        assert eval(planner.plan(e)) == eval(e) == (3 + 4950) * 4951
+        assert planner.forks == 2
+        planner.release()
+        # the run of pure items is forked, the Put between them is not
+        planner = Parallel(executor, min_cost=100)
+        e = LetMut(a, NumLiteral(0), Seq([pure_sum(100, NumLiteral(0)), pure_sum(100, NumLiteral(1)), Put(a, NumLiteral(1)),
+                                          pure_sum(100, Get(a)), pure_sum(100, NumLiteral(2))]))
+        assert eval(planner.plan(e)) == 4952 and planner.forks == 4
+        planner.release()
+    # forked after planning: the workers have the parts already
+    assert parallel_eval(e, min_cost=100) == 4952
+    assert not registry
+    assert evaluate_part((0, -1), None, {}) == (MISSING, None)
+    assert evaluate_part((0, -1), from_tree(BinOp("+", a, a)).dumps(), {"a": 2}) == (True, 4)
+    assert evaluate_part((0, -1), None, {"a": 3}) == (True, 6)
+    registry.clear()
+
+def test_parallel_errors():
+    import pytest
+    a = Variable("a")
+    # the first failing part in program order decides, as in eval
+    with ProcessPoolExecutor(2) as executor:
+        e = BinOp("+", BinOp("/", pure_sum(50, NumLiteral(1)), NumLiteral(0)), BinOp("+", pure_sum(50, NumLiteral(1)), a))
+        with pytest.raises(ZeroDivisionError):
+            parallel_eval(e, executor=executor, min_cost=50)
+        e = BinOp("+", BinOp("+", pure_sum(50, NumLiteral(1)), a), BinOp("/", pure_sum(50, NumLiteral(1)), NumLiteral(0)))
+        with pytest.raises(KeyError):
+            parallel_eval(e, executor=executor, min_cost=50)
+        e = BinOp("+", pure_sum(50, NumLiteral(1)), Two_Str_concatenation(pure_sum(50, NumLiteral(1)), StringLiteral("x")))
+        with pytest.raises(TypeError):
+            parallel_eval(e, executor=executor, min_cost=50)
+    # eval runs a Fork because Fork is registered, not because it has an evaluate method
+    class LookAlike:
+        def evaluate(self, environment, tail=False):
+            return 1
+    with pytest.raises(InvalidProgram):
+        eval(LookAlike())
+
+
+# print(bench_parallel()) # Uncomment to compare eval and parallel_eval on shared sums.
+print("test_analyse(): ", test_analyse())
@@ -0,0 +1,94 @@
+# Static scope resolution for the language in code1.py.
+#
+# A Scope is the compile-time picture of one run-time frame: the names bound
+# in it, in slot order. A backend resolves every variable to a (hops, index)
+# pair while it compiles, where hops is how many frames up the binding lives
+# and index is its slot in that frame. At run time a variable access is then
+# a couple of list indexings instead of a search through a chain of dicts.
+#
+# A frame is a plain list:  [parent frame, names, slot, slot, ...]
+# The names are only needed for the run-time lookups described below and for
+# debugging.
+
+from typing import List, Optional
+
+
+FRAME_HEADER = 2    # slots start after the parent link and the names
+
+
+class Unbound:
+    # marks a slot whose Assign/for_loop has not run yet
+    def __repr__(self):
+        return "<unbound>"
+
+unbound = Unbound()
+
+
+class Scope:
+    names: List[str]
+
+    def __init__(self, parent: Optional['Scope'] = None):
+        self.names = []
+        self.parent = parent
+        # names bound by Assign may be read before the Assign has run
+        self.maybe_unbound = set()
+
+    def declare(self, name, maybe_unbound=False) -> int:
+        if name not in self.names:
+            self.names.append(name)
+            if maybe_unbound:
+                self.maybe_unbound.add(name)
+        return FRAME_HEADER + self.names.index(name)
+
+    def resolve(self, name):
+        # (hops, index, needs_check), or None when the name is only known at run time
+        scope, hops = self, 0
+        while scope is not None:
+            if name in scope.names:
+                return hops, FRAME_HEADER + scope.names.index(name), name in scope.maybe_unbound
+            scope, hops = scope.parent, hops + 1
+        return None
+
+    def template(self) -> list:
+        # copied (and its parent link filled in) every time the frame is entered
+        return [None, self.names] + [unbound] * len(self.names)
+
+
+def lookup_name(frame, name):
+    # run-time lookup for the names the resolver had to leave open
+    while frame is not None:
+        names = frame[1]
+        if name in names:
+            value = frame[FRAME_HEADER + names.index(name)]
+            if value is not unbound:
+                return frame, FRAME_HEADER + names.index(name)
+        frame = frame[0]
+    return None
+
+
+def test_resolve():
+    outer = Scope()
+    outer.declare("a")
+    outer.declare("b")
+    inner = Scope(outer)
+    inner.declare("a")
+    assert inner.resolve("a") == (0, FRAME_HEADER, False)
+    assert inner.resolve("b") == (1, FRAME_HEADER + 1, False)
+    assert inner.resolve("c") is None
+
+def test_lookup_name():
+    outer = Scope()
+    outer.declare("a")
+    inner = Scope(outer)
+    inner.declare("b", maybe_unbound=True)
+    f1 = outer.template()
+    f1[FRAME_HEADER] = 5
+    f2 = inner.template()
+    f2[0] = f1
+    assert lookup_name(f2, "a") == (f1, FRAME_HEADER)
+    assert lookup_name(f2, "b") is None    # declared but not assigned yet
+    assert inner.resolve("b") == (0, FRAME_HEADER, True)
+
+
+print("test_resolve(): ", test_resolve())
+print("test_lookup_name(): ", test_lookup_name())
@@ -0,0 +1,177 @@
+# Runs many independent programs on all cores.
+#
+# run_programs(programs) evaluates every program with eval in a pool of
+# worker processes and returns one Outcome per program, in the order the
+# programs were given, whichever worker ran them and whenever it finished.
+# A program that fails gets its exception back instead of a value; it does
+# not stop the others.
+#
+# The programs travel to the workers encoded by serialize.Codec, a couple of
+# bytes per node instead of a pickle of the dataclass tree, and in chunks, so
+# one round trip to a worker carries many programs. A program can also be
+# given as the path of a file holding such an encoding (see write_program);
+# the file is read and handed on as it is, without being decoded here.
+#
+#   python runner.py [--workers N] [--chunksize N] [--stats] FILE...
+#
+# prints the value of each program, one per line, in order.
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import code1
+from code1 import (NumLiteral, StringLiteral, BinOp, Variable, Let, Break, Two_Str_concatenation,
+                   Seq, Assign, InvalidProgram, eval, example_programs)
+from serialize import Codec, ast_classes
+
+
+codec = Codec(ast_classes(code1))
+
+@dataclass
+class Outcome:
+    value: object = None
+    error: Optional[Exception] = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+@dataclass
+class WorkerStats:
+    pid: int
+    programs: int = 0
+    failures: int = 0
+    seconds: float = 0.0    # time spent decoding and evaluating
+
+    @property
+    def throughput(self):
+        # programs per second
+        return self.programs / self.seconds if self.seconds else 0.0
+
+
+@dataclass
+class BatchResult:
+    outcomes: List[Outcome]
+    workers: Dict[int, WorkerStats] = field(default_factory=dict)
+    seconds: float = 0.0    # wall time of the whole batch
+
+    @property
+    def values(self):
+        return [outcome.value for outcome in self.outcomes]
+
+
+def write_program(path, program):
+    with open(path, "wb") as f:
+        f.write(codec.dumps(program))
+
+
+def encode(program) -> bytes:
+    if isinstance(program, (str, os.PathLike)):
+        with open(program, "rb") as f:
+            return f.read()
+    return codec.dumps(program)
+
+
+def run_chunk(start, blobs):
+    # in a worker: (start, outcomes, pid, seconds) for the programs from start on
+    began = time.perf_counter()
+    outcomes = []
+    for blob in blobs:
+        try:
+            program = codec.loads(blob)
+        except Exception as e:      # not a tree the codec wrote
+            outcomes.append(Outcome(error=InvalidProgram(str(e))))
+            continue
+        try:
+            outcomes.append(Outcome(eval(program)))
+        except Exception as e:      # the program's own failure, not the batch's
+            outcomes.append(Outcome(error=e))
+    return start, outcomes, os.getpid(), time.perf_counter() - began
+
+
+def run_programs(programs, max_workers=None, chunksize=None) -> BatchResult:
+    began = time.perf_counter()
+    blobs = [encode(program) for program in programs]
+    workers = max_workers or os.cpu_count() or 1
+    if chunksize is None:
+        # a few chunks per worker, so one slow chunk does not hold up the end
+        chunksize = max(1, -(-len(blobs) // (4 * workers)))
+    outcomes = [None] * len(blobs)
+    stats = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_chunk, start, blobs[start:start + chunksize])
+                   for start in range(0, len(blobs), chunksize)]
+        for future in as_completed(futures):
+            start, chunk, pid, seconds = future.result()
+            outcomes[start:start + len(chunk)] = chunk
+            worker = stats.setdefault(pid, WorkerStats(pid))
+            worker.programs += len(chunk)
+            worker.failures += sum(1 for outcome in chunk if not outcome.ok)
+            worker.seconds += seconds
+    return BatchResult(outcomes, stats, time.perf_counter() - began)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate encoded code1.py programs in parallel.")
+    parser.add_argument("files", nargs="+", help="files written by write_program")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument("--chunksize", type=int, default=None, help="programs sent to a worker at a time")
+    parser.add_argument("--stats", action="store_true", help="print each worker's throughput afterwards")
+    args = parser.parse_args(argv)
+    result = run_programs(args.files, args.workers, args.chunksize)
+    for path, outcome in zip(args.files, result.outcomes):
+        if outcome.ok:
+            print(f"{path}: {outcome.value!r}")
+        else:
+            print(f"{path}: error: {type(outcome.error).__name__}: {outcome.error}")
+    if args.stats:
+        for worker in sorted(result.workers.values(), key=lambda worker: worker.pid):
+            print(f"worker {worker.pid}: {worker.programs} programs, {worker.failures} failed, "
+                  f"{worker.throughput:.1f} programs/s", file=sys.stderr)
+        print(f"{len(result.outcomes)} programs in {result.seconds:.3f}s", file=sys.stderr)
+    return 0 if all(outcome.ok for outcome in result.outcomes) else 1
+
+
+def test_run_programs():
+    a = Variable("a")
+    programs = [program for program, expected in example_programs()]
+    # a duplicate Assign fails an assert in Environment.add
+    bad = [Break(), Two_Str_concatenation(NumLiteral(1), StringLiteral("x")), a,
+           BinOp("/", NumLiteral(1), NumLiteral(0)), Seq([Assign(a, NumLiteral(1)), Assign(a, NumLiteral(2))])]
+    result = run_programs(bad[:2] + programs + bad[2:], max_workers=2, chunksize=3)
+    assert result.values[2:-3] == [expected for program, expected in example_programs()]
+    errors = [outcome.error for outcome in result.outcomes if not outcome.ok]
+    assert all(map(isinstance, errors, [InvalidProgram, TypeError, KeyError, ZeroDivisionError, AssertionError]))
+    assert sum(worker.programs for worker in result.workers.values()) == len(programs) + 5
+    assert sum(worker.failures for worker in result.workers.values()) == 5
+
+def test_run_files():
+    import contextlib
+    import io
+    a = Variable("a")
+    with tempfile.TemporaryDirectory() as directory:
+        paths = [os.path.join(directory, name) for name in ("ok.ast", "bad.ast", "junk.ast")]
+        write_program(paths[0], Let(a, NumLiteral(5), BinOp("+", a, a)))
+        write_program(paths[1], Let(a, NumLiteral(5), BinOp("+", a, StringLiteral("x"))))
+        with open(paths[2], "wb") as f:
+            f.write(b"not a tree")
+        assert run_programs(paths[:1], max_workers=1).values == [10]
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            status = main(["--workers", "2", *paths])
+    assert status == 1
+    lines = out.getvalue().splitlines()
+    assert lines[0].endswith("ok.ast: 10")
+    assert lines[1].endswith("bad.ast: error: TypeError: unsupported operand type(s) for +: 'int' and 'str'")
+    assert "junk.ast: error: InvalidProgram" in lines[2]
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,200 @@
+# Compact binary form for dataclass ASTs (code1.py and code2.py trees alike).
+#
+# A tree is written in postorder as two flat streams: a "shape" stream of
+# bytes that says how to rebuild the nodes, and a "values" stream with the
+# strings and numbers found in them. Both are packed with marshal, so encoding
+# and decoding never recurse and arbitrarily deep trees (a long left-leaning
+# a + a + ... chain, say) are fine.
+#
+# shape codes:
+#   k < LIST       build an instance of classes[k]; the next byte is a mask with
+#                  one bit per field, set when the field is a plain value taken
+#                  from the values stream, clear when it was built before and
+#                  is on the stack
+#   LIST           build a list from the top n stack items, n from the values
+#   FRACTION       make a Fraction from the next two values
+
+from dataclasses import fields, is_dataclass
+from fractions import Fraction
+import hashlib
+import marshal
+import sys
+
+
+LIST = 250
+FRACTION = 251
+MAGIC = b"AST2"
+plain = (str, int, bool, float, type(None))
+new = object.__new__
+
+
+class Codec:
+    def __init__(self, classes):
+        self.classes = list(classes)
+        assert len(self.classes) < LIST and all(len(fields(cls)) <= 8 for cls in self.classes)
+        self.index = {cls: k for k, cls in enumerate(self.classes)}
+        self.field_names = [tuple(f.name for f in fields(cls)) for cls in self.classes]
+        # changes whenever a class or one of its fields is added, removed or
+        # renamed, so data written for another set of classes is refused
+        layout = repr([(cls.__name__, names) for cls, names in zip(self.classes, self.field_names)])
+        self.fingerprint = hashlib.blake2b(layout.encode(), digest_size=8).digest()
+        self.builders = {}
+
+    def dumps(self, tree) -> bytes:
+        shape = bytearray()
+        values = []
+        intern = sys.intern     # repeated names and operators are then written once
+        # (value, expanded): a node or list is visited twice, first to
+        # schedule its children and then, once they are written, itself
+        todo = [(tree, False)]
+        while todo:
+            value, expanded = todo.pop()
+            if isinstance(value, list):
+                if expanded:
+                    shape.append(LIST)
+                    values.append(len(value))
+                else:
+                    todo.append((value, True))
+                    todo.extend((item, False) for item in reversed(value))
+            elif isinstance(value, Fraction):
+                shape.append(FRACTION)
+                values.append(value.numerator)
+                values.append(value.denominator)
+            else:
+                k = self.index[type(value)]
+                names = self.field_names[k]
+                if expanded:
+                    mask = 0
+                    for bit, name in enumerate(names):
+                        field = getattr(value, name)
+                        if type(field) in plain:
+                            mask |= 1 << bit
+                            values.append(intern(field) if type(field) is str else field)
+                    shape.append(k)
+                    shape.append(mask)
+                else:
+                    todo.append((value, True))
+                    for name in reversed(names):
+                        field = getattr(value, name)
+                        if type(field) not in plain:
+                            todo.append((field, False))
+        return MAGIC + self.fingerprint + marshal.dumps((bytes(shape), values))
+
+    def builder(self, code, mask):
+        # A function that builds one classes[code] node with the given mask
+        # and returns the new position in the values stream. Generating it
+        # once per (class, mask) keeps the decoding loop down to a call per
+        # node. Fields are set on a bare instance, without calling __init__:
+        # NumLiteral's __init__, for one, does not take its fields as
+        # arguments. Classes that intern their instances (code1.py's Variable,
+        # say) are built through the constructor instead, so a decoded tree
+        # shares its nodes like one built by hand.
+        names = self.field_names[code]
+        cls = self.classes[code]
+        frozen = cls.__dataclass_params__.frozen
+        if not names and frozen:
+            # field-less frozen nodes (the types) can all share one instance
+            shared = new(cls)
+            def build(values, v, stack):
+                stack.append(shared)
+                return v
+            return build
+        if "__new__" in vars(cls) and mask == (1 << len(names)) - 1:
+            args = ", ".join(f"values[v + {k}]" for k in range(len(names)))
+            lines = ["def build(values, v, stack):",
+                     f"    stack.append(cls({args}))",
+                     f"    return v + {len(names)}"]
+            namespace = {"cls": cls}
+            exec("\n".join(lines), namespace)
+            return namespace["build"]
+        lines = ["def build(values, v, stack):",
+                 "    node = new(cls)"]
+        # a frozen class refuses plain assignment
+        store = "    setattr_(node, {name!r}, {value})" if frozen else "    node.{name} = {value}"
+        from_values = 0
+        from_stack = []
+        for bit, name in enumerate(names):
+            if mask >> bit & 1:
+                lines.append(store.format(name=name, value=f"values[v + {from_values}]"))
+                from_values += 1
+            else:
+                from_stack.append(name)
+        for name in reversed(from_stack):
+            lines.append(store.format(name=name, value="stack.pop()"))
+        lines.append("    stack.append(node)")
+        lines.append(f"    return v + {from_values}")
+        namespace = {"new": new, "cls": cls, "setattr_": object.__setattr__}
+        exec("\n".join(lines), namespace)
+        return namespace["build"]
+
+    def loads(self, data: bytes):
+        if data[:4] != MAGIC or data[4:12] != self.fingerprint:
+            raise ValueError("not a tree written by this codec")
+        shape, values = marshal.loads(data[12:])
+        builders = self.builders
+        stack = []
+        v = 0
+        i = 0
+        n = len(shape)
+        while i < n:
+            code = shape[i]
+            if code < LIST:
+                key = code << 8 | shape[i + 1]
+                build = builders.get(key)
+                if build is None:
+                    build = builders[key] = self.builder(code, shape[i + 1])
+                v = build(values, v, stack)
+                i += 2
+            elif code == LIST:
+                count = values[v]
+                v += 1
+                i += 1
+                items = stack[len(stack) - count:]
+                del stack[len(stack) - count:]
+                stack.append(items)
+            else:
+                stack.append(Fraction(values[v], values[v + 1]))
+                v += 2
+                i += 1
+        assert len(stack) == 1
+        return stack[0]
+
+
+def ast_classes(module):
+    # every dataclass defined in module, in definition order
+    return [value for value in vars(module).values()
+            if isinstance(value, type) and is_dataclass(value) and value.__module__ == module.__name__]
+
+
+def test_round_trip():
+    import code1
+    from code1 import example_programs, eval
+    codec = Codec(ast_classes(code1))
+    for program, expected in example_programs():
+        copy = codec.loads(codec.dumps(program))
+        assert copy == program
+        assert eval(copy) == expected
+
+def test_deep_tree():
+    import code1
+    codec = Codec(ast_classes(code1))
+    tree = code1.NumLiteral(1, 3)
+    for k in range(20000):
+        tree = code1.BinOp("+", tree, code1.Variable("a"))
+    copy = codec.loads(codec.dumps(tree))
+    depth = 0
+    while isinstance(copy, code1.BinOp):
+        copy = copy.left
+        depth += 1
+    assert depth == 20000 and copy.value == Fraction(1, 3)
+
+def test_other_classes_refused():
+    import pytest
+    import code1
+    codec = Codec(ast_classes(code1))
+    other = Codec(ast_classes(code1)[1:])
+    with pytest.raises(ValueError):
+        other.loads(codec.dumps(code1.Variable("a")))
+
+
+print("test_round_trip(): ", test_round_trip())
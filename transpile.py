@@ -0,0 +1,693 @@
+# Python source backend for the language in code1.py.
+#
+# transpile(program) turns a program into the source of one Python function,
+# `program(env)`. Every Let/LetMut binding becomes a local variable with a name
+# of its own, so shadowing costs nothing at run time; loops become `while`
+# loops, Break and Continue become `break` and `continue`, and a LetFun becomes
+# a nested def. Expressions that need statements (a loop or a Seq inside a
+# BinOp, say) are computed into temporaries first, in eval's order.
+#
+# compile_to_python compiles that source with the built-in compile() and keeps
+# the code object, keyed by a hash of the program's serialize.py encoding and
+# by the program object itself, so a program that is run again is neither
+# transpiled nor compiled again. (Nothing changes a tree in place once it is
+# built, so a program object is the same program every time it comes back.)
+#
+# Functions in code1.py are lexically scoped, like a def. A function that calls
+# itself in tail position gets its body wrapped in a `while True:` loop and the
+# call becomes an assignment to the parameters and a `continue`, so it runs in
+# constant Python stack. A program that calls something the transpiler cannot
+# see is a function (or that Python cannot compile, such as loops nested more
+# than 20 deep) is run with closures.py instead.
+
+from collections import OrderedDict
+from dataclasses import dataclass, field, fields
+from fractions import Fraction
+from types import CodeType
+from typing import Callable, List, Optional
+import hashlib
+import re
+
+import code1
+from code1 import (NumLiteral, BoolLiteral, StringLiteral, BinOp, Variable, Let, LetMut,
+                   if_else, while_loop, for_loop, Break, Continue, Two_Str_concatenation, Str_slicing,
+                   Seq, Put, Get, Assign, Print, LetFun, FunCall, LetAnd, UBoolOp,
+                   Environment, InvalidProgram, BreakLoop, ContinueLoop, eval, example_programs,
+                   as_number, divide, as_str, is_string, concat, slice_string, concatenation_operands)
+from closures import closure_eval
+from serialize import Codec, ast_classes
+from vm import counting_loop, timeit_
+
+
+python_operators = {"+": "+", "-": "-", "*": "*", ">": ">", "<": "<", "==": "=="}
+comparisons = (">", "<", "==")
+
+
+class NotTranspilable(Exception):
+    # the program calls a value that is not known to be a function
+    pass
+
+
+# the value of a variable of env that was not bound when the program started;
+# reading it raises KeyError where eval would, and not before
+unbound = object()
+
+
+def unbound_name(name):
+    raise KeyError(name)
+
+
+def truth(value):
+    # UBoolOp: strings are true when non-empty, numbers when non-zero
+    if is_string(value):
+        return value != ""
+    return value != 0
+
+
+@dataclass(eq=False)
+class Binding:
+    name: str
+    pyname: str
+    context: 'Context'
+    params: Optional[int] = None    # for a LetFun: the number of parameters
+    # for a for_loop or LetAnd variable that env may have as well: env's
+    # Binding, which stands for the variable whenever env does have it
+    env: Optional['Binding'] = None
+
+
+class Context:
+    # one Python function being written
+    def __init__(self, parent=None, function=None):
+        self.parent = parent
+        self.function = function    # the LetFun Binding, None for the program
+        self.params = []            # the Python names of the function's parameters
+        self.tail_calls = False     # whether it calls itself in tail position
+        self.lines = []             # (indentation, text)
+        self.depth = 1
+        self.loops = 0              # loops open at this point of the function
+        self.nonlocals = set()
+
+
+class Transpiler:
+    def __init__(self):
+        self.scopes = [{}]      # innermost last; scopes[0] has the env variables
+        self.context = Context()
+        self.counter = 0
+        self.constants = {}     # name -> value, for the Fractions in the program
+        self.env_names = {}     # name -> Binding, read from env on entry
+        self.env_written = set()
+        self.temporaries = set()    # Python names assigned once and never changed
+
+    def fresh(self, name="t"):
+        self.counter += 1
+        name = re.sub(r"\W", "_", name)
+        return f"{name}_{self.counter}"
+
+    def temporary(self, name="t"):
+        # a fresh name for a value of the compiler's own, not a variable of the program
+        t = self.fresh(name)
+        self.temporaries.add(t)
+        return t
+
+    def emit(self, text):
+        self.context.lines.append((self.context.depth, text))
+
+    def mark(self):
+        return len(self.context.lines)
+
+    # names
+
+    def lookup(self, name, scopes):
+        for scope in reversed(scopes):
+            if name in scope:
+                return scope[name]
+        return None
+
+    def resolve(self, name) -> Binding:
+        binding = self.lookup(name, self.scopes)
+        if binding is None:
+            binding = Binding(name, self.fresh(name), self.root_context())
+            self.env_names[name] = self.scopes[0][name] = binding
+        return binding
+
+    def read(self, binding: Binding) -> str:
+        if binding.env is not None:
+            env = binding.env.pyname
+            return f"({env} if {env} is not unbound else {binding.pyname})"
+        if self.env_names.get(binding.name) is binding:
+            return f"({binding.pyname} if {binding.pyname} is not unbound else unbound_name({binding.name!r}))"
+        return binding.pyname
+
+    def root_context(self):
+        context = self.context
+        while context.parent is not None:
+            context = context.parent
+        return context
+
+    def declare(self, name, **kwargs) -> Binding:
+        binding = Binding(name, self.fresh(name), self.context, **kwargs)
+        self.scopes[-1][name] = binding
+        return binding
+
+    def assign(self, binding: Binding, value: str, bind=False):
+        # bind: like eval's for_loop and LetAnd, bind the variable if env does not have it
+        if value == binding.pyname or binding.env is not None and value == self.read(binding):
+            return      # a Put as a for_loop update has stored it already
+        if binding.env is not None:
+            self.emit(f"if {binding.env.pyname} is not unbound:")
+            self.context.depth += 1
+            self.assign(binding.env, value, bind=True)
+            self.context.depth -= 1
+            self.emit("else:")
+            self.context.depth += 1
+            self.assign(Binding(binding.name, binding.pyname, binding.context), value)
+            self.context.depth -= 1
+            return
+        if binding.context is not self.context:
+            self.context.nonlocals.add(binding.pyname)
+        if self.env_names.get(binding.name) is binding:
+            if not bind:
+                # a Put to a variable env does not have fails, as in eval
+                self.emit(f"if {binding.pyname} is unbound: unbound_name({binding.name!r})")
+            self.env_written.add(binding.name)
+        self.emit(f"{binding.pyname} = {value}")
+
+    def bind(self, name, value: str) -> Binding:
+        # eval's for_loop and LetAnd: update the variable if it is visible,
+        # in env too, and bind it in the innermost scope otherwise
+        binding = self.lookup(name, self.scopes)
+        if binding is None or self.env_names.get(name) is binding:
+            binding = self.resolve(name)
+            if len(self.scopes) > 1:
+                # which of the two it is depends on env, so it is decided at run time
+                binding = self.declare(name, env=binding)
+        self.assign(binding, value, bind=True)
+        return binding
+
+    # expressions
+
+    def temp(self, value: str) -> str:
+        t = self.temporary()
+        self.emit(f"{t} = {value}")
+        return t
+
+    def stable(self, value: str) -> bool:
+        # cannot be changed by statements emitted later
+        return (value in ("None", "True", "False") or value in self.temporaries
+                or re.fullmatch(r"-?\d+|'.*'|\".*\"", value) is not None)
+
+    def operands(self, nodes) -> List[str]:
+        # the values of nodes, in order; a value that statements emitted for a
+        # later node could change is copied into a temporary first
+        values = []
+        for node in nodes:
+            value = self.expr(node)
+            values.append((value, self.mark()))
+        end = self.mark()
+        for k in reversed(range(len(values) - 1)):
+            value, at = values[k]
+            if at < end and not self.stable(value):
+                t = self.temporary()
+                self.context.lines.insert(at, (self.context.depth, f"{t} = {value}"))
+                values[k] = (t, at)
+        return [value for value, _ in values]
+
+    def small(self, value: str) -> str:
+        # keeps expressions shallow enough for the Python parser
+        if value.count("(") > 40:
+            return self.temp(value)
+        return value
+
+    def capture(self, node, tail=False):
+        # (lines, value) of node, without emitting them
+        saved = self.context.lines, self.context.depth
+        self.context.lines, self.context.depth = [], 0
+        try:
+            value = self.expr(node, tail)
+            return self.context.lines, value
+        finally:
+            self.context.lines, self.context.depth = saved
+
+    def splice(self, lines):
+        for depth, text in lines:
+            self.context.lines.append((self.context.depth + depth, text))
+
+    def block(self, node):
+        # emit node, for its effect only, as an indented block
+        self.context.depth += 1
+        start = self.mark()
+        self.statement(node)
+        if self.mark() == start:
+            self.emit("pass")
+        self.context.depth -= 1
+
+    def statement(self, node):
+        # node for its effect only
+        value = self.expr(node)
+        if not self.stable(value) and not re.fullmatch(r"\w+", value):
+            self.emit(value)    # it may still fail, as it would in eval
+
+    def condition(self, node) -> str:
+        value = self.expr(node)
+        if isinstance(node, BinOp) and node.operator in comparisons:
+            return value
+        return f"{value} == True"
+
+    def expr(self, program, tail=False) -> str:
+        # tail: program is in tail position in the function being written
+        return self.small(self.expr_(program, tail))
+
+    def expr_(self, program, tail) -> str:
+        match program:
+            case NumLiteral(value):
+                value = as_number(value)
+                if isinstance(value, Fraction):
+                    name = self.temporary("c")
+                    self.constants[name] = value
+                    return name
+                return repr(value)
+
+            case BoolLiteral(value) | StringLiteral(value):
+                return repr(value)
+
+            case Variable(name) | Get(Variable(name)):
+                return self.read(self.resolve(name))
+
+            case Put(Variable(name), e1):
+                value = self.expr(e1)
+                binding = self.resolve(name)
+                self.assign(binding, value)
+                if binding.env is not None:
+                    return self.read(binding)
+                return binding.pyname
+
+            case Assign(Variable(name), e1):
+                value = self.expr(e1)
+                self.assign(self.declare(name), value)
+                return repr(name)
+
+            case Let(Variable(name), e1, e2) | LetMut(Variable(name), e1, e2):
+                value = self.expr(e1)
+                self.scopes.append({})
+                self.assign(self.declare(name), value)
+                result = self.expr(e2, tail)
+                self.scopes.pop()
+                return result
+
+            case LetAnd(Variable(name1), expr1, Variable(name2), expr2, expr3):
+                # both values are taken before either variable changes
+                v1, v2 = [value if self.stable(value) else self.temp(value)
+                          for value in self.operands([expr1, expr2])]
+                self.scopes.append({})
+                for name, value in ((name1, v1), (name2, v2)):
+                    self.bind(name, value)
+                result = self.expr(expr3, tail)
+                self.scopes.pop()
+                return result
+
+            case BinOp(op, left, right):
+                if op not in python_operators and op != "/":
+                    raise InvalidProgram()
+                left, right = self.operands([left, right])
+                if op == "/":
+                    return f"divide({left}, {right})"
+                return f"({left} {python_operators[op]} {right})"
+
+            case Two_Str_concatenation():
+                # a chain of them is written link by link, left to right
+                operands = concatenation_operands(program)
+                value = self.expr(operands[0])
+                for operand in operands[1:]:
+                    at = self.mark()
+                    right = self.expr(operand)
+                    if self.mark() > at and not self.stable(value):
+                        # as in operands(): read value before the statements for the right one run
+                        t = self.temporary()
+                        self.context.lines.insert(at, (self.context.depth, f"{t} = {value}"))
+                        value = t
+                    value = self.small(f"concat({value}, {right})")
+                return value
+
+            case Str_slicing(str1, start, end):
+                str1, start, end = self.operands([str1, start, end])
+                return f"slice_string({str1}, {start}, {end})"
+
+            case if_else(expr, et, ef):
+                test = self.condition(expr)
+                et_lines, et_value = self.capture(et, tail)
+                ef_lines, ef_value = self.capture(ef, tail)
+                if not et_lines and not ef_lines:
+                    return f"({et_value} if {test} else {ef_value})"
+                t = self.temporary()
+                self.emit(f"if {test}:")
+                self.context.depth += 1
+                self.splice(et_lines)
+                self.emit(f"{t} = {et_value}")
+                self.context.depth -= 1
+                self.emit("else:")
+                self.context.depth += 1
+                self.splice(ef_lines)
+                self.emit(f"{t} = {ef_value}")
+                self.context.depth -= 1
+                return t
+
+            case while_loop(condition, body):
+                test_lines, test = self.capture_condition(condition)
+                if test_lines:
+                    self.emit("while True:")
+                    self.context.depth += 1
+                    self.splice(test_lines)
+                    self.emit(f"if not ({test}):")
+                    self.emit("    break")
+                    self.context.depth -= 1
+                else:
+                    self.emit(f"while {test}:")
+                self.loop_body(body)
+                return "None"
+
+            case for_loop(Variable(name), e1, condition, updt, body):
+                binding = self.bind(name, self.expr(e1))
+                # the update runs at the top of every iteration but the first,
+                # so that `continue` does not skip it
+                started = self.fresh("started")
+                self.emit(f"{started} = False")
+                self.emit("while True:")
+                self.context.depth += 1
+                self.emit(f"if {started}:")
+                self.context.depth += 1
+                self.assign(binding, self.expr(updt))
+                self.context.depth -= 1
+                self.emit(f"{started} = True")
+                test = self.condition(condition)
+                self.emit(f"if not ({test}):")
+                self.emit("    break")
+                self.context.depth -= 1
+                self.loop_body(body)
+                return "None"
+
+            case Break():
+                self.emit("break" if self.context.loops else "raise BreakLoop()")
+                return "None"
+
+            case Continue():
+                self.emit("continue" if self.context.loops else "raise ContinueLoop()")
+                return "None"
+
+            case Seq(body):
+                if not body:
+                    return "None"
+                for item in body[:-1]:
+                    self.statement(item)
+                return self.expr(body[-1], tail)
+
+            case Print(e1):
+                value = self.expr(e1)
+                if not self.stable(value):
+                    value = self.temp(value)
+                self.emit(f"print({value})")
+                return value
+
+            case LetFun(Variable(name), params, body, expr):
+                self.scopes.append({})
+                fn = self.declare(name, params=len(params))
+                outer = self.context
+                self.context = Context(outer, fn)
+                self.scopes.append({})
+                pynames = self.context.params = [self.declare(p.name).pyname for p in params]
+                result = self.expr(body, True)
+                self.emit(f"return {result}")
+                self.scopes.pop()
+                inner, self.context = self.context, outer
+                self.emit(f"def {fn.pyname}({', '.join(pynames)}):")
+                if inner.nonlocals:
+                    self.emit(f"    nonlocal {', '.join(sorted(inner.nonlocals))}")
+                if inner.tail_calls:
+                    self.emit("    while True:")
+                    self.splice([(depth + 1, text) for depth, text in inner.lines])
+                else:
+                    self.splice(inner.lines)
+                result = self.expr(expr, tail)
+                self.scopes.pop()
+                return result
+
+            case FunCall(Variable(name), args):
+                fn = self.resolve(name)
+                if fn.params is None or fn.params != len(args):
+                    raise NotTranspilable()
+                values = self.operands(args)
+                if tail and fn is self.context.function:
+                    # back to the top of the body with the new arguments
+                    if values:
+                        self.emit(f"{', '.join(self.context.params)} = {', '.join(values)}")
+                    self.emit("continue")
+                    self.context.tail_calls = True
+                    return "None"
+                return self.temp(f"{fn.pyname}({', '.join(values)})")
+
+            case UBoolOp(Variable(name), expr):
+                self.statement(expr)
+                return f"truth({self.read(self.resolve(name))})"
+
+        raise InvalidProgram()
+
+    def capture_condition(self, node):
+        saved = self.context.lines, self.context.depth
+        self.context.lines, self.context.depth = [], 0
+        try:
+            test = self.condition(node)
+            return self.context.lines, test
+        finally:
+            self.context.lines, self.context.depth = saved
+
+    def loop_body(self, body):
+        # A Break in a function called from the body leaves this loop, as
+        # in eval, by raising BreakLoop.
+        self.context.loops += 1
+        if any(isinstance(node, FunCall) for node in walk(body)):
+            self.context.depth += 1
+            self.emit("try:")
+            self.block(body)
+            self.emit("except BreakLoop:")
+            self.emit("    break")
+            self.emit("except ContinueLoop:")
+            self.emit("    continue")
+            self.context.depth -= 1
+        else:
+            self.block(body)
+        self.context.loops -= 1
+
+    def program(self, program) -> str:
+        result = self.expr(program)
+        body = self.context.lines
+        self.context.lines = []
+        self.context.depth = 1
+        for name, binding in self.env_names.items():
+            self.emit(f"{binding.pyname} = env.get({name!r}) if env.check({name!r}) else unbound")
+        if self.env_written:
+            self.emit("try:")
+            self.context.depth += 1
+        self.splice([(depth - 1, text) for depth, text in body])
+        self.emit(f"return {result}")
+        if self.env_written:
+            self.context.depth -= 1
+            self.emit("finally:")
+            for name in sorted(self.env_written):
+                pyname = self.env_names[name].pyname
+                self.emit(f"    if {pyname} is not unbound:")
+                self.emit(f"        if env.check({name!r}): env.update({name!r}, {pyname})")
+                self.emit(f"        else: env.add({name!r}, {pyname})")
+        return "\n".join(["def program(env):"] + ["    " * depth + text for depth, text in self.context.lines])
+
+
+def walk(program):
+    todo = [program]
+    while todo:
+        program = todo.pop()
+        yield program
+        for value in [getattr(program, f.name) for f in fields(program)]:
+            if isinstance(value, list):
+                todo.extend(item for item in value if hasattr(item, "__dataclass_fields__"))
+            elif hasattr(value, "__dataclass_fields__"):
+                todo.append(value)
+
+
+def transpile(program):
+    # (the source, the Fraction constants it refers to by name)
+    transpiler = Transpiler()
+    source = transpiler.program(program)
+    return source, transpiler.constants
+
+
+@dataclass
+class PythonProgram:
+    source: Optional[str]
+    code: Optional[CodeType] = field(repr=False)
+    run: Callable = field(repr=False)   # takes an Environment
+
+
+python_programs = OrderedDict()    # digest of the program's encoding -> PythonProgram
+programs_seen = OrderedDict()      # id(program) -> (program, PythonProgram), the same cache by identity
+cache_size = 256
+codec = Codec(ast_classes(code1))
+
+
+def compile_to_python(program) -> PythonProgram:
+    found = programs_seen.get(id(program))
+    if found is not None and found[0] is program:
+        programs_seen.move_to_end(id(program))
+        return found[1]
+    try:
+        # the codec walks the tree with a stack of its own, however deep it is
+        key = hashlib.blake2b(codec.dumps(program), digest_size=16).digest()
+    except KeyError:    # not a code1 tree
+        return PythonProgram(None, None, lambda env: closure_eval(program, env))
+    compiled = python_programs.get(key)
+    if compiled is not None:
+        python_programs.move_to_end(key)
+    else:
+        compiled = python_programs[key] = transpile_and_compile(program)
+        if len(python_programs) > cache_size:
+            python_programs.popitem(last=False)
+    programs_seen[id(program)] = (program, compiled)
+    if len(programs_seen) > cache_size:
+        programs_seen.popitem(last=False)
+    return compiled
+
+
+def transpile_and_compile(program) -> PythonProgram:
+    try:
+        source, constants = transpile(program)
+        code = compile(source, "<transpiled>", "exec")
+    except (NotTranspilable, SyntaxError, RecursionError, MemoryError):
+        return PythonProgram(None, None, lambda env: closure_eval(program, env))
+    namespace = {"divide": divide, "truth": truth, "concat": concat, "slice_string": slice_string,
+                 "unbound": unbound, "unbound_name": unbound_name, "BreakLoop": BreakLoop,
+                 "ContinueLoop": ContinueLoop, **constants}
+    exec(code, namespace)
+    return PythonProgram(source, code, namespace["program"])
+
+
+def python_eval(program, environment: Environment = None):
+    if environment is None:
+        environment = Environment()
+    return as_str(compile_to_python(program).run(environment))
+
+
+def bench_python(n=1000, repeat=5):
+    program = counting_loop(n)
+    compiled = compile_to_python(program)
+    t_eval = min(timeit_(lambda: eval(program)) for _ in range(repeat))
+    t_python = min(timeit_(lambda: compiled.run(Environment())) for _ in range(repeat))
+    return t_eval, t_python, t_eval / t_python
+
+
+def test_python_matches_eval():
+    for program, expected in example_programs():
+        compiled = compile_to_python(program)
+        assert compiled.source is not None
+        assert compiled.run(Environment()) == eval(program) == expected
+
+def test_python_functions():
+    a=Variable('a')
+    b=Variable('b')
+    n=Variable('n')
+    f=Variable('f')
+    e=LetFun(f,[a,b],BinOp("+",a,b),FunCall(f,[NumLiteral(15),NumLiteral(2)]))
+    assert "def f_" in compile_to_python(e).source
+    assert python_eval(e)==17
+    fact=if_else(BinOp("<",n,NumLiteral(1)),NumLiteral(1),BinOp("*",n,FunCall(f,[BinOp("-",n,NumLiteral(1))])))
+    e=LetFun(f,[n],fact,FunCall(f,[NumLiteral(20)]))
+    assert python_eval(e)==2432902008176640000
+    # the body uses the a around the LetFun, not the one of its caller
+    e=Let(a,NumLiteral(1),LetFun(f,[n],BinOp("+",n,a),Let(a,NumLiteral(5),FunCall(f,[NumLiteral(1)]))))
+    assert compile_to_python(e).source is not None
+    assert python_eval(e)==eval(e)==2
+    # a call in tail position becomes a loop
+    loop=if_else(BinOp("<",n,NumLiteral(1)),a,FunCall(f,[BinOp("-",n,NumLiteral(1)),BinOp("+",a,NumLiteral(2))]))
+    e=LetFun(f,[n,a],loop,FunCall(f,[NumLiteral(10000),NumLiteral(0)]))
+    assert "continue" in compile_to_python(e).source
+    assert python_eval(e)==eval(e)==20000
+    # a function passed around under another name is left to closures.py
+    g=Variable('g')
+    e=LetFun(f,[n],n,Let(g,f,FunCall(g,[NumLiteral(3)])))
+    assert compile_to_python(e).source is None
+    assert python_eval(e)==eval(e)==3
+
+def test_python_loops():
+    i=Variable('i')
+    a=Variable('a')
+    s=Variable('s')
+    # continue inside a Let, break from a nested if
+    body=Let(s,Get(i),if_else(BinOp("<",Get(i),NumLiteral(3)),Continue(),
+             Seq([Put(a,BinOp("+",Get(a),Get(s))),if_else(BinOp(">",Get(i),NumLiteral(7)),Break(),NumLiteral(0))])))
+    loop=for_loop(i,NumLiteral(0),BinOp("<",Get(i),NumLiteral(20)),Put(i,BinOp("+",Get(i),NumLiteral(1))),body)
+    e=LetMut(a,NumLiteral(0),Seq([loop,Get(a)]))
+    assert python_eval(e)==eval(e)==3+4+5+6+7+8
+    assert python_eval(counting_loop(100000))==9999900000
+
+def test_python_values():
+    a=Variable('a')
+    assert python_eval(BinOp("/",NumLiteral(1),NumLiteral(3)))==Fraction(1,3)
+    assert python_eval(Str_slicing(StringLiteral("abcdefg"),NumLiteral(0),NumLiteral(4)))=="abcd"
+    chain=StringLiteral("")
+    for k in range(5000):
+        chain=Two_Str_concatenation(chain,StringLiteral("ab"))
+    assert compile_to_python(chain).source is not None and python_eval(chain)=="ab"*5000
+    e=LetMut(a,StringLiteral("x"),Two_Str_concatenation(Two_Str_concatenation(Get(a),Seq([Put(a,StringLiteral("y")),Get(a)])),Get(a)))
+    assert python_eval(e)==eval(e)=="xyy"
+    # the Put inside the right operand runs after the left one was read
+    e=LetMut(a,NumLiteral(1),BinOp("+",Get(a),Seq([Put(a,NumLiteral(10)),Get(a)])))
+    assert python_eval(e)==eval(e)==11
+    # and so it is for variables whose names look like the transpiler's own
+    for name in ("t","c"):
+        v=Variable(name)
+        e=LetMut(v,NumLiteral(1),BinOp("+",Get(v),Seq([Put(v,NumLiteral(10)),Get(v)])))
+        assert python_eval(e)==eval(e)==11
+    c=Variable('c')
+    q=Variable('q')
+    e=LetMut(c,NumLiteral(0),BinOp("<",BinOp("*",Put(c,NumLiteral(-3)),LetMut(q,NumLiteral(5),Put(c,NumLiteral(1)))),NumLiteral(0)))
+    assert python_eval(e)==eval(e)==True
+    env=Environment()
+    env.add("a",10)
+    assert python_eval(Put(a,BinOp("+",a,NumLiteral(1))),env)==11
+    assert env.get("a")==11
+    # a variable env does not have is only missed where it is used
+    zz=Variable('zz')
+    assert python_eval(if_else(BoolLiteral(True),NumLiteral(1),zz))==eval(if_else(BoolLiteral(True),NumLiteral(1),zz))==1
+    assert python_eval(if_else(BoolLiteral(True),NumLiteral(1),Put(zz,NumLiteral(2))))==1
+    import pytest
+    for e in (zz,BinOp("+",NumLiteral(1),zz),Put(zz,NumLiteral(2)),Seq([zz,NumLiteral(1)])):
+        with pytest.raises(KeyError):
+            python_eval(e)
+    # a for_loop or LetAnd updates it in env if env has it, and binds it where eval would otherwise
+    loop=for_loop(zz,NumLiteral(0),BinOp("<",zz,NumLiteral(3)),Put(zz,BinOp("+",zz,NumLiteral(1))),NumLiteral(0))
+    q=Variable('q')
+    f=Variable('f')
+    for e in (loop,Seq([loop,zz]),Let(q,NumLiteral(1),Seq([loop,zz])),
+              LetAnd(zz,NumLiteral(5),q,NumLiteral(6),BinOp("+",zz,q)),
+              LetFun(f,[q],Seq([loop,BinOp("+",zz,q)]),FunCall(f,[NumLiteral(1)]))):
+        for bound in (False,True):
+            env1,env2=Environment(),Environment()
+            if bound:
+                env1.add("zz",100)
+                env2.add("zz",100)
+            assert compile_to_python(e).source is not None
+            assert python_eval(e,env1)==eval(e,env2)
+            assert env1.env==env2.env
+
+def test_python_cached():
+    program = counting_loop(10)
+    assert compile_to_python(program) is compile_to_python(counting_loop(10))
+    assert compile_to_python(program) is compile_to_python(program)
+    # the key is found without recursion, however deep the program
+    deep = NumLiteral(1)
+    for _ in range(20000):
+        deep = BinOp("+", deep, NumLiteral(1))
+    assert compile_to_python(deep) is compile_to_python(deep)
+
+
+# print(bench_python()) # Uncomment to compare eval and the generated Python on a loop.
+print("test_python_matches_eval(): ", test_python_matches_eval())
+print("test_python_functions(): ", test_python_functions())
+print("test_python_loops(): ", test_python_loops())
+print("test_python_values(): ", test_python_values())
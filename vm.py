@@ -0,0 +1,661 @@
+# Bytecode compiler and stack VM for the language in code1.py.
+#
+# compile_program walks the AST once and flattens it into a list of
+# (opcode, arg) pairs. run executes that list with an explicit value stack
+# and an explicit call stack, so a loop body costs a few list operations per
+# node instead of a trip through the whole `match` in eval.
+#
+# Variables are resolved while compiling (see resolver.py): every Let, LetAnd,
+# LetFun and function call gets a fixed-size frame, and a variable access is
+# an index into the current frame or one a known number of frames up.
+
+from dataclasses import dataclass, field
+from typing import List
+import operator
+import time
+
+from code1 import (NumLiteral, BoolLiteral, StringLiteral, BinOp, Variable, Let, LetMut,
+                   if_else, while_loop, for_loop, Break, Continue, Two_Str_concatenation, Str_slicing,
+                   Seq, Put, Get, Assign, Print, LetFun, FunCall, LetAnd, UBoolOp,
+                   Environment, InvalidProgram, eval, example_programs, as_number, divide,
+                   as_str, is_string, concat, slice_string, concatenation_operands)
+from resolver import Scope, FRAME_HEADER, unbound, lookup_name
+
+
+# Opcodes. The VM checks them in roughly this order, so the ones that show up
+# in loop bodies come first.
+LOAD_LOCAL = 0     # push slot arg of the current frame
+LOAD_OUTER = 1     # push slot arg of the parent frame
+CONST = 2          # push arg
+BINARY = 3         # pop two values, push arg(left, right)
+BINARY_CONST = 4   # arg is (fn, constant): replace the top with fn(top, constant)
+JUMP_IF_FALSE = 5  # pop a value, jump to arg unless it == True
+JUMP = 6           # jump to arg
+STORE_LOCAL = 7    # pop a value into slot arg of the current frame
+STORE_OUTER = 8    # pop a value into slot arg of the parent frame
+DUP = 9            # push the top of the stack again
+POP = 10           # drop the top of the stack
+LOAD_SLOT = 11     # arg is (hops, index, name): push a slot further up, or the variable further
+                   # out while the slot is not bound yet
+STORE_SLOT = 12    # arg is (hops, index, name): pop a value into a slot, the same way
+LOAD_NAME = 13     # push a variable the resolver could not place, looked up by name
+STORE_NAME = 14    # pop a value into such a variable
+DEFINE_LOCAL = 15  # like STORE_LOCAL, but the slot must not be bound yet
+ENTER = 16         # push a new frame, arg is its template
+EXIT = 17          # pop the current frame
+CONCAT = 18        # string concatenation
+SLICE = 19         # pop end, start and a string, push the slice
+PRINT = 20         # print the top of the stack, keep it
+CALL = 21          # call a function with arg arguments
+TAIL_CALL = 22     # CALL in tail position: the callee returns straight to our caller
+RETURN = 23        # return from a function
+CLOSURE = 24       # push a Closure of Function arg over the current frame
+UBOOL = 25         # replace the top of the stack by its truthiness
+SETUP_LOOP = 26    # remember the stack depth and frame for break/continue
+POP_BLOCK = 27     # forget them again when the loop is done
+BREAK = 28         # unwind to the loop's stack depth and frame and jump to arg
+CONTINUE = 29      # same as BREAK, the target is the next iteration
+HALT = 30          # stop and return the top of the stack
+BIND = 31          # arg is (index, name): pop a value into the variable if it is visible, the
+                   # environment's included, into slot index otherwise (None: add it to the environment)
+
+opnames = ("LOAD_LOCAL LOAD_OUTER CONST BINARY BINARY_CONST JUMP_IF_FALSE JUMP STORE_LOCAL "
+           "STORE_OUTER DUP POP LOAD_SLOT STORE_SLOT LOAD_NAME STORE_NAME DEFINE_LOCAL ENTER "
+           "EXIT CONCAT SLICE PRINT CALL TAIL_CALL RETURN CLOSURE UBOOL SETUP_LOOP POP_BLOCK BREAK CONTINUE "
+           "HALT BIND").split()
+
+binary_operators = {
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    "/": divide,
+    ">": operator.gt,
+    "<": operator.lt,
+    "==": operator.eq,
+}
+
+
+@dataclass
+class Code:
+    instrs: List[tuple] = field(default_factory=list)
+    name: str = "<program>"
+    # template of the frame the code runs in (the program's top-level frame)
+    template: list = field(default=None, repr=False)
+    # (break jumps, continue jumps) of the loops being compiled, innermost last
+    loops: List[tuple] = field(default_factory=list, repr=False)
+
+    def emit(self, op, arg=None):
+        self.instrs.append((op, arg))
+        return len(self.instrs) - 1
+
+    def patch(self, at, target):
+        # fill in the argument of an instruction emitted before it was known
+        self.instrs[at] = (self.instrs[at][0], target)
+
+    def here(self):
+        return len(self.instrs)
+
+    def dis(self):
+        # human readable listing, handy when debugging the compiler
+        lines = []
+        for pc, (op, arg) in enumerate(self.instrs):
+            if op == ENTER:
+                arg = arg[1]
+            elif op == CLOSURE:
+                arg = arg.name
+            lines.append(f"{pc:4} {opnames[op]:14} {'' if arg is None else arg}")
+        return "\n".join(lines)
+
+
+@dataclass
+class Function:
+    name: str
+    params: List[str]
+    code: Code
+
+
+@dataclass
+class Closure:
+    # a function together with the frame of its LetFun, the parent of the
+    # frames its calls run in
+    function: Function
+    frame: list = field(repr=False)
+
+
+def compile_program(program) -> Code:
+    code = Code()
+    scope = Scope()
+    compile_(program, code, scope)
+    code.emit(HALT)
+    code.template = scope.template()
+    return code
+
+
+def emit_load(name, code: Code, scope: Scope):
+    where = scope.resolve(name)
+    if where is None:
+        code.emit(LOAD_NAME, name)
+        return
+    hops, index, check = where
+    if check or hops > 1:
+        code.emit(LOAD_SLOT, (hops, index, name))
+    elif hops == 0:
+        code.emit(LOAD_LOCAL, index)
+    else:
+        code.emit(LOAD_OUTER, index)
+
+
+def emit_store(name, code: Code, scope: Scope):
+    where = scope.resolve(name)
+    if where is None:
+        code.emit(STORE_NAME, name)
+        return
+    hops, index, check = where
+    if check or hops > 1:
+        code.emit(STORE_SLOT, (hops, index, name))
+    elif hops == 0:
+        code.emit(STORE_LOCAL, index)
+    else:
+        code.emit(STORE_OUTER, index)
+
+
+def emit_set(name, code: Code, scope: Scope):
+    # eval's for_loop and LetAnd: update the variable if it is visible, the
+    # environment's included, and bind it in the current frame otherwise
+    where = scope.resolve(name)
+    if where is not None and not where[2]:
+        emit_store(name, code, scope)
+        return
+    # at the top level the current scope is the environment's last one
+    index = None if scope.parent is None else scope.declare(name, maybe_unbound=True)
+    code.emit(BIND, (index, name))
+
+
+def compile_scope(body, code: Code, scope: Scope, bind=()):
+    # Compile body in a new frame. The values for the names in `bind` are on
+    # the stack, the last name on top.
+    inner = Scope(scope)
+    enter = code.emit(ENTER)
+    for name in reversed(bind):
+        code.emit(STORE_LOCAL, inner.declare(name))
+    compile_(body, code, inner)
+    code.emit(EXIT)
+    # the frame size is only known once the whole body has been compiled
+    code.patch(enter, inner.template())
+
+
+def compile_(program, code: Code, scope: Scope):
+    # Every expression leaves exactly one value on the stack.
+    match program:
+        case NumLiteral(value):
+            code.emit(CONST, as_number(value))
+
+        case BoolLiteral(value):
+            code.emit(CONST, value)
+
+        case StringLiteral(word):
+            code.emit(CONST, word)
+
+        case Variable(name) | Get(Variable(name)):
+            emit_load(name, code, scope)
+
+        case Put(Variable(name), e1):
+            compile_(e1, code, scope)
+            code.emit(DUP)
+            emit_store(name, code, scope)
+
+        case Assign(Variable(name), e1):
+            compile_(e1, code, scope)
+            code.emit(DEFINE_LOCAL, scope.declare(name, maybe_unbound=True))
+            code.emit(CONST, name)
+
+        case Let(Variable(name), e1, e2) | LetMut(Variable(name), e1, e2):
+            compile_(e1, code, scope)
+            compile_scope(e2, code, scope, [name])
+
+        case LetAnd(Variable(name1), expr1, Variable(name2), expr2, expr3):
+            compile_(expr1, code, scope)
+            compile_(expr2, code, scope)
+            inner = Scope(scope)
+            enter = code.emit(ENTER)
+            emit_set(name2, code, inner)
+            emit_set(name1, code, inner)
+            compile_(expr3, code, inner)
+            code.emit(EXIT)
+            code.patch(enter, inner.template())
+
+        case BinOp(op, left, right):
+            if op not in binary_operators:
+                raise InvalidProgram()
+            compile_(left, code, scope)
+            if isinstance(right, NumLiteral):
+                # `a + 1`, `i < 10`, ...: no need to push the constant first
+                code.emit(BINARY_CONST, (binary_operators[op], as_number(right.value)))
+            else:
+                compile_(right, code, scope)
+                code.emit(BINARY, binary_operators[op])
+
+        case Two_Str_concatenation():
+            # a chain of them is compiled in one loop, left to right
+            operands = concatenation_operands(program)
+            compile_(operands[0], code, scope)
+            for operand in operands[1:]:
+                compile_(operand, code, scope)
+                code.emit(CONCAT)
+
+        case Str_slicing(str1, start, end):
+            compile_(str1, code, scope)
+            compile_(start, code, scope)
+            compile_(end, code, scope)
+            code.emit(SLICE)
+
+        case if_else(expr, et, ef):
+            compile_(expr, code, scope)
+            to_else = code.emit(JUMP_IF_FALSE)
+            compile_(et, code, scope)
+            to_end = code.emit(JUMP)
+            code.patch(to_else, code.here())
+            compile_(ef, code, scope)
+            code.patch(to_end, code.here())
+
+        case while_loop(condition, body):
+            code.emit(SETUP_LOOP)
+            top = code.here()
+            compile_(condition, code, scope)
+            to_end = code.emit(JUMP_IF_FALSE)
+            breaks, continues = compile_loop_body(body, code, scope)
+            code.emit(JUMP, top)
+            for at in continues:
+                code.patch(at, top)
+            for at in breaks + [to_end]:
+                code.patch(at, code.here())
+            code.emit(POP_BLOCK)
+            code.emit(CONST, None)
+
+        case for_loop(Variable(name), e1, condition, updt, body):
+            compile_(e1, code, scope)
+            emit_set(name, code, scope)
+            code.emit(SETUP_LOOP)
+            top = code.here()
+            compile_(condition, code, scope)
+            to_end = code.emit(JUMP_IF_FALSE)
+            breaks, continues = compile_loop_body(body, code, scope)
+            for at in continues:
+                code.patch(at, code.here())
+            compile_(updt, code, scope)
+            emit_store(name, code, scope)
+            code.emit(JUMP, top)
+            for at in breaks + [to_end]:
+                code.patch(at, code.here())
+            code.emit(POP_BLOCK)
+            code.emit(CONST, None)
+
+        case Break():
+            if not code.loops:
+                raise InvalidProgram()
+            code.loops[-1][0].append(code.emit(BREAK))
+
+        case Continue():
+            if not code.loops:
+                raise InvalidProgram()
+            code.loops[-1][1].append(code.emit(CONTINUE))
+
+        case Seq(body):
+            if not body:
+                code.emit(CONST, None)
+            for item in body[:-1]:
+                compile_effect(item, code, scope)
+            if body:
+                compile_(body[-1], code, scope)
+
+        case Print(e1):
+            compile_(e1, code, scope)
+            code.emit(PRINT)
+
+        case LetFun(Variable(name), params, body, expr):
+            # The closure is made in the frame that binds the function's name,
+            # which is then the parent of the frame of every call, so the body
+            # sees the variables around the LetFun, itself included.
+            inner = Scope(scope)
+            index = inner.declare(name)
+            enter = code.emit(ENTER)
+            fscope = Scope(inner)
+            for p in params:
+                fscope.declare(p.name)
+            fcode = Code(name=name)
+            compile_(body, fcode, fscope)
+            fcode.emit(RETURN)
+            fcode.template = fscope.template()
+            mark_tail_calls(fcode)
+            code.emit(CLOSURE, Function(name, [p.name for p in params], fcode))
+            code.emit(STORE_LOCAL, index)
+            compile_(expr, code, inner)
+            code.emit(EXIT)
+            code.patch(enter, inner.template())
+
+        case FunCall(Variable(name), args):
+            emit_load(name, code, scope)
+            for arg in args:
+                compile_(arg, code, scope)
+            code.emit(CALL, len(args))
+
+        case UBoolOp(Variable(name), expr):
+            compile_(expr, code, scope)
+            code.emit(POP)
+            emit_load(name, code, scope)
+            code.emit(UBOOL)
+
+        case _:
+            raise InvalidProgram()
+
+
+def mark_tail_calls(code: Code):
+    # A CALL whose value the function returns as it is, maybe after leaving
+    # some Lets or jumping to the end of an if_else, becomes a TAIL_CALL.
+    instrs = code.instrs
+    for pc, (op, arg) in enumerate(instrs):
+        if op == CALL and returns(instrs, pc + 1):
+            instrs[pc] = (TAIL_CALL, arg)
+
+
+def returns(instrs, pc):
+    while True:
+        op, arg = instrs[pc]
+        if op == RETURN:
+            return True
+        if op == JUMP:
+            pc = arg
+        elif op == EXIT:
+            pc += 1
+        else:
+            return False
+
+
+def compile_loop_body(body, code: Code, scope: Scope):
+    # returns the BREAK and CONTINUE instructions whose targets still need patching
+    code.loops.append(([], []))
+    compile_effect(body, code, scope)
+    return code.loops.pop()
+
+
+def compile_effect(program, code: Code, scope: Scope):
+    # Compile an expression whose value is not used (loop bodies, all but the
+    # last item of a Seq).
+    match program:
+        case Put(Variable(name), e1):
+            compile_(e1, code, scope)
+            emit_store(name, code, scope)
+        case Seq(body) if body:
+            for item in body:
+                compile_effect(item, code, scope)
+        case _:
+            compile_(program, code, scope)
+            code.emit(POP)
+
+
+def run(code: Code, environment: Environment = None):
+    # environment supplies the variables the program uses without binding them
+    if environment is None:
+        environment = Environment()
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    calls = []      # saved (instrs, pc, frame) of the callers
+    blocks = []     # (stack depth, frame) of the loops being run
+    frame = code.template.copy()
+    instrs = code.instrs
+    pc = 0
+
+    while True:
+        op, arg = instrs[pc]
+        pc += 1
+        if op == LOAD_LOCAL:
+            push(frame[arg])
+        elif op == LOAD_OUTER:
+            push(frame[0][arg])
+        elif op == CONST:
+            push(arg)
+        elif op == BINARY:
+            right = pop()
+            stack[-1] = arg(stack[-1], right)
+        elif op == BINARY_CONST:
+            stack[-1] = arg[0](stack[-1], arg[1])
+        elif op == JUMP_IF_FALSE:
+            if pop() != True:
+                pc = arg
+        elif op == JUMP:
+            pc = arg
+        elif op == STORE_LOCAL:
+            frame[arg] = pop()
+        elif op == STORE_OUTER:
+            frame[0][arg] = pop()
+        elif op == DUP:
+            push(stack[-1])
+        elif op == POP:
+            pop()
+        elif op == LOAD_SLOT:
+            hops, index, name = arg
+            f = frame
+            for _ in range(hops):
+                f = f[0]
+            value = f[index]
+            if value is unbound:
+                found = lookup_name(frame, name)
+                value = environment.get(name) if found is None else found[0][found[1]]
+            push(value)
+        elif op == STORE_SLOT:
+            hops, index, name = arg
+            f = frame
+            for _ in range(hops):
+                f = f[0]
+            if f[index] is unbound:
+                found = lookup_name(frame, name)
+                if found is None:
+                    environment.update(name, pop())
+                else:
+                    found[0][found[1]] = pop()
+            else:
+                f[index] = pop()
+        elif op == LOAD_NAME:
+            found = lookup_name(frame, arg)
+            if found is None:
+                push(environment.get(arg))
+            else:
+                push(found[0][found[1]])
+        elif op == STORE_NAME:
+            found = lookup_name(frame, arg)
+            if found is None:
+                environment.update(arg, pop())
+            else:
+                found[0][found[1]] = pop()
+        elif op == BIND:
+            index, name = arg
+            if index is not None and frame[index] is not unbound:
+                frame[index] = pop()
+            else:
+                found = lookup_name(frame, name)
+                if found is not None:
+                    found[0][found[1]] = pop()
+                elif environment.check(name):
+                    environment.update(name, pop())
+                elif index is None:
+                    environment.add(name, pop())
+                else:
+                    frame[index] = pop()
+        elif op == DEFINE_LOCAL:
+            assert frame[arg] is unbound
+            frame[arg] = pop()
+        elif op == ENTER:
+            new = arg.copy()
+            new[0] = frame
+            frame = new
+        elif op == EXIT:
+            frame = frame[0]
+        elif op == CONCAT:
+            right = pop()
+            stack[-1] = concat(stack[-1], right)
+        elif op == SLICE:
+            end = pop()
+            start = pop()
+            stack[-1] = slice_string(stack[-1], start, end)
+        elif op == PRINT:
+            print(stack[-1])
+        elif op == CALL or op == TAIL_CALL:
+            closure = stack[-arg - 1]
+            if type(closure) is not Closure or len(closure.function.params) != arg:
+                raise InvalidProgram()
+            fcode = closure.function.code
+            new = fcode.template.copy()
+            new[0] = closure.frame
+            new[FRAME_HEADER:FRAME_HEADER + arg] = stack[len(stack) - arg:]
+            del stack[len(stack) - arg - 1:]
+            if op == CALL:
+                calls.append((instrs, pc, frame))
+            frame = new
+            instrs = fcode.instrs
+            pc = 0
+        elif op == RETURN:
+            instrs, pc, frame = calls.pop()
+        elif op == CLOSURE:
+            push(Closure(arg, frame))
+        elif op == UBOOL:
+            value = stack[-1]
+            if is_string(value):
+                stack[-1] = value != ""
+            else:
+                stack[-1] = value != 0
+        elif op == SETUP_LOOP:
+            blocks.append((len(stack), frame))
+        elif op == POP_BLOCK:
+            blocks.pop()
+        elif op == BREAK or op == CONTINUE:
+            # the loop may be left from the middle of an expression or a Let
+            depth, frame = blocks[-1]
+            del stack[depth:]
+            pc = arg
+        elif op == HALT:
+            return pop()
+        else:
+            raise InvalidProgram()
+
+
+def vm_eval(program, environment: Environment = None):
+    return as_str(run(compile_program(program), environment))
+
+
+def counting_loop(n):
+    # sum of 2*a for a in 0..n-1, the shape of the loops our scripts spend their time in
+    a = Variable("a")
+    s = Variable("s")
+    body = Seq([Put(s, BinOp("+", Get(s), BinOp("*", NumLiteral(2), Get(a)))),
+                Put(a, BinOp("+", Get(a), NumLiteral(1)))])
+    return LetMut(a, NumLiteral(0), LetMut(s, NumLiteral(0),
+                  Seq([while_loop(BinOp("<", Get(a), NumLiteral(n)), body), Get(s)])))
+
+
+def bench_loop(n=1000, repeat=5):
+    program = counting_loop(n)
+    code = compile_program(program)
+    t_eval = min(timeit_(lambda: eval(program)) for _ in range(repeat))
+    t_vm = min(timeit_(lambda: run(code)) for _ in range(repeat))
+    return t_eval, t_vm, t_eval / t_vm
+
+
+def timeit_(f):
+    start = time.perf_counter()
+    f()
+    return time.perf_counter() - start
+
+
+def test_vm_matches_eval():
+    for program, expected in example_programs():
+        assert vm_eval(program) == eval(program) == expected
+
+def test_vm_loop():
+    assert vm_eval(counting_loop(10)) == 90
+    assert vm_eval(counting_loop(10)) == eval(counting_loop(10))
+
+def test_vm_string_slicing():
+    expr = Str_slicing(StringLiteral("abcdefg"), NumLiteral(0), NumLiteral(4))
+    assert vm_eval(expr) == 'abcd'
+    # a long chain of concatenations compiles without recursion, as eval runs it
+    chain = StringLiteral("")
+    for k in range(5000):
+        chain = Two_Str_concatenation(chain, StringLiteral("ab"))
+    assert vm_eval(chain) == "ab" * 5000
+
+def test_vm_Letfun():
+    a=Variable('a')
+    b=Variable('b')
+    f=Variable('f')
+    e=LetFun(f,[a,b],BinOp("+",a,b),FunCall(f,[NumLiteral(15),NumLiteral(2)]))
+    assert vm_eval(e)==17
+
+def test_vm_invalid_program():
+    import pytest
+    with pytest.raises(InvalidProgram):
+        compile_program(BinOp("%", NumLiteral(1), NumLiteral(2)))
+    with pytest.raises(InvalidProgram):
+        compile_program(Seq([Break()]))
+
+def test_vm_nested_lets():
+    # every Let is a frame; the innermost body reaches all the way out
+    names = [Variable(f"v{k}") for k in range(60)]
+    body = names[0]
+    for v in names[1:]:
+        body = BinOp("+", body, v)
+    program = body
+    for k, v in reversed(list(enumerate(names))):
+        program = Let(v, NumLiteral(k), program)
+    assert vm_eval(program) == eval(program) == sum(range(60))
+
+def test_vm_free_names():
+    # a function body sees the variables around its LetFun, not those of its
+    # caller, and the program sees the environment it is run in
+    a=Variable('a')
+    x=Variable('x')
+    f=Variable('f')
+    e=Let(a,NumLiteral(1),LetFun(f,[x],BinOp("+",x,a),Let(a,NumLiteral(5),FunCall(f,[NumLiteral(1)]))))
+    assert vm_eval(e)==2
+    env=Environment()
+    env.add("a",10)
+    assert vm_eval(Put(a,BinOp("+",a,NumLiteral(1))),env)==11
+    assert env.get("a")==11
+    # a for_loop or LetAnd updates a variable of the environment, and binds
+    # one where eval would when there is none
+    zz=Variable('zz')
+    q=Variable('q')
+    loop=for_loop(zz,NumLiteral(0),BinOp("<",zz,NumLiteral(3)),Put(zz,BinOp("+",zz,NumLiteral(1))),NumLiteral(0))
+    for e in (loop,Seq([loop,zz]),Let(q,NumLiteral(1),Seq([loop,zz])),
+              LetAnd(zz,NumLiteral(5),q,NumLiteral(6),BinOp("+",zz,q)),
+              LetFun(f,[q],Seq([loop,BinOp("+",zz,q)]),FunCall(f,[NumLiteral(1)]))):
+        for bound in (False,True):
+            env1,env2=Environment(),Environment()
+            if bound:
+                env1.add("zz",100)
+                env2.add("zz",100)
+            assert vm_eval(e,env1)==eval(e,env2)
+            assert env1.env==env2.env
+
+def test_vm_deep_recursion():
+    # calls live on the VM's own call stack, and tail calls do not even use that
+    n=Variable('n')
+    acc=Variable('acc')
+    f=Variable('f')
+    sum_to=if_else(BinOp("<",n,NumLiteral(1)),NumLiteral(0),BinOp("+",n,FunCall(f,[BinOp("-",n,NumLiteral(1))])))
+    assert vm_eval(LetFun(f,[n],sum_to,FunCall(f,[NumLiteral(100000)])))==5000050000
+    loop=if_else(BinOp("<",n,NumLiteral(1)),acc,Let(n,BinOp("-",n,NumLiteral(1)),FunCall(f,[n,BinOp("+",acc,NumLiteral(2))])))
+    code=compile_program(LetFun(f,[n,acc],loop,FunCall(f,[NumLiteral(100000),NumLiteral(0)])))
+    fn=next(arg for op, arg in code.instrs if op == CLOSURE)
+    assert TAIL_CALL in [op for op, arg in fn.code.instrs]
+    assert run(code)==200000
+
+def test_vm_long_loop():
+    assert vm_eval(counting_loop(100000)) == 9999900000
+
+
+# print(bench_loop()) # Uncomment to compare eval and the VM on a loop.
+print("test_vm_matches_eval(): ", test_vm_matches_eval())
+print("test_vm_loop(): ", test_vm_loop())
+print("test_vm_string_slicing(): ", test_vm_string_slicing())
+print("test_vm_Letfun(): ", test_vm_Letfun())